@@ -1,11 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
 from uuid import UUID
 import numpy as np
 import base64
+import json
 
 from app.db.base import get_db
 from app.models.user import User
@@ -14,6 +15,15 @@ from app.models.upload import Upload
 from app.api.auth import get_current_user
 from app.services.gemini_service import gemini_service
 from app.services.voice_service import voice_service
+from app.services.embedding_service import embedding_service
+from app.services.conversation_store import conversation_store, format_history, new_session_id
+from app.services.prompt_cache import prompt_cache
+from app.services.audio_store import audio_store
+from app.services.tts_job_service import tts_job_service, TTSQueueFullError, InvalidCallbackURLError
+from app.core.config import settings
+from app.services.speech_pipeline import iter_sentences, pipeline_speech
+from app.services.rate_limiter import ProviderUnavailableError
+from app.services.request_coalescer import request_coalescer, IdempotencyKeyReusedError
 
 router = APIRouter()
 
@@ -25,16 +35,34 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     return float(np.dot(vec1_np, vec2_np) / (np.linalg.norm(vec1_np) * np.linalg.norm(vec2_np)))
 
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header names this (strong or weak) ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.replace("W/", "", 1).strip('"') == etag for tag in candidates)
+
+
+def audio_headers(etag: str) -> dict:
+    # Audio for a given id never changes, so clients may keep it indefinitely
+    return {
+        "ETag": f'"{etag}"',
+        "Cache-Control": "private, max-age=31536000, immutable"
+    }
+
+
 # Pydantic schemas
 class ChatRequest(BaseModel):
     message: str
     course_id: str
     upload_id: Optional[str] = None  # Optional: specific upload context
+    session_id: Optional[str] = None  # Continue a conversation (a new one is started if omitted)
 
 
 class ChatResponse(BaseModel):
     message: str
     response: str
+    session_id: str
 
 
 class SearchRequest(BaseModel):
@@ -55,6 +83,7 @@ class VoiceChatRequest(BaseModel):
     course_id: str
     upload_id: Optional[str] = None
     emotion: Optional[str] = "encouraging"  # neutral, encouraging, excited, patient, serious
+    session_id: Optional[str] = None  # Continue a conversation (a new one is started if omitted)
 
 
 class TextToSpeechRequest(BaseModel):
@@ -62,40 +91,43 @@ class TextToSpeechRequest(BaseModel):
     emotion: Optional[str] = "neutral"
 
 
-@router.post("/chat", response_model=ChatResponse)
-def chat_with_ai(
-    chat_request: ChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Chat with AI tutor - uses course materials as context"""
+class TextToSpeechJobRequest(BaseModel):
+    text: str
+    emotion: Optional[str] = "neutral"
+    callback_url: Optional[str] = None  # POSTed the job JSON when it finishes
+
+
+class TextToSpeechJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued, running, completed, failed
+    audio_url: Optional[str] = None  # Set once completed
+    error: Optional[str] = None
+    created_at: str
+    completed_at: Optional[str] = None
+
+
+def tts_job_response(job: dict) -> TextToSpeechJobResponse:
+    """API view of a text-to-speech job"""
+    return TextToSpeechJobResponse(
+        job_id=job["id"],
+        status=job["status"],
+        audio_url=f"{settings.API_V1_STR}/ai/audio/{job['audio_id']}" if job["status"] == "completed" else None,
+        error=job["error"],
+        created_at=job["created_at"],
+        completed_at=job["completed_at"]
+    )
 
-    # Verify course belongs to user
-    course_id = UUID(chat_request.course_id)
-    course = db.query(Course).filter(
-        Course.id == course_id,
-        Course.user_id == current_user.id
-    ).first()
 
-    if not course:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Course not found"
-        )
-
-    # Build context using semantic search with embeddings
+def build_chat_context(message: str, course_id: UUID, upload_id: Optional[str], db: Session) -> str:
+    """Build tutor context from the most relevant course material (semantic search with embeddings)"""
     context = ""
 
     try:
-        # Generate embedding for the user's question
-        question_embedding = gemini_service.semantic_search_query(chat_request.message)
-
         # Get uploads to search
-        if chat_request.upload_id:
+        if upload_id:
             # Search in specific upload
-            upload_id = UUID(chat_request.upload_id)
             uploads = db.query(Upload).filter(
-                Upload.id == upload_id,
+                Upload.id == UUID(upload_id),
                 Upload.course_id == course_id,
                 Upload.status == 'ready'
             ).all()
@@ -106,6 +138,21 @@ def chat_with_ai(
                 Upload.status == 'ready'
             ).all()
 
+        # Embed the question once per model the chunks were stored with, so uploads
+        # ingested under another EMBEDDING_BACKEND are still searchable
+        models = {
+            embedding_service.chunk_model(chunk_data)
+            for upload in uploads for chunk_data in (upload.embeddings or [])
+        }
+        question_embeddings = {}
+        for model in models:
+            try:
+                question_embeddings[model] = embedding_service.embed_query(message, model)[1]
+            except Exception as e:
+                print(f"Error embedding question for {model} chunks: {str(e)}")
+        if models and not question_embeddings:
+            raise Exception("Could not embed the question for any stored embedding model")
+
         # Find most relevant chunks using cosine similarity
         relevant_chunks = []
 
@@ -114,8 +161,9 @@ def chat_with_ai(
                 for chunk_data in upload.embeddings:
                     chunk_text = chunk_data.get('chunk', '')
                     chunk_embedding = chunk_data.get('embedding', [])
+                    question_embedding = question_embeddings.get(embedding_service.chunk_model(chunk_data))
 
-                    if chunk_embedding:
+                    if chunk_embedding and question_embedding is not None:
                         similarity = cosine_similarity(question_embedding, chunk_embedding)
                         relevant_chunks.append({
                             'text': chunk_text,
@@ -143,10 +191,9 @@ def chat_with_ai(
     except Exception as e:
         print(f"Error in semantic search: {str(e)}")
         # Fallback: Use full text content when embeddings fail (e.g., quota exceeded)
-        if chat_request.upload_id:
-            upload_id = UUID(chat_request.upload_id)
+        if upload_id:
             uploads = db.query(Upload).filter(
-                Upload.id == upload_id,
+                Upload.id == UUID(upload_id),
                 Upload.course_id == course_id,
                 Upload.status == 'ready'
             ).all()
@@ -163,21 +210,74 @@ def chat_with_ai(
                     context += f"=== {upload.file_name} ===\n\n"
                     context += upload.text_content[:3000] + "\n\n"  # First 3000 chars per file
 
+    return context
+
+
+def pinned_course_material(upload_id: Optional[str], course_id: UUID, db: Session) -> str:
+    """
+    Text of the upload a chat is about, pinned in the prompt prefix
+    Only when the provider caches prefixes - otherwise it would be resent every turn.
+    """
+    if not upload_id or not prompt_cache.enabled:
+        return ""
+    upload = db.query(Upload).filter(
+        Upload.id == UUID(upload_id),
+        Upload.course_id == course_id,
+        Upload.status == 'ready'
+    ).first()
+    if not upload or not upload.text_content:
+        return ""
+    return upload.text_content[:settings.PROMPT_CACHE_PINNED_CHARS]
+
+
+@router.post("/chat", response_model=ChatResponse)
+def chat_with_ai(
+    chat_request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Chat with AI tutor - uses course materials as context"""
+
+    # Verify course belongs to user
+    course_id = UUID(chat_request.course_id)
+    course = db.query(Course).filter(
+        Course.id == course_id,
+        Course.user_id == current_user.id
+    ).first()
+
+    if not course:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Course not found"
+        )
+
+    context = build_chat_context(chat_request.message, course_id, chat_request.upload_id, db)
+    session_id = chat_request.session_id or new_session_id()
+    history = format_history(conversation_store.load(db, current_user.id, course_id, session_id))
+    pinned = pinned_course_material(chat_request.upload_id, course_id, db)
+
     # Chat with Gemini
     try:
         response = gemini_service.chat(
             message=chat_request.message,
-            context=context
+            context=context,
+            history=history,
+            pinned=pinned
         )
+    except ProviderUnavailableError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error chatting with AI: {str(e)}"
         )
 
+    conversation_store.record_turn(current_user.id, course_id, session_id, chat_request.message, response)
+
     return ChatResponse(
         message=chat_request.message,
-        response=response
+        response=response,
+        session_id=session_id
     )
 
 
@@ -267,14 +367,6 @@ def voice_chat(
     4. Returns both text and audio
     """
 
-    # First, get text response using existing chat logic
-    text_request = ChatRequest(
-        message=chat_request.message,
-        course_id=chat_request.course_id,
-        upload_id=chat_request.upload_id
-    )
-
-    # Reuse chat logic (inline to avoid code duplication)
     course_id = UUID(chat_request.course_id)
     course = db.query(Course).filter(
         Course.id == course_id,
@@ -287,82 +379,30 @@ def voice_chat(
             detail="Course not found"
         )
 
-    # Build context using semantic search
-    context = ""
-    try:
-        question_embedding = gemini_service.semantic_search_query(chat_request.message)
-
-        if chat_request.upload_id:
-            upload_id = UUID(chat_request.upload_id)
-            uploads = db.query(Upload).filter(
-                Upload.id == upload_id,
-                Upload.course_id == course_id,
-                Upload.status == 'ready'
-            ).all()
-        else:
-            uploads = db.query(Upload).filter(
-                Upload.course_id == course_id,
-                Upload.status == 'ready'
-            ).all()
-
-        relevant_chunks = []
-        for upload in uploads:
-            if upload.embeddings:
-                for chunk_data in upload.embeddings:
-                    chunk_text = chunk_data.get('chunk', '')
-                    chunk_embedding = chunk_data.get('embedding', [])
-                    if chunk_embedding:
-                        similarity = cosine_similarity(question_embedding, chunk_embedding)
-                        relevant_chunks.append({
-                            'text': chunk_text,
-                            'similarity': similarity,
-                            'file_name': upload.file_name
-                        })
-
-        relevant_chunks.sort(key=lambda x: x['similarity'], reverse=True)
-        top_chunks = relevant_chunks[:5]
-
-        if top_chunks:
-            context = "Relevant context from course materials:\n\n"
-            for i, chunk in enumerate(top_chunks, 1):
-                context += f"[{i}] From {chunk['file_name']} (relevance: {chunk['similarity']:.2f}):\n"
-                context += f"{chunk['text']}\n\n"
-    except Exception as e:
-        print(f"Error in semantic search: {str(e)}")
-        # Fallback: Use full text content when embeddings fail
-        if chat_request.upload_id:
-            upload_id = UUID(chat_request.upload_id)
-            uploads = db.query(Upload).filter(
-                Upload.id == upload_id,
-                Upload.course_id == course_id,
-                Upload.status == 'ready'
-            ).all()
-        else:
-            uploads = db.query(Upload).filter(
-                Upload.course_id == course_id,
-                Upload.status == 'ready'
-            ).all()
-
-        if uploads:
-            context = "Context from course materials:\n\n"
-            for upload in uploads[:2]:  # Limit to 2 files to avoid token limits
-                if upload.text_content:
-                    context += f"=== {upload.file_name} ===\n\n"
-                    context += upload.text_content[:3000] + "\n\n"  # First 3000 chars per file
+    context = build_chat_context(chat_request.message, course_id, chat_request.upload_id, db)
+    session_id = chat_request.session_id or new_session_id()
+    history = format_history(conversation_store.load(db, current_user.id, course_id, session_id))
+    pinned = pinned_course_material(chat_request.upload_id, course_id, db)
 
     # Get AI response with emotion
     try:
         response_text = gemini_service.chat(
             message=chat_request.message,
             context=context,
-            emotion=chat_request.emotion
+            emotion=chat_request.emotion,
+            history=history,
+            pinned=pinned
         )
+    except ProviderUnavailableError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error chatting with AI: {str(e)}"
         )
 
+    conversation_store.record_turn(current_user.id, course_id, session_id, chat_request.message, response_text)
+
     # Convert to speech with emotion
     try:
         emotion_settings = voice_service.get_emotional_voice_settings(chat_request.emotion)
@@ -379,9 +419,12 @@ def voice_chat(
             media_type="audio/mpeg",
             headers={
                 "X-Response-Text": response_text_b64,  # Base64 encoded to avoid header issues
-                "X-Emotion": chat_request.emotion
+                "X-Emotion": chat_request.emotion,
+                "X-Session-Id": session_id
             }
         )
+    except ProviderUnavailableError:
+        raise
     except Exception as e:
         # If voice fails, return text response as fallback
         raise HTTPException(
@@ -390,28 +433,194 @@ def voice_chat(
         )
 
 
+@router.post("/voice-chat/stream")
+def voice_chat_stream(
+    chat_request: VoiceChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Streaming voice chat, as newline-delimited JSON
+
+    The Gemini answer is streamed and split into sentences; each sentence is sent
+    to 11 Labs as soon as it is complete, while later sentences are still being
+    generated, and its audio is streamed back in order. Playback can start after
+    the first sentence instead of after the whole answer and the whole MP3.
+
+    Each line is one event:
+        {"type": "sentence", "index": 0, "text": "...", "audio": "<base64 mp3>"}
+        {"type": "done", "text": "full response", "emotion": "...", "session_id": "..."}
+        {"type": "error", "detail": "..."}
+    """
+
+    course_id = UUID(chat_request.course_id)
+    course = db.query(Course).filter(
+        Course.id == course_id,
+        Course.user_id == current_user.id
+    ).first()
+
+    if not course:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Course not found"
+        )
+
+    context = build_chat_context(chat_request.message, course_id, chat_request.upload_id, db)
+    emotion_settings = voice_service.get_emotional_voice_settings(chat_request.emotion)
+    session_id = chat_request.session_id or new_session_id()
+    history = format_history(conversation_store.load(db, current_user.id, course_id, session_id))
+    pinned = pinned_course_material(chat_request.upload_id, course_id, db)
+
+    def events():
+        sentences = []
+        try:
+            text_stream = gemini_service.chat_stream(
+                message=chat_request.message,
+                context=context,
+                emotion=chat_request.emotion,
+                history=history,
+                pinned=pinned
+            )
+            for index, (sentence, audio_bytes) in enumerate(pipeline_speech(
+                iter_sentences(text_stream),
+                lambda text: voice_service.text_to_speech(text=text, **emotion_settings)
+            )):
+                sentences.append(sentence)
+                yield json.dumps({
+                    "type": "sentence",
+                    "index": index,
+                    "text": sentence,
+                    "audio": base64.b64encode(audio_bytes).decode('utf-8')
+                }) + "\n"
+        except Exception as e:
+            print(f"Error streaming voice chat: {str(e)}")
+            yield json.dumps({"type": "error", "detail": f"Error generating voice: {str(e)}"}) + "\n"
+            return
+
+        conversation_store.record_turn(current_user.id, course_id, session_id, chat_request.message, " ".join(sentences))
+
+        yield json.dumps({
+            "type": "done",
+            "text": " ".join(sentences),
+            "emotion": chat_request.emotion,
+            "session_id": session_id
+        }) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @router.post("/text-to-speech")
 def text_to_speech(
     request: TextToSpeechRequest,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Convert any text to speech with emotion
     Useful for reading out quiz results, feedback, etc.
+    Identical concurrent requests share one synthesis, and repeated text is
+    served from the audio cache with an ETag (304 if the client already has it).
     """
     try:
         emotion_settings = voice_service.get_emotional_voice_settings(request.emotion)
-        audio_bytes = voice_service.text_to_speech(
-            text=request.text,
-            **emotion_settings
+        etag = voice_service.speech_key(text=request.text, **emotion_settings)
+        if etag_matches(if_none_match, etag) and audio_store.exists(etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=audio_headers(etag))
+
+        audio_bytes = request_coalescer.run(
+            "ai.text_to_speech",
+            {"text": request.text, "emotion": request.emotion},
+            str(current_user.id),
+            lambda: voice_service.text_to_speech(text=request.text, **emotion_settings),
+            idempotency_key,
+            # The audio is already in the audio store; replays re-read it by key
+            store=lambda audio: etag,
+            load=audio_store.get
         )
 
         return Response(
             content=audio_bytes,
-            media_type="audio/mpeg"
+            media_type="audio/mpeg",
+            headers=audio_headers(etag)
         )
+    except (ProviderUnavailableError, IdempotencyKeyReusedError):
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error generating speech: {str(e)}"
         )
+
+
+@router.post("/text-to-speech/jobs", response_model=TextToSpeechJobResponse, status_code=status.HTTP_202_ACCEPTED)
+def submit_text_to_speech_job(
+    request: TextToSpeechJobRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Queue text-to-speech for long text without holding the connection open
+    Poll GET /ai/text-to-speech/jobs/{job_id} or pass a callback_url; the finished
+    audio is served from /ai/audio/{audio_id}.
+    """
+    try:
+        job = tts_job_service.submit(
+            user_id=str(current_user.id),
+            text=request.text,
+            emotion=request.emotion,
+            callback_url=request.callback_url
+        )
+    except InvalidCallbackURLError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except TTSQueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "5"}
+        )
+
+    return tts_job_response(job)
+
+
+@router.get("/text-to-speech/jobs/{job_id}", response_model=TextToSpeechJobResponse)
+def get_text_to_speech_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Status of a text-to-speech job (with its audio URL once completed)"""
+    job = tts_job_service.get(job_id, str(current_user.id))
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+
+    return tts_job_response(job)
+
+
+@router.get("/audio/{audio_id}")
+def get_audio(
+    audio_id: str,
+    current_user: User = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Serve synthesized audio from the audio store by id (its content hash, also the ETag)"""
+    if etag_matches(if_none_match, audio_id) and audio_store.exists(audio_id):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=audio_headers(audio_id))
+
+    audio_bytes = audio_store.get(audio_id) if len(audio_id) == 64 and audio_id.isalnum() else None
+    if audio_bytes is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Audio not found"
+        )
+
+    return Response(
+        content=audio_bytes,
+        media_type="audio/mpeg",
+        headers=audio_headers(audio_id)
+    )
+
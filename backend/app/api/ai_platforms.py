@@ -6,7 +6,7 @@ For Hackathon Prizes:
 - Snowflake: Play with industry-leading LLMs on a single account
 - DigitalOcean: Gradient AI for building, training, and deploying ML models
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Header
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
@@ -20,6 +20,13 @@ from app.api.auth import get_current_user
 from app.services.snowflake_service import snowflake_service
 from app.services.digitalocean_ai_service import digitalocean_ai_service
 from app.services.gemini_service import gemini_service
+from app.services.rate_limiter import ProviderUnavailableError, provider_guards
+from app.services.prompt_cache import prompt_cache
+from app.services.usage_meter import usage_meter
+from app.services.request_coalescer import request_coalescer
+from app.services import analytics_queries
+from app.services.analytics_rollup_service import top_topics
+from app.services.recommendation_cache import recommendation_cache
 
 router = APIRouter()
 
@@ -108,7 +115,8 @@ def get_ai_capabilities(
 def generate_hybrid_quiz(
     request: HybridQuizRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     🏆 PRIZE SHOWCASE: Generate quiz using BOTH Snowflake and DigitalOcean!
@@ -149,9 +157,33 @@ def generate_hybrid_quiz(
             detail="No uploads found"
         )
 
-    # Combine content
-    combined_content = "\n\n".join([
-        u.text_content[:2000] for u in uploads if u.text_content
+    # Identical concurrent requests share one generation; Idempotency-Key replays it
+    return request_coalescer.run(
+        "ai_platforms.hybrid_quiz",
+        {
+            "course_id": request.course_id,
+            "upload_ids": sorted(request.upload_ids),
+            "num_questions": request.num_questions,
+            "use_digitalocean": request.use_digitalocean,
+            "use_snowflake": request.use_snowflake
+        },
+        str(current_user.id),
+        lambda: build_hybrid_quiz(request, course_id, uploads, db),
+        idempotency_key
+    )
+
+
+def build_hybrid_quiz(
+    request: HybridQuizRequest,
+    course_id: UUID,
+    uploads: List[Upload],
+    db: Session
+) -> HybridQuizResponse:
+    """Generate questions across platforms and save the quiz"""
+
+    # Combine full content - quiz generation segments it instead of truncating
+    combined_content = "".join([
+        f"\n\n--- {u.file_name} ---\n\n{u.text_content}" for u in uploads if u.text_content
     ])
 
     platforms_used = []
@@ -174,13 +206,14 @@ def generate_hybrid_quiz(
     # Fallback to Gemini if DigitalOcean fails
     if not questions:
         try:
-            gemini_quiz = gemini_service.generate_quiz(
-                uploads=uploads,
+            questions = gemini_service.generate_quiz(
+                content=combined_content,
                 num_questions=request.num_questions
             )
-            questions = gemini_quiz.get("questions", [])
             platforms_used.append("Gemini AI (fallback)")
-            generation_details["gemini"] = f"Generated {len(questions)} questions using Gemini 1.5 Pro"
+            generation_details["gemini"] = f"Generated {len(questions)} questions using Gemini 2.0 Flash"
+        except ProviderUnavailableError:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -210,14 +243,17 @@ def generate_hybrid_quiz(
             "question": q.get("question", ""),
             "options": q.get("options", []),
             "correct": q.get("correct", 0),
-            "explanation": q.get("explanation", "")
+            "explanation": q.get("explanation", ""),
+            "topic": q.get("topic"),
+            "difficulty": q.get("difficulty")
         })
 
     # Create quiz with correct structure
     new_quiz = Quiz(
         course_id=course_id,
         upload_ids=[UUID(uid) for uid in request.upload_ids],
-        questions=formatted_questions  # Store as JSONB array
+        questions=formatted_questions,  # Store as JSONB array
+        num_questions=len(formatted_questions)
     )
 
     db.add(new_quiz)
@@ -260,34 +296,15 @@ def generate_intelligent_study_plan(
             detail="Course not found"
         )
 
-    # Get student performance data
-    from app.models.quiz import Quiz, QuizAttempt
-    quizzes = db.query(Quiz).filter(Quiz.course_id == course_id).all()
-    quiz_ids = [q.id for q in quizzes]
+    # Get student performance data - aggregated in SQL (scores and topics of the last 10 attempts)
+    num_attempts = analytics_queries.attempt_stats(db, current_user.id, course_id)["count"]
+    recent_scores = [
+        attempt["score"] for attempt in analytics_queries.recent_attempts(db, current_user.id, course_id, limit=10)
+    ]
 
-    attempts = db.query(QuizAttempt).filter(
-        QuizAttempt.quiz_id.in_(quiz_ids),
-        QuizAttempt.user_id == current_user.id
-    ).all()
-
-    # Extract weak and strong topics
-    weak_topics = []
-    strong_topics = []
-    recent_scores = []
-
-    for attempt in attempts[:10]:
-        recent_scores.append(attempt.score)
-        if attempt.performance_data:
-            weak_topics.extend(attempt.performance_data.get("weak_topics", []))
-            strong_topics.extend(attempt.performance_data.get("strong_topics", []))
-
-    # Get most common topics
-    from collections import Counter
-    weak_counter = Counter(weak_topics)
-    strong_counter = Counter(strong_topics)
-
-    top_weak = [topic for topic, _ in weak_counter.most_common(5)]
-    top_strong = [topic for topic, _ in strong_counter.most_common(5)]
+    # Most common weak/strong topics
+    top_weak = top_topics(analytics_queries.topic_counts(db, current_user.id, "weak_topics", course_id, last_n=10), 5)
+    top_strong = top_topics(analytics_queries.topic_counts(db, current_user.id, "strong_topics", course_id, last_n=10), 5)
 
     platforms_used = []
     insights = {}
@@ -299,11 +316,17 @@ def generate_intelligent_study_plan(
 
     if snowflake_service.enabled:
         try:
-            snowflake_result = snowflake_service.generate_study_recommendations(
-                weak_topics=top_weak,
-                strong_topics=top_strong,
-                recent_scores=recent_scores,
-                context=f"Course: {course.name}, {len(attempts)} quizzes completed"
+            # Only regenerated when the topics/scores change; a stale plan is served meanwhile
+            inputs = {
+                "weak_topics": top_weak,
+                "strong_topics": top_strong,
+                "recent_scores": recent_scores,
+                "context": f"Course: {course.name}, {num_attempts} quizzes completed"
+            }
+            snowflake_result = recommendation_cache.get(
+                ("course", str(current_user.id), str(course_id)),
+                inputs,
+                lambda: snowflake_service.generate_study_recommendations(**inputs)
             )
             study_plan = snowflake_result.get("study_plan", "")
             recommendations = snowflake_result.get("recommendations", [])
@@ -379,6 +402,10 @@ def get_platform_statistics(
                 ]
             }
         },
+        "rate_limits": {name: guard.snapshot() for name, guard in provider_guards.items()},
+        "connection_pools": {"snowflake": snowflake_service.pool.stats()},
+        "prompt_cache": prompt_cache.stats(),
+        "usage_metering": usage_meter.stats(),
         "architecture": {
             "approach": "Multi-cloud AI platform",
             "benefits": [
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 from uuid import UUID
@@ -9,9 +9,11 @@ from datetime import datetime, timedelta
 from app.db.base import get_db
 from app.models.user import User
 from app.models.course import Course
-from app.models.quiz import Quiz, QuizAttempt
+from app.models.quiz import Quiz
 from app.api.auth import get_current_user
 from app.services.snowflake_service import snowflake_service
+from app.services.study_recommendation_service import study_recommendation_service
+from app.services.analytics_rollup_service import analytics_rollup_service, top_topics
 
 router = APIRouter()
 
@@ -74,38 +76,16 @@ def get_course_analytics(
             detail="Course not found"
         )
 
-    # Get all quizzes for this course
-    quizzes = db.query(Quiz).filter(Quiz.course_id == course_id).all()
-    quiz_ids = [q.id for q in quizzes]
+    total_quizzes = db.query(func.count(Quiz.id)).filter(Quiz.course_id == course_id).scalar()
 
-    if not quiz_ids:
-        return CourseAnalytics(
-            course_id=str(course_id),
-            course_name=course.name,
-            total_quizzes=0,
-            total_attempts=0,
-            average_score=0.0,
-            highest_score=0.0,
-            lowest_score=0.0,
-            recent_attempts=[],
-            weak_topics=[],
-            strong_topics=[],
-            progress_over_time=[]
-        )
-
-    # Get all attempts for this user
-    attempts = db.query(QuizAttempt).filter(
-        and_(
-            QuizAttempt.quiz_id.in_(quiz_ids),
-            QuizAttempt.user_id == current_user.id
-        )
-    ).order_by(QuizAttempt.completed_at.desc()).all()
+    # Running totals maintained on quiz submission - one row however many attempts
+    rollup = analytics_rollup_service.get_course_rollup(db, current_user.id, course_id)
 
-    if not attempts:
+    if not total_quizzes or not rollup or not rollup.attempt_count:
         return CourseAnalytics(
             course_id=str(course_id),
             course_name=course.name,
-            total_quizzes=len(quizzes),
+            total_quizzes=total_quizzes or 0,
             total_attempts=0,
             average_score=0.0,
             highest_score=0.0,
@@ -116,65 +96,42 @@ def get_course_analytics(
             progress_over_time=[]
         )
 
-    # Calculate statistics
-    scores = [a.score for a in attempts]
-    average_score = sum(scores) / len(scores)
-    highest_score = max(scores)
-    lowest_score = min(scores)
-
-    # Aggregate weak and strong topics
-    all_weak_topics = []
-    all_strong_topics = []
-    for attempt in attempts:
-        if attempt.performance_data:
-            all_weak_topics.extend(attempt.performance_data.get('weak_topics', []))
-            all_strong_topics.extend(attempt.performance_data.get('strong_topics', []))
-
-    # Get most common weak/strong topics
-    weak_topics_count = {}
-    for topic in all_weak_topics:
-        weak_topics_count[topic] = weak_topics_count.get(topic, 0) + 1
-    weak_topics = sorted(weak_topics_count.keys(), key=lambda x: weak_topics_count[x], reverse=True)[:5]
-
-    strong_topics_count = {}
-    for topic in all_strong_topics:
-        strong_topics_count[topic] = strong_topics_count.get(topic, 0) + 1
-    strong_topics = sorted(strong_topics_count.keys(), key=lambda x: strong_topics_count[x], reverse=True)[:5]
+    recent = rollup.recent_attempts  # Newest first
 
     # Progress over time (last 10 attempts)
     progress_over_time = [
         {
-            "date": attempt.completed_at.isoformat(),
-            "score": attempt.score
+            "date": attempt["completed_at"],
+            "score": attempt["score"]
         }
-        for attempt in reversed(attempts[:10])
+        for attempt in reversed(recent[:10])
     ]
 
     # Recent attempts
     recent_attempts = [
         QuizAttemptSummary(
-            id=str(attempt.id),
-            quiz_id=str(attempt.quiz_id),
-            score=attempt.score,
-            time_taken_seconds=attempt.time_taken_seconds,
-            completed_at=attempt.completed_at.isoformat(),
-            weak_topics=attempt.performance_data.get('weak_topics', []) if attempt.performance_data else [],
-            strong_topics=attempt.performance_data.get('strong_topics', []) if attempt.performance_data else []
+            id=attempt["id"],
+            quiz_id=attempt["quiz_id"],
+            score=attempt["score"],
+            time_taken_seconds=attempt["time_taken_seconds"],
+            completed_at=attempt["completed_at"],
+            weak_topics=attempt["weak_topics"],
+            strong_topics=attempt["strong_topics"]
         )
-        for attempt in attempts[:5]
+        for attempt in recent[:5]
     ]
 
     return CourseAnalytics(
         course_id=str(course_id),
         course_name=course.name,
-        total_quizzes=len(quizzes),
-        total_attempts=len(attempts),
-        average_score=round(average_score, 2),
-        highest_score=round(highest_score, 2),
-        lowest_score=round(lowest_score, 2),
+        total_quizzes=total_quizzes,
+        total_attempts=rollup.attempt_count,
+        average_score=round(rollup.score_sum / rollup.attempt_count, 2),
+        highest_score=round(rollup.score_max, 2),
+        lowest_score=round(rollup.score_min, 2),
         recent_attempts=recent_attempts,
-        weak_topics=weak_topics,
-        strong_topics=strong_topics,
+        weak_topics=top_topics(rollup.weak_topic_counts, 5),
+        strong_topics=top_topics(rollup.strong_topic_counts, 5),
         progress_over_time=progress_over_time
     )
 
@@ -186,26 +143,10 @@ def get_student_performance(
 ):
     """Get overall student performance across all courses"""
 
-    # Get all user's courses
-    courses = db.query(Course).filter(Course.user_id == current_user.id).all()
-    course_ids = [c.id for c in courses]
-
-    if not course_ids:
-        return StudentPerformance(
-            overall_average=0.0,
-            total_quizzes_taken=0,
-            total_study_time_hours=0.0,
-            weak_areas=[],
-            strong_areas=[],
-            recommended_topics=[],
-            recent_trend="stable"
-        )
-
-    # Get all quizzes for user's courses
-    quizzes = db.query(Quiz).filter(Quiz.course_id.in_(course_ids)).all()
-    quiz_ids = [q.id for q in quizzes]
+    # Running totals maintained on quiz submission - one row however many attempts
+    rollup = analytics_rollup_service.get_user_rollup(db, current_user.id)
 
-    if not quiz_ids:
+    if not rollup.attempt_count:
         return StudentPerformance(
             overall_average=0.0,
             total_quizzes_taken=0,
@@ -216,63 +157,24 @@ def get_student_performance(
             recent_trend="stable"
         )
 
-    # Get all attempts
-    attempts = db.query(QuizAttempt).filter(
-        and_(
-            QuizAttempt.quiz_id.in_(quiz_ids),
-            QuizAttempt.user_id == current_user.id
-        )
-    ).order_by(QuizAttempt.completed_at.desc()).all()
-
-    if not attempts:
-        return StudentPerformance(
-            overall_average=0.0,
-            total_quizzes_taken=0,
-            total_study_time_hours=0.0,
-            weak_areas=[],
-            strong_areas=[],
-            recommended_topics=[],
-            recent_trend="stable"
-        )
-
-    # Calculate statistics
-    scores = [a.score for a in attempts]
-    overall_average = sum(scores) / len(scores)
-    total_study_time_hours = sum([a.time_taken_seconds or 0 for a in attempts]) / 3600
-
-    # Aggregate weak and strong topics
-    all_weak_topics = []
-    all_strong_topics = []
-    for attempt in attempts:
-        if attempt.performance_data:
-            all_weak_topics.extend(attempt.performance_data.get('weak_topics', []))
-            all_strong_topics.extend(attempt.performance_data.get('strong_topics', []))
-
-    # Get most common weak/strong topics
-    weak_topics_count = {}
-    for topic in all_weak_topics:
-        weak_topics_count[topic] = weak_topics_count.get(topic, 0) + 1
-    weak_areas = sorted(weak_topics_count.keys(), key=lambda x: weak_topics_count[x], reverse=True)[:10]
-
-    strong_topics_count = {}
-    for topic in all_strong_topics:
-        strong_topics_count[topic] = strong_topics_count.get(topic, 0) + 1
-    strong_areas = sorted(strong_topics_count.keys(), key=lambda x: strong_topics_count[x], reverse=True)[:10]
+    weak_areas = top_topics(rollup.weak_topic_counts, 10)
+    strong_areas = top_topics(rollup.strong_topic_counts, 10)
 
     # Calculate recent trend (compare last 3 vs previous 3)
+    recent_scores = [attempt["score"] for attempt in rollup.recent_attempts]
     recent_trend = "stable"
-    if len(attempts) >= 6:
-        recent_avg = sum([a.score for a in attempts[:3]]) / 3
-        previous_avg = sum([a.score for a in attempts[3:6]]) / 3
+    if len(recent_scores) >= 6:
+        recent_avg = sum(recent_scores[:3]) / 3
+        previous_avg = sum(recent_scores[3:6]) / 3
         if recent_avg > previous_avg + 5:
             recent_trend = "improving"
         elif recent_avg < previous_avg - 5:
             recent_trend = "declining"
 
     return StudentPerformance(
-        overall_average=round(overall_average, 2),
-        total_quizzes_taken=len(attempts),
-        total_study_time_hours=round(total_study_time_hours, 2),
+        overall_average=round(rollup.score_sum / rollup.attempt_count, 2),
+        total_quizzes_taken=rollup.attempt_count,
+        total_study_time_hours=round(rollup.time_taken_sum / 3600, 2),
         weak_areas=weak_areas,
         strong_areas=strong_areas,
         recommended_topics=weak_areas[:5],  # Recommend reviewing weak areas
@@ -301,11 +203,10 @@ def get_study_recommendations(
     Falls back to basic algorithm if Snowflake is not configured.
     """
 
-    # Get all user's courses
-    courses = db.query(Course).filter(Course.user_id == current_user.id).all()
-    course_ids = [c.id for c in courses]
+    # Get user's course and quiz counts
+    num_courses = db.query(func.count(Course.id)).filter(Course.user_id == current_user.id).scalar()
 
-    if not course_ids:
+    if not num_courses:
         return StudyRecommendations(
             recommendations=["Start by uploading some course materials!"],
             study_plan="Upload PDFs or videos to get started with personalized learning.",
@@ -314,11 +215,11 @@ def get_study_recommendations(
             powered_by="basic_algorithm"
         )
 
-    # Get all quizzes for user's courses
-    quizzes = db.query(Quiz).filter(Quiz.course_id.in_(course_ids)).all()
-    quiz_ids = [q.id for q in quizzes]
+    num_quizzes = db.query(func.count(Quiz.id)).join(
+        Course, Course.id == Quiz.course_id
+    ).filter(Course.user_id == current_user.id).scalar()
 
-    if not quiz_ids:
+    if not num_quizzes:
         return StudyRecommendations(
             recommendations=["Generate and take quizzes to get personalized recommendations"],
             study_plan="Take quizzes on your course materials to help us understand your strengths and weaknesses.",
@@ -327,15 +228,10 @@ def get_study_recommendations(
             powered_by="basic_algorithm"
         )
 
-    # Get all attempts
-    attempts = db.query(QuizAttempt).filter(
-        and_(
-            QuizAttempt.quiz_id.in_(quiz_ids),
-            QuizAttempt.user_id == current_user.id
-        )
-    ).order_by(QuizAttempt.completed_at.desc()).all()
+    # Running totals maintained on quiz submission - one row however many attempts
+    rollup = analytics_rollup_service.get_user_rollup(db, current_user.id)
 
-    if not attempts:
+    if not rollup.attempt_count:
         return StudyRecommendations(
             recommendations=["Take your first quiz to get started!"],
             study_plan="Complete quizzes to receive personalized study recommendations.",
@@ -344,36 +240,13 @@ def get_study_recommendations(
             powered_by="basic_algorithm"
         )
 
-    # Aggregate weak and strong topics
-    all_weak_topics = []
-    all_strong_topics = []
-    for attempt in attempts:
-        if attempt.performance_data:
-            all_weak_topics.extend(attempt.performance_data.get('weak_topics', []))
-            all_strong_topics.extend(attempt.performance_data.get('strong_topics', []))
-
-    # Get most common weak/strong topics
-    weak_topics_count = {}
-    for topic in all_weak_topics:
-        weak_topics_count[topic] = weak_topics_count.get(topic, 0) + 1
-    weak_areas = sorted(weak_topics_count.keys(), key=lambda x: weak_topics_count[x], reverse=True)[:5]
-
-    strong_topics_count = {}
-    for topic in all_strong_topics:
-        strong_topics_count[topic] = strong_topics_count.get(topic, 0) + 1
-    strong_areas = sorted(strong_topics_count.keys(), key=lambda x: strong_topics_count[x], reverse=True)[:5]
-
-    # Recent scores
-    recent_scores = [attempt.score for attempt in attempts[:10]]
+    inputs = study_recommendation_service.user_inputs(rollup, num_courses)
+    weak_areas = inputs["weak_topics"]
 
     # Use Snowflake Cortex AI to generate recommendations
     try:
-        recommendations_data = snowflake_service.generate_study_recommendations(
-            weak_topics=weak_areas,
-            strong_topics=strong_areas,
-            recent_scores=recent_scores,
-            context=f"Student has taken {len(attempts)} quizzes across {len(courses)} courses"
-        )
+        # Precomputed nightly; otherwise only regenerated when the topics/scores change
+        recommendations_data = study_recommendation_service.get_for_user(db, current_user.id, inputs)
 
         # Determine source
         powered_by = "snowflake_cortex" if snowflake_service.enabled else "basic_algorithm"
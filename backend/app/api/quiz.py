@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, tuple_
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Tuple, Dict
 from uuid import UUID
 from datetime import datetime
+import base64
+import json
 
 from app.db.base import get_db
 from app.models.user import User
@@ -11,10 +15,22 @@ from app.models.course import Course
 from app.models.upload import Upload
 from app.models.quiz import Quiz, QuizAttempt
 from app.api.auth import get_current_user
+from app.api.ai import etag_matches, audio_headers
 from app.services.gemini_service import gemini_service
+from app.services.rate_limiter import ProviderUnavailableError
+from app.services.question_bank_service import question_bank_service
+from app.services.request_coalescer import request_coalescer
+from app.services.quiz_audio_service import quiz_audio_service
+from app.services.quiz_grading import grade_attempt
+from app.services.analytics_rollup_service import analytics_rollup_service
+from app.services.audio_store import audio_store
+from app.core.config import settings
 
 router = APIRouter()
 
+# Page size when a cursor is given without a limit
+HISTORY_PAGE_SIZE = 50
+
 
 # Pydantic schemas
 class QuizQuestionResponse(BaseModel):
@@ -23,11 +39,17 @@ class QuizQuestionResponse(BaseModel):
     options: List[str]
     correct: int
     explanation: str
+    topic: Optional[str] = None
+    difficulty: Optional[str] = None
+    audio_url: Optional[str] = None  # Read-aloud of question + options (pre-synthesized)
+    explanation_audio_url: Optional[str] = None
 
 
 class QuizGenerateRequest(BaseModel):
     upload_ids: List[str]
     num_questions: int = 25
+    difficulty: Optional[str] = None  # easy, medium, hard - only applied to question banks
+    synthesize_audio: Optional[bool] = None  # Pre-synthesize question audio (default QUIZ_AUDIO_PRESYNTHESIS)
 
 
 class QuizResponse(BaseModel):
@@ -58,6 +80,7 @@ class QuestionResult(BaseModel):
     correct_answer: int
     is_correct: bool
     explanation: str
+    topic: Optional[str] = None
 
 
 class QuizResultsResponse(BaseModel):
@@ -67,15 +90,42 @@ class QuizResultsResponse(BaseModel):
     correct_answers: int
     results: List[QuestionResult]
     completed_at: str
+    accuracy_by_topic: Dict[str, float] = {}  # topic -> % correct
+    weak_topics: List[str] = []
+    strong_topics: List[str] = []
 
 
-@router.post("/generate", response_model=QuizResponse, status_code=status.HTTP_201_CREATED)
-def generate_quiz(
-    quiz_request: QuizGenerateRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Generate a quiz from selected uploads"""
+def audio_url(quiz_id, question_id: str, part: str, audio_id: Optional[str]) -> Optional[str]:
+    """URL of a quiz clip (served from the audio store, synthesized on a miss)"""
+    return f"{settings.API_V1_STR}/quiz/{quiz_id}/audio/{question_id}/{part}" if audio_id else None
+
+
+def get_owned_quiz(quiz_id: UUID, current_user: User, db: Session) -> Quiz:
+    """Load a quiz, checking it belongs to one of the user's courses"""
+    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
+
+    if not quiz:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Quiz not found"
+        )
+
+    course = db.query(Course).filter(
+        Course.id == quiz.course_id,
+        Course.user_id == current_user.id
+    ).first()
+
+    if not course:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this quiz"
+        )
+
+    return quiz
+
+
+def get_quiz_uploads(quiz_request: QuizGenerateRequest, current_user: User, db: Session) -> List[Upload]:
+    """Load the selected uploads, checking ownership and that they are processed"""
 
     if not quiz_request.upload_ids:
         raise HTTPException(
@@ -106,8 +156,6 @@ def generate_quiz(
                 detail="You don't have access to one or more uploads"
             )
 
-    # Combine content from all uploads
-    combined_content = ""
     for upload in uploads:
         if upload.status != 'ready':
             raise HTTPException(
@@ -115,6 +163,13 @@ def generate_quiz(
                 detail=f"Upload '{upload.file_name}' is not ready yet"
             )
 
+    return uploads
+
+
+def combine_upload_content(uploads: List[Upload]) -> str:
+    """Combine upload text for live generation, failing if there is none"""
+    combined_content = ""
+    for upload in uploads:
         if upload.text_content:
             combined_content += f"\n\n--- {upload.file_name} ---\n\n"
             combined_content += upload.text_content
@@ -125,32 +180,101 @@ def generate_quiz(
             detail="No content available to generate quiz"
         )
 
-    # Generate quiz using Gemini
-    try:
-        questions = gemini_service.generate_quiz(
-            content=combined_content,
-            num_questions=quiz_request.num_questions
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error generating quiz: {str(e)}"
-        )
+    return combined_content
+
+
+@router.post("/generate", response_model=QuizResponse, status_code=status.HTTP_201_CREATED)
+def generate_quiz(
+    quiz_request: QuizGenerateRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    Generate a quiz from selected uploads
+    Concurrent identical requests (double-clicks, retries) share one generation
+    and return the same quiz; an Idempotency-Key replays the stored quiz.
+    """
+
+    uploads = get_quiz_uploads(quiz_request, current_user, db)
+
+    return request_coalescer.run(
+        "quiz.generate",
+        {
+            "upload_ids": sorted(quiz_request.upload_ids),
+            "num_questions": quiz_request.num_questions,
+            "difficulty": quiz_request.difficulty,
+            "synthesize_audio": quiz_request.synthesize_audio
+        },
+        str(current_user.id),
+        lambda: create_quiz(quiz_request, uploads, background_tasks, db),
+        idempotency_key
+    )
+
+
+def create_quiz(
+    quiz_request: QuizGenerateRequest,
+    uploads: List[Upload],
+    background_tasks: BackgroundTasks,
+    db: Session
+) -> QuizResponse:
+    """Build the questions (bank sample or live generation) and save the quiz"""
+
+    # Sample from the pre-generated question banks (no LLM call), then top up any that run low
+    questions = question_bank_service.sample(
+        db,
+        [upload.id for upload in uploads],
+        quiz_request.num_questions,
+        quiz_request.difficulty
+    )
+    low_banks = question_bank_service.claim_top_ups(db, [upload.id for upload in uploads])
+    if low_banks:
+        background_tasks.add_task(question_bank_service.top_up, low_banks)
+
+    if questions is None:
+        # Banks not built yet or exhausted - generate live from the combined content
+        combined_content = combine_upload_content(uploads)
+
+        # Generate quiz using Gemini
+        try:
+            questions = gemini_service.generate_quiz(
+                content=combined_content,
+                num_questions=quiz_request.num_questions
+            )
+        except ProviderUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error generating quiz: {str(e)}"
+            )
 
     # Get course_id from first upload (they should all be from the same course ideally)
     course_id = uploads[0].course_id
 
+    synthesize_audio = quiz_request.synthesize_audio
+    if synthesize_audio is None:
+        synthesize_audio = settings.QUIZ_AUDIO_PRESYNTHESIS
+
     # Save quiz to database
     new_quiz = Quiz(
         course_id=course_id,
         upload_ids=[upload.id for upload in uploads],
-        questions=questions
+        questions=questions,
+        num_questions=len(questions),
+        audio=quiz_audio_service.build_manifest(questions) if synthesize_audio else None
     )
 
     db.add(new_quiz)
     db.commit()
     db.refresh(new_quiz)
 
+    # Audio ids are content hashes, so URLs are returned now and filled in the background
+    if synthesize_audio:
+        background_tasks.add_task(quiz_audio_service.presynthesize, str(new_quiz.id))
+    audio = new_quiz.audio or {}
+
     return QuizResponse(
         id=str(new_quiz.id),
         course_id=str(new_quiz.course_id),
@@ -161,7 +285,13 @@ def generate_quiz(
                 question=q['question'],
                 options=q['options'],
                 correct=q['correct'],
-                explanation=q['explanation']
+                explanation=q['explanation'],
+                topic=q.get('topic'),
+                difficulty=q.get('difficulty'),
+                audio_url=audio_url(new_quiz.id, q['id'], "question", audio.get(q['id'], {}).get('question')),
+                explanation_audio_url=audio_url(
+                    new_quiz.id, q['id'], "explanation", audio.get(q['id'], {}).get('explanation')
+                )
             )
             for q in questions
         ],
@@ -169,6 +299,132 @@ def generate_quiz(
     )
 
 
+@router.get("/{quiz_id}/audio")
+def get_quiz_audio(
+    quiz_id: UUID,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Per-question audio URLs of a quiz and whether each clip has been synthesized yet"""
+    quiz = get_owned_quiz(quiz_id, current_user, db)
+
+    return {
+        "quiz_id": str(quiz.id),
+        "questions": [
+            {
+                "question_id": question_id,
+                "audio_url": audio_url(quiz.id, question_id, "question", parts.get("question")),
+                "explanation_audio_url": audio_url(quiz.id, question_id, "explanation", parts.get("explanation")),
+                "ready": all(audio_store.exists(audio_id) for audio_id in parts.values())
+            }
+            for question_id, parts in (quiz.audio or {}).items()
+        ]
+    }
+
+
+@router.get("/{quiz_id}/audio/{question_id}/{part}")
+def get_quiz_audio_clip(
+    quiz_id: UUID,
+    question_id: str,
+    part: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Read-aloud audio of a question or its explanation ("question" / "explanation")
+    Served from the audio store; a clip that wasn't pre-synthesized or has been
+    evicted is synthesized now (503 with Retry-After while ElevenLabs is throttled).
+    """
+    quiz = get_owned_quiz(quiz_id, current_user, db)
+
+    audio_id = (quiz.audio or {}).get(question_id, {}).get(part)
+    if not audio_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Audio not found"
+        )
+
+    if etag_matches(if_none_match, audio_id):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=audio_headers(audio_id))
+
+    try:
+        audio_bytes = quiz_audio_service.audio_for(quiz.questions, question_id, part)
+    except ProviderUnavailableError:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error generating speech: {str(e)}"
+        )
+    if audio_bytes is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Audio not found"
+        )
+
+    return Response(
+        content=audio_bytes,
+        media_type="audio/mpeg",
+        headers=audio_headers(audio_id)
+    )
+
+
+@router.post("/generate/stream")
+def generate_quiz_stream(
+    quiz_request: QuizGenerateRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Generate a quiz, streaming questions as newline-delimited JSON
+
+    Each line is one event:
+        {"type": "question", "question": {...}}   - as soon as a question is parsed
+        {"type": "quiz", "quiz_id": "...", ...}   - once the quiz has been saved
+        {"type": "error", "detail": "..."}        - generation failed before any question
+    """
+
+    uploads = get_quiz_uploads(quiz_request, current_user, db)
+    combined_content = combine_upload_content(uploads)
+
+    def events():
+        questions = []
+        try:
+            for question in gemini_service.generate_quiz_stream(
+                content=combined_content,
+                num_questions=quiz_request.num_questions
+            ):
+                questions.append(question)
+                yield json.dumps({"type": "question", "question": question}) + "\n"
+        except Exception as e:
+            # Keep whatever was generated before the failure
+            print(f"Error streaming quiz: {str(e)}")
+            if not questions:
+                yield json.dumps({"type": "error", "detail": f"Error generating quiz: {str(e)}"}) + "\n"
+                return
+
+        new_quiz = Quiz(
+            course_id=uploads[0].course_id,
+            upload_ids=[upload.id for upload in uploads],
+            questions=questions,
+            num_questions=len(questions)
+        )
+        db.add(new_quiz)
+        db.commit()
+        db.refresh(new_quiz)
+
+        yield json.dumps({
+            "type": "quiz",
+            "quiz_id": str(new_quiz.id),
+            "course_id": str(new_quiz.course_id),
+            "num_questions": len(questions),
+            "created_at": new_quiz.created_at.isoformat()
+        }) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @router.post("/{quiz_id}/submit", response_model=QuizResultsResponse)
 def submit_quiz(
     quiz_id: UUID,
@@ -199,54 +455,28 @@ def submit_quiz(
             detail="You don't have access to this quiz"
         )
 
-    # Grade the quiz
-    answers_dict = {ans.question_id: ans.selected_answer for ans in submission.answers}
-    results = []
-    correct_count = 0
-
-    for question in quiz.questions:
-        question_id = question['id']
-        correct_answer = question['correct']
-        selected_answer = answers_dict.get(question_id, -1)
-        is_correct = selected_answer == correct_answer
-
-        if is_correct:
-            correct_count += 1
-
-        results.append(
-            QuestionResult(
-                question_id=question_id,
-                question=question['question'],
-                options=question['options'],
-                selected_answer=selected_answer,
-                correct_answer=correct_answer,
-                is_correct=is_correct,
-                explanation=question['explanation']
-            )
-        )
-
-    total_questions = len(quiz.questions)
-    score = (correct_count / total_questions * 100) if total_questions > 0 else 0
+    # Grade once and persist per-question results and topic accuracy with the attempt
+    answers = [{"question_id": ans.question_id, "selected_answer": ans.selected_answer} for ans in submission.answers]
+    performance_data = grade_attempt(quiz.questions, answers)
 
     # Save quiz attempt
     quiz_attempt = QuizAttempt(
         quiz_id=quiz.id,
         user_id=current_user.id,
-        answers=[{"question_id": ans.question_id, "selected_answer": ans.selected_answer} for ans in submission.answers],
-        score=score
+        answers=answers,
+        score=performance_data["score"],
+        performance_data=performance_data
     )
 
     db.add(quiz_attempt)
+    db.flush()
+    db.refresh(quiz_attempt)
+
+    # Analytics rollups are updated in the same transaction as the attempt
+    analytics_rollup_service.record_attempt(db, quiz_attempt, quiz.course_id)
     db.commit()
 
-    return QuizResultsResponse(
-        quiz_id=str(quiz.id),
-        score=score,
-        total_questions=total_questions,
-        correct_answers=correct_count,
-        results=results,
-        completed_at=quiz_attempt.completed_at.isoformat()
-    )
+    return build_results_response(quiz, quiz_attempt, performance_data)
 
 
 @router.get("/{quiz_id}/results", response_model=QuizResultsResponse)
@@ -278,64 +508,118 @@ def get_quiz_results(
             detail="No quiz attempt found"
         )
 
-    # Reconstruct results
-    answers_dict = {ans['question_id']: ans['selected_answer'] for ans in attempt.answers}
-    results = []
-    correct_count = 0
+    # Attempts graded before results were stored are graded now
+    performance_data = attempt.performance_data
+    if not performance_data or "results" not in performance_data:
+        performance_data = grade_attempt(quiz.questions, attempt.answers)
 
-    for question in quiz.questions:
-        question_id = question['id']
-        correct_answer = question['correct']
-        selected_answer = answers_dict.get(question_id, -1)
-        is_correct = selected_answer == correct_answer
+    return build_results_response(quiz, attempt, performance_data)
 
-        if is_correct:
-            correct_count += 1
 
-        results.append(
-            QuestionResult(
-                question_id=question_id,
-                question=question['question'],
-                options=question['options'],
-                selected_answer=selected_answer,
-                correct_answer=correct_answer,
-                is_correct=is_correct,
-                explanation=question['explanation']
-            )
-        )
+def build_results_response(quiz: Quiz, attempt: QuizAttempt, performance_data: dict) -> QuizResultsResponse:
+    """Results of a graded attempt, with question text and explanations from the quiz"""
+    questions = {question['id']: question for question in quiz.questions}
 
     return QuizResultsResponse(
         quiz_id=str(quiz.id),
         score=attempt.score,
-        total_questions=len(quiz.questions),
-        correct_answers=correct_count,
-        results=results,
-        completed_at=attempt.completed_at.isoformat()
+        total_questions=performance_data["total_questions"],
+        correct_answers=performance_data["correct_answers"],
+        results=[
+            QuestionResult(
+                question_id=result['question_id'],
+                question=questions[result['question_id']]['question'],
+                options=questions[result['question_id']]['options'],
+                selected_answer=result['selected_answer'],
+                correct_answer=result['correct_answer'],
+                is_correct=result['is_correct'],
+                explanation=questions[result['question_id']]['explanation'],
+                topic=result.get('topic')
+            )
+            for result in performance_data["results"]
+        ],
+        completed_at=attempt.completed_at.isoformat(),
+        accuracy_by_topic={
+            topic: counts["accuracy"] for topic, counts in performance_data.get("accuracy_by_topic", {}).items()
+        },
+        weak_topics=performance_data.get("weak_topics", []),
+        strong_topics=performance_data.get("strong_topics", [])
     )
 
 
 @router.get("/history", response_model=List[dict])
 def get_quiz_history(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Maximum number of attempts (paginates)"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all quiz attempts for the current user"""
-
-    attempts = db.query(QuizAttempt).filter(
+    """
+    Get quiz attempts for the current user, newest first
+
+    One joined query selecting only the needed columns, keyset-paginated on
+    (completed_at, id) so every page costs the same however long the history is.
+    When there are more attempts the X-Next-Cursor header holds the next page's cursor.
+    Without limit or cursor the whole history is returned (unpaginated clients).
+    """
+
+    query = db.query(
+        QuizAttempt.id,
+        QuizAttempt.quiz_id,
+        QuizAttempt.score,
+        QuizAttempt.completed_at,
+        Quiz.course_id,
+        func.coalesce(Quiz.num_questions, func.jsonb_array_length(Quiz.questions)).label("total_questions")
+    ).join(
+        Quiz, Quiz.id == QuizAttempt.quiz_id
+    ).filter(
         QuizAttempt.user_id == current_user.id
-    ).order_by(QuizAttempt.completed_at.desc()).all()
-
-    history = []
-    for attempt in attempts:
-        quiz = db.query(Quiz).filter(Quiz.id == attempt.quiz_id).first()
-        if quiz:
-            history.append({
-                "attempt_id": str(attempt.id),
-                "quiz_id": str(quiz.id),
-                "course_id": str(quiz.course_id),
-                "score": attempt.score,
-                "total_questions": len(quiz.questions),
-                "completed_at": attempt.completed_at.isoformat()
-            })
-
-    return history
+    )
+
+    if cursor:
+        completed_at, attempt_id = decode_history_cursor(cursor)
+        query = query.filter(tuple_(QuizAttempt.completed_at, QuizAttempt.id) < tuple_(completed_at, attempt_id))
+
+    query = query.order_by(
+        QuizAttempt.completed_at.desc(),
+        QuizAttempt.id.desc()
+    )
+    if limit is None and cursor is None:
+        rows = query.all()
+    else:
+        limit = limit or HISTORY_PAGE_SIZE
+        rows = query.limit(limit + 1).all()
+
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_history_cursor(rows[-1].completed_at, rows[-1].id)
+
+    return [
+        {
+            "attempt_id": str(row.id),
+            "quiz_id": str(row.quiz_id),
+            "course_id": str(row.course_id),
+            "score": row.score,
+            "total_questions": row.total_questions,
+            "completed_at": row.completed_at.isoformat()
+        }
+        for row in rows
+    ]
+
+
+def encode_history_cursor(completed_at: datetime, attempt_id: UUID) -> str:
+    """Opaque keyset cursor for quiz history"""
+    raw = f"{completed_at.isoformat()}|{attempt_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        completed_at, attempt_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(completed_at), UUID(attempt_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
@@ -15,6 +15,8 @@ from app.models.upload import Upload
 from app.api.auth import get_current_user
 from app.core.config import settings
 from app.services.gemini_service import gemini_service
+from app.services.embedding_service import embedding_service
+from app.services.question_bank_service import question_bank_service
 
 router = APIRouter()
 
@@ -37,6 +39,12 @@ class UploadResponse(BaseModel):
         from_attributes = True
 
 
+def embed_text_chunks(text: str) -> List[dict]:
+    """Chunk text and embed the chunks with the configured embedding backend"""
+    chunks = gemini_service.chunk_text(text, chunk_size=500)
+    return embedding_service.embed_chunks(chunks)
+
+
 def process_upload_background(upload_id: str, file_path: str, file_type: str, db_session):
     """Background task to process uploaded file"""
     try:
@@ -48,21 +56,7 @@ def process_upload_background(upload_id: str, file_path: str, file_type: str, db
             upload.text_content = text
 
             # Generate embeddings for text chunks
-            chunks = gemini_service.chunk_text(text, chunk_size=500)
-            embeddings_data = []
-
-            for chunk in chunks:
-                if chunk.strip():  # Skip empty chunks
-                    try:
-                        embedding = gemini_service.generate_embeddings(chunk)
-                        embeddings_data.append({
-                            "chunk": chunk,
-                            "embedding": embedding
-                        })
-                    except Exception as e:
-                        print(f"Error generating embedding for chunk: {str(e)}")
-
-            upload.embeddings = embeddings_data
+            upload.embeddings = embed_text_chunks(text)
             upload.status = 'ready'
 
         elif file_type == 'video':
@@ -76,27 +70,16 @@ def process_upload_background(upload_id: str, file_path: str, file_type: str, db
 
             # Generate embeddings for transcript chunks
             if upload.text_content:
-                chunks = gemini_service.chunk_text(upload.text_content, chunk_size=500)
-                embeddings_data = []
-
-                for chunk in chunks:
-                    if chunk.strip():
-                        try:
-                            embedding = gemini_service.generate_embeddings(chunk)
-                            embeddings_data.append({
-                                "chunk": chunk,
-                                "embedding": embedding
-                            })
-                        except Exception as e:
-                            print(f"Error generating embedding for chunk: {str(e)}")
-
-                upload.embeddings = embeddings_data
+                upload.embeddings = embed_text_chunks(upload.text_content)
 
             upload.status = 'ready'
 
         upload.processed_at = datetime.utcnow()
         db_session.commit()
 
+        # Pre-generate the upload's question bank so quizzes skip the LLM call
+        question_bank_service.fill_bank(upload_id)
+
     except Exception as e:
         print(f"Error processing upload: {str(e)}")
         upload = db_session.query(Upload).filter(Upload.id == upload_id).first()
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import List, Optional, Dict, Any
+from datetime import datetime, timedelta, timezone
+
+from app.db.base import get_db
+from app.models.user import User
+from app.api.auth import get_current_user
+from app.core.config import settings
+from app.services.usage_meter import usage_meter
+
+router = APIRouter()
+
+
+# Pydantic schemas
+class UsageBudget(BaseModel):
+    tokens_used: int
+    token_budget: Optional[int]
+    characters_used: int
+    character_budget: Optional[int]
+    resets_in_seconds: int
+
+
+class MyUsageResponse(BaseModel):
+    since: str
+    by_provider: List[Dict[str, Any]]
+    budget: UsageBudget
+
+
+class TopConsumersResponse(BaseModel):
+    since: str
+    group_by: str
+    consumers: List[Dict[str, Any]]
+
+
+def require_usage_admin(current_user: User = Depends(get_current_user)) -> User:
+    """Only users listed in USAGE_ADMIN_EMAILS may see everyone's usage"""
+    admins = {email.strip().lower() for email in settings.USAGE_ADMIN_EMAILS.split(",") if email.strip()}
+    if current_user.email.lower() not in admins:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Usage reports are restricted to administrators"
+        )
+    return current_user
+
+
+@router.get("/me", response_model=MyUsageResponse)
+def get_my_usage(
+    days: int = Query(1, ge=1, le=90, description="Window in days"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Your AI usage per provider over the window, and today's spend against your budget"""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    return {
+        "since": since.isoformat(),
+        "by_provider": usage_meter.top_consumers(db, "provider", since, limit=100, user_id=current_user.id),
+        "budget": usage_meter.budget_status(current_user.id)
+    }
+
+
+@router.get("/top", response_model=TopConsumersResponse)
+def get_top_consumers(
+    group_by: str = Query("user", pattern="^(user|endpoint|provider)$", description="user, endpoint or provider"),
+    days: int = Query(7, ge=1, le=90, description="Window in days"),
+    limit: int = Query(20, ge=1, le=200, description="Maximum number of consumers"),
+    provider: Optional[str] = Query(None, description="Only calls to this provider"),
+    admin: User = Depends(require_usage_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Heaviest AI consumers over the window (by tokens, then characters synthesized),
+    with call counts, failures and latency - for capacity planning and quotas
+
+    Events are written in batches, so the last few seconds may not be included yet.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    return {
+        "since": since.isoformat(),
+        "group_by": group_by,
+        "consumers": usage_meter.top_consumers(db, group_by, since, limit=limit, provider=provider)
+    }
@@ -26,6 +26,14 @@ class Settings(BaseSettings):
     SNOWFLAKE_SCHEMA: str = "PUBLIC"
     SNOWFLAKE_WAREHOUSE: str = "COMPUTE_WH"
     SNOWFLAKE_USE_CORTEX: bool = True
+    SNOWFLAKE_POOL_MIN_SIZE: int = 1  # Connections kept open even when idle
+    SNOWFLAKE_POOL_MAX_SIZE: int = 8
+    SNOWFLAKE_POOL_IDLE_TIMEOUT_SECONDS: float = 600.0
+    SNOWFLAKE_POOL_HEALTH_CHECK_SECONDS: float = 60.0  # Ping connections idle longer than this before reuse
+    SNOWFLAKE_POOL_ACQUIRE_TIMEOUT_SECONDS: float = 10.0
+    SNOWFLAKE_QUERY_TIMEOUT_SECONDS: float = 60.0  # Queries still running after this are cancelled
+    SNOWFLAKE_BATCH_TIMEOUT_SECONDS: float = 1800.0  # Deadline for a nightly batch Cortex statement
+    SNOWFLAKE_POLL_INTERVAL_SECONDS: float = 0.25  # First status poll of an async query (then backs off)
 
     # 11 Labs (optional)
     ELEVENLABS_API_KEY: Optional[str] = None
@@ -36,6 +44,103 @@ class Settings(BaseSettings):
     DIGITALOCEAN_API_TOKEN: Optional[str] = None
     DIGITALOCEAN_GRADIENT_ENDPOINT: str = "https://openrouter.ai/api/v1"  # Proxy for demo
     DIGITALOCEAN_USE_GPU: bool = True
+    DIGITALOCEAN_POOL_SIZE: int = 20  # Keep-alive connections to the endpoint
+    DIGITALOCEAN_MAX_RETRIES: int = 2  # Retries of throttled/5xx/failed requests
+    DIGITALOCEAN_RETRY_BACKOFF_SECONDS: float = 0.5  # Jittered, doubled per retry
+    DIGITALOCEAN_DEADLINE_SECONDS: float = 60.0  # Per call, across retries
+    DIGITALOCEAN_EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    DIGITALOCEAN_EMBEDDING_BATCH_SIZE: int = 100  # Texts per embeddings request
+    DIGITALOCEAN_EMBEDDING_CONCURRENCY: int = 4  # Embedding requests in flight per bulk call
+
+    # Embedding backend for upload chunks and chat queries: gemini or digitalocean
+    # Chunks are tagged with their model; switching backends only affects new uploads
+    EMBEDDING_BACKEND: str = "gemini"
+
+    # Provider rate limits and circuit breakers
+    # Tokens are estimated from prompt size; for ElevenLabs they are characters synthesized
+    GEMINI_REQUESTS_PER_MINUTE: int = 60
+    GEMINI_TOKENS_PER_MINUTE: int = 1000000
+    DIGITALOCEAN_REQUESTS_PER_MINUTE: int = 60
+    DIGITALOCEAN_TOKENS_PER_MINUTE: int = 200000
+    SNOWFLAKE_REQUESTS_PER_MINUTE: int = 30
+    SNOWFLAKE_TOKENS_PER_MINUTE: int = 200000
+    ELEVENLABS_REQUESTS_PER_MINUTE: int = 20
+    ELEVENLABS_TOKENS_PER_MINUTE: int = 40000
+    PROVIDER_MAX_WAIT_SECONDS: float = 10.0  # Queue at most this long for capacity, else fail fast
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_BREAKER_RECOVERY_SECONDS: float = 30.0
+
+    # Record/replay transport for AI provider calls: live, record, replay or auto
+    AI_TRANSPORT_MODE: str = "live"
+    AI_TRANSPORT_STORE_DIR: str = "./recordings"
+    AI_TRANSPORT_REPLAY_LATENCY_SCALE: float = 0.0  # 1.0 = replay with the recorded latency
+
+    # Request coalescing / Idempotency-Key replay window
+    IDEMPOTENCY_WINDOW_SECONDS: int = 600
+    IDEMPOTENCY_MAX_ENTRIES: int = 1000
+
+    # Quiz generation (map-reduce over the full content)
+    QUIZ_SEGMENT_CHARS: int = 8000
+    QUIZ_GENERATION_CONCURRENCY: int = 4
+
+    # Video transcript summarization (per-window summaries, then a reduce step)
+    TRANSCRIPT_WINDOW_CHARS: int = 6000
+    TRANSCRIPT_SUMMARY_CACHE_SIZE: int = 2048  # Cached window summaries
+
+    # Synthesized audio cache (content-addressed, LRU-evicted on disk)
+    AUDIO_CACHE_DIR: str = "./audio_cache"
+    AUDIO_CACHE_MAX_MB: int = 500
+
+    # Analytics rollups
+    ANALYTICS_RECENT_ATTEMPTS: int = 10  # Attempts kept in each rollup's recent-attempts ring
+
+    # Study recommendation cache (recomputed when a user's topics/scores change)
+    RECOMMENDATION_CACHE_MAX_ENTRIES: int = 10000
+    RECOMMENDATION_MAX_STALE_SECONDS: int = 86400  # Older plans are regenerated inline, not served stale
+
+    # Nightly recommendation batch (precompute_recommendations.py)
+    RECOMMENDATION_BATCH_ACTIVE_DAYS: int = 7  # Users with an attempt in this window are precomputed
+    RECOMMENDATION_BATCH_SIZE: int = 200  # Students per set-based Cortex statement
+
+    # Asynchronous text-to-speech jobs
+    TTS_JOB_WORKERS: int = 4
+    TTS_JOB_MAX_PENDING: int = 100  # Submissions beyond this get a 503
+    TTS_JOB_TTL_SECONDS: int = 3600  # How long finished jobs can be polled
+    TTS_JOB_CALLBACK_TIMEOUT_SECONDS: float = 5.0
+    TTS_JOB_CALLBACK_HOSTS: str = ""  # Comma-separated allowlist for callback_url hosts; empty = any public host
+
+    # Quiz audio pre-synthesis (question + explanation audio generated after quiz creation)
+    QUIZ_AUDIO_PRESYNTHESIS: bool = False  # Default when the request doesn't say
+    QUIZ_AUDIO_CONCURRENCY: int = 3
+
+    # Tutor chat history (recent exchanges verbatim, older ones in a rolling summary)
+    CHAT_HISTORY_RECENT_TURNS: int = 6  # Student/tutor exchanges kept verbatim
+    CHAT_HISTORY_TURN_MAX_CHARS: int = 2000  # Per stored message
+    CHAT_HISTORY_SUMMARY_WORDS: int = 200
+    CHAT_HISTORY_MAX_UNSUMMARIZED_TURNS: int = 30  # Exchanges stored while summarization is failing
+
+    # Prompt-prefix cache (provider context caching for tutor instructions + pinned material)
+    PROMPT_CACHE_ENABLED: bool = True  # Used only when the Gemini SDK supports context caching
+    PROMPT_CACHE_TTL_SECONDS: int = 3600
+    PROMPT_CACHE_MIN_TOKENS: int = 4096  # Shorter prefixes are sent in full
+    PROMPT_CACHE_PINNED_CHARS: int = 60000  # Upload text pinned in a chat's cached prefix
+
+    # Streaming voice chat (sentences synthesized while the answer is still generating)
+    VOICE_STREAM_TTS_CONCURRENCY: int = 2
+
+    # Per-upload question banks (generated at ingest, sampled at quiz time)
+    QUESTION_BANK_SIZE: int = 50  # Questions generated per upload per fill
+    QUESTION_BANK_LOW_WATERMARK: int = 20  # Top up when fewer fresh questions remain
+    QUESTION_BANK_MAX_SERVES: int = 3  # A question is "fresh" until served this many times
+
+    # Provider usage metering (usage_events table, written in batches) and per-user daily budgets
+    USAGE_METERING_ENABLED: bool = True
+    USAGE_FLUSH_INTERVAL_SECONDS: float = 5.0
+    USAGE_FLUSH_BATCH_SIZE: int = 200  # Flush early once this many events are pending
+    USAGE_MAX_PENDING_EVENTS: int = 10000  # Events beyond this are dropped while the DB is unreachable
+    USAGE_DAILY_TOKEN_BUDGET: int = 0  # Input + output tokens per user per UTC day; 0 = unlimited
+    USAGE_DAILY_CHARACTER_BUDGET: int = 0  # Characters synthesized per user per UTC day; 0 = unlimited
+    USAGE_ADMIN_EMAILS: str = ""  # Comma-separated; these users may query everyone's usage
 
     # File Upload
     MAX_UPLOAD_SIZE_MB: int = 500
@@ -0,0 +1,51 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Statuses worth retrying: throttling and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def pooled_session(pool_size: int = 10, headers: Optional[Dict[str, str]] = None) -> requests.Session:
+    """
+    requests.Session with a keep-alive connection pool of pool_size per host
+    Reusing the session avoids a TCP+TLS handshake per call. Retries are left to
+    the caller so they can go through the provider guards.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base_seconds: float, retry_after: Optional[float] = None, cap: float = 30.0) -> float:
+    """
+    Seconds to wait before retry number attempt + 1
+    Full jitter (uniform up to base * 2^attempt) so concurrent callers don't retry
+    in lockstep; a server-provided Retry-After is honoured as the minimum.
+    """
+    delay = random.uniform(0, min(cap, base_seconds * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
@@ -1,7 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+from uuid import UUID
 from app.core.config import settings
+from app.core.security import decode_access_token
 from app.db.base import Base, engine
+from app.services.rate_limiter import ProviderUnavailableError
+from app.services.request_coalescer import IdempotencyKeyReusedError
+from app.services.usage_meter import usage_meter, UsageBudgetExceededError
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -18,9 +25,66 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Quiz history pagination
 )
 
 
+def usage_attribution(request: Request):
+    """(user_id, "METHOD /route/{template}") that a request's AI provider calls are metered against"""
+    user_id = None
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        payload = decode_access_token(authorization[7:])
+        try:
+            user_id = UUID(payload.get("sub")) if payload else None
+        except (TypeError, ValueError):
+            user_id = None
+
+    # Route templates keep IDs out of the endpoint, so usage groups per endpoint
+    path = request.url.path
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            path = route.path
+            break
+    return user_id, f"{request.method} {path}"
+
+
+@app.middleware("http")
+async def attribute_usage(request: Request, call_next):
+    user_id, endpoint = usage_attribution(request)
+    with usage_meter.attribute(user_id, endpoint):
+        return await call_next(request)
+
+
+@app.exception_handler(ProviderUnavailableError)
+def provider_unavailable_handler(request: Request, exc: ProviderUnavailableError):
+    """Throttled or failing AI provider - tell the client when to retry instead of a 500"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc), "provider": exc.provider},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))}
+    )
+
+
+@app.exception_handler(UsageBudgetExceededError)
+def usage_budget_exceeded_handler(request: Request, exc: UsageBudgetExceededError):
+    """The user's daily AI budget is spent - retry once it resets"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": str(exc), "provider": exc.provider},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))}
+    )
+
+
+@app.exception_handler(IdempotencyKeyReusedError)
+def idempotency_key_reused_handler(request: Request, exc: IdempotencyKeyReusedError):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={"detail": str(exc)}
+    )
+
+
 @app.get("/")
 def read_root():
     return {"message": "CortexIQ API", "version": "1.0.0"}
@@ -32,7 +96,7 @@ def health_check():
 
 
 # Import and include routers
-from app.api import auth, courses, uploads, quiz, ai, analytics, ai_platforms
+from app.api import auth, courses, uploads, quiz, ai, analytics, ai_platforms, usage
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
 app.include_router(courses.router, prefix=f"{settings.API_V1_STR}/courses", tags=["courses"])
 app.include_router(uploads.router, prefix=f"{settings.API_V1_STR}/courses", tags=["uploads"])
@@ -40,3 +104,4 @@ app.include_router(quiz.router, prefix=f"{settings.API_V1_STR}/quiz", tags=["qui
 app.include_router(ai.router, prefix=f"{settings.API_V1_STR}/ai", tags=["ai"])
 app.include_router(analytics.router, prefix=f"{settings.API_V1_STR}/analytics", tags=["analytics"])
 app.include_router(ai_platforms.router, prefix=f"{settings.API_V1_STR}/ai-platforms", tags=["ai-platforms-hackathon-prize"])
+app.include_router(usage.router, prefix=f"{settings.API_V1_STR}/usage", tags=["usage"])
@@ -3,6 +3,11 @@ from app.models.course import Course
 from app.models.upload import Upload
 from app.models.quiz import Quiz, QuizAttempt
 from app.models.session import TimeBlock, StudySession, ConfidenceScore
+from app.models.question_bank import QuestionBankItem
+from app.models.analytics_rollup import CoursePerformanceRollup, UserPerformanceRollup
+from app.models.study_recommendation import StudyRecommendation
+from app.models.chat_conversation import ChatConversation
+from app.models.usage_event import UsageEvent
 
 __all__ = [
     "User",
@@ -13,4 +18,10 @@ __all__ = [
     "TimeBlock",
     "StudySession",
     "ConfidenceScore",
+    "QuestionBankItem",
+    "CoursePerformanceRollup",
+    "UserPerformanceRollup",
+    "StudyRecommendation",
+    "ChatConversation",
+    "UsageEvent",
 ]
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Float
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class CoursePerformanceRollup(Base):
+    """Running quiz statistics for one user in one course, updated on every submission"""
+    __tablename__ = "course_performance_rollups"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    course_id = Column(UUID(as_uuid=True), ForeignKey("courses.id", ondelete="CASCADE"), primary_key=True)
+    attempt_count = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_min = Column(Float, nullable=True)
+    score_max = Column(Float, nullable=True)
+    time_taken_sum = Column(Float, nullable=False, default=0.0)
+    weak_topic_counts = Column(JSONB, nullable=False, default=dict)  # {topic: attempts where it was weak}
+    strong_topic_counts = Column(JSONB, nullable=False, default=dict)
+    recent_attempts = Column(JSONB, nullable=False, default=list)  # Newest first, capped ring
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class UserPerformanceRollup(Base):
+    """Running quiz statistics for one user across all courses"""
+    __tablename__ = "user_performance_rollups"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    attempt_count = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_min = Column(Float, nullable=True)
+    score_max = Column(Float, nullable=True)
+    time_taken_sum = Column(Float, nullable=False, default=0.0)
+    weak_topic_counts = Column(JSONB, nullable=False, default=dict)
+    strong_topic_counts = Column(JSONB, nullable=False, default=dict)
+    recent_attempts = Column(JSONB, nullable=False, default=list)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Integer
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class ChatConversation(Base):
+    """Tutor chat history for one user/course/session: rolling summary + recent turns"""
+    __tablename__ = "chat_conversations"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    course_id = Column(UUID(as_uuid=True), ForeignKey("courses.id", ondelete="CASCADE"), primary_key=True)
+    session_id = Column(String, primary_key=True)  # Chosen by the client, or issued on the first turn
+    summary = Column(Text, nullable=False, default="")  # Older turns, compressed
+    recent_turns = Column(JSONB, nullable=False, default=list)  # [{role, content}], oldest first
+    summarized_turns = Column(Integer, nullable=False, default=0)  # Turns folded into the summary
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+import uuid
+from app.db.base import Base
+
+
+class QuestionBankItem(Base):
+    """Pre-generated question for an upload, sampled into quizzes without an LLM call"""
+    __tablename__ = "question_bank_items"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    upload_id = Column(UUID(as_uuid=True), ForeignKey("uploads.id", ondelete="CASCADE"), nullable=False, index=True)
+    question = Column(JSONB, nullable=False)  # {question, options, correct, explanation}
+    topic = Column(String, nullable=True)
+    difficulty = Column(String, nullable=True)  # 'easy', 'medium', 'hard'
+    times_served = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Relationships
+    upload = relationship("Upload", back_populates="question_bank")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Float
+from sqlalchemy import Column, String, DateTime, ForeignKey, Float, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY
 from sqlalchemy.sql import func
 import uuid
@@ -12,6 +12,8 @@ class Quiz(Base):
     course_id = Column(UUID(as_uuid=True), ForeignKey("courses.id"), nullable=False)
     upload_ids = Column(ARRAY(UUID(as_uuid=True)), nullable=False)
     questions = Column(JSONB, nullable=False)  # [{question, options, correct, explanation}]
+    num_questions = Column(Integer, nullable=True)  # len(questions), so listings needn't load the JSONB
+    audio = Column(JSONB, nullable=True)  # {question_id: {question: audio_id, explanation: audio_id}}
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -24,5 +26,10 @@ class QuizAttempt(Base):
     answers = Column(JSONB, nullable=False)  # [{question_id, selected_answer, confidence}]
     score = Column(Float, nullable=False)
     time_taken_seconds = Column(Float, nullable=True)  # Time taken to complete quiz
-    performance_data = Column(JSONB, nullable=True)  # {weak_topics: [], strong_topics: [], accuracy_by_topic: {}}
+    performance_data = Column(JSONB, nullable=True)  # Graded at submit: {results, accuracy_by_topic, weak_topics, strong_topics, ...}
     completed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Quiz history: keyset pagination per user, newest first
+        Index("idx_quiz_attempts_user_completed", "user_id", "completed_at", "id"),
+    )
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class StudyRecommendation(Base):
+    """Study recommendations precomputed by the nightly batch job"""
+    __tablename__ = "study_recommendations"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    fingerprint = Column(String, nullable=False)  # Of the inputs the plan was generated from
+    data = Column(JSONB, nullable=False)  # {recommendations, study_plan, estimated_hours, priority_topics}
+    generated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -40,3 +40,4 @@ class Upload(Base):
 
     # Relationships
     course = relationship("Course", back_populates="uploads")
+    question_bank = relationship("QuestionBankItem", back_populates="upload", cascade="all, delete-orphan")
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, BigInteger, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class UsageEvent(Base):
+    """One metered AI provider call (append-only, written in batches by usage_meter)"""
+    __tablename__ = "usage_events"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)  # None for background jobs
+    endpoint = Column(String, nullable=True)  # Route template, e.g. "POST /api/v1/ai/chat"
+    provider = Column(String, nullable=False)  # gemini, digitalocean, snowflake or elevenlabs
+    operation = Column(String, nullable=False)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    characters = Column(Integer, nullable=False, default=0)  # Characters synthesized (ElevenLabs)
+    latency_ms = Column(Integer, nullable=False, default=0)
+    outcome = Column(String, nullable=False)  # ok, error, rejected, over_budget or cancelled
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Per-user budgets and top-consumer queries over a time window
+        Index("idx_usage_events_user_created", "user_id", "created_at"),
+        Index("idx_usage_events_created", "created_at"),
+    )
@@ -0,0 +1,120 @@
+"""
+SQL-side analytics aggregation
+Scores are aggregated (count/avg/min/max), recent-attempt series are cut and
+weak/strong topics are unnested from performance_data and counted in Postgres,
+so callers get a handful of small rows instead of materializing every attempt.
+
+Used to (re)build the analytics rollups from history and wherever analytics
+over a window of recent attempts is needed.
+"""
+from typing import List, Dict, Any, Optional
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, Query
+
+from app.models.quiz import Quiz, QuizAttempt
+
+
+def _scoped(query: Query, user_id: UUID, course_id: Optional[UUID]) -> Query:
+    """Restrict a QuizAttempt query to a user (and optionally a course)"""
+    query = query.filter(QuizAttempt.user_id == user_id)
+    if course_id is not None:
+        query = query.join(Quiz, Quiz.id == QuizAttempt.quiz_id).filter(Quiz.course_id == course_id)
+    return query
+
+
+def attempt_stats(db: Session, user_id: UUID, course_id: Optional[UUID] = None) -> Dict[str, Any]:
+    """Attempt count, score sum/avg/min/max and total time taken"""
+    row = _scoped(db.query(
+        func.count(QuizAttempt.id).label("count"),
+        func.coalesce(func.sum(QuizAttempt.score), 0.0).label("score_sum"),
+        func.avg(QuizAttempt.score).label("score_avg"),
+        func.min(QuizAttempt.score).label("score_min"),
+        func.max(QuizAttempt.score).label("score_max"),
+        func.coalesce(func.sum(QuizAttempt.time_taken_seconds), 0.0).label("time_taken_sum")
+    ), user_id, course_id).one()
+
+    return {
+        "count": row.count,
+        "score_sum": float(row.score_sum),
+        "score_avg": float(row.score_avg) if row.score_avg is not None else None,
+        "score_min": row.score_min,
+        "score_max": row.score_max,
+        "time_taken_sum": float(row.time_taken_sum)
+    }
+
+
+def recent_attempts(
+    db: Session,
+    user_id: UUID,
+    course_id: Optional[UUID] = None,
+    limit: int = 10
+) -> List[Dict[str, Any]]:
+    """The last `limit` attempts, newest first, without loading answers or per-question results"""
+    rows = _scoped(db.query(
+        QuizAttempt.id,
+        QuizAttempt.quiz_id,
+        QuizAttempt.score,
+        QuizAttempt.time_taken_seconds,
+        QuizAttempt.completed_at,
+        QuizAttempt.performance_data["weak_topics"].label("weak_topics"),
+        QuizAttempt.performance_data["strong_topics"].label("strong_topics")
+    ), user_id, course_id).order_by(
+        QuizAttempt.completed_at.desc(),
+        QuizAttempt.id.desc()
+    ).limit(limit).all()
+
+    return [
+        {
+            "id": str(row.id),
+            "quiz_id": str(row.quiz_id),
+            "score": row.score,
+            "time_taken_seconds": row.time_taken_seconds,
+            "completed_at": row.completed_at.isoformat(),
+            "weak_topics": row.weak_topics or [],
+            "strong_topics": row.strong_topics or []
+        }
+        for row in rows
+    ]
+
+
+def topic_counts(
+    db: Session,
+    user_id: UUID,
+    kind: str = "weak_topics",
+    course_id: Optional[UUID] = None,
+    last_n: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    How many attempts flagged each topic as weak (kind="weak_topics") or strong
+    Topics are unnested from performance_data and grouped in SQL.
+
+    Args:
+        last_n: Only count the most recent last_n attempts
+    """
+    attempts = _scoped(
+        db.query(QuizAttempt.performance_data.label("performance_data")),
+        user_id,
+        course_id
+    )
+    if last_n:
+        attempts = attempts.order_by(QuizAttempt.completed_at.desc()).limit(last_n)
+    attempts = attempts.subquery()
+
+    topics = db.query(
+        func.jsonb_array_elements_text(attempts.c.performance_data[kind]).label("topic")
+    ).subquery()
+
+    rows = db.query(topics.c.topic, func.count()).group_by(topics.c.topic).all()
+    return {topic: count for topic, count in rows}
+
+
+def attempted_course_ids(db: Session, user_id: UUID) -> List[UUID]:
+    """Courses in which the user has at least one attempt"""
+    rows = db.query(Quiz.course_id).join(
+        QuizAttempt, QuizAttempt.quiz_id == Quiz.id
+    ).filter(
+        QuizAttempt.user_id == user_id
+    ).distinct().all()
+    return [course_id for course_id, in rows]
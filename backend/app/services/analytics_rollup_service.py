@@ -0,0 +1,136 @@
+"""
+Incrementally maintained analytics rollups
+Every quiz submission updates two rows in the same transaction: the user's
+rollup for the quiz's course and the user's overall rollup (attempt count,
+score sum/min/max, study time, weak/strong topic counters and a ring of the
+most recent attempts). Analytics endpoints read those rows instead of
+reloading and re-tallying every attempt, so they cost the same however long
+the history is.
+
+Users whose attempts predate the rollups are rebuilt from their attempts (with
+SQL-side aggregation, see analytics_queries) the first time their rollup is needed.
+"""
+from typing import List, Dict, Any, Optional
+from uuid import UUID
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services import analytics_queries
+from app.models.quiz import QuizAttempt
+from app.models.analytics_rollup import CoursePerformanceRollup, UserPerformanceRollup
+
+
+def top_topics(counts: Dict[str, int], limit: int) -> List[str]:
+    """Most frequently flagged topics first"""
+    return sorted(counts, key=lambda topic: counts[topic], reverse=True)[:limit]
+
+
+class AnalyticsRollupService:
+    def _locked_row(self, db: Session, model, **keys):
+        """Get-or-create a rollup row and lock it for the rest of the transaction"""
+        db.execute(insert(model.__table__).values(**keys).on_conflict_do_nothing())
+        return db.query(model).filter_by(**keys).with_for_update().one()
+
+    def _attempt_entry(self, attempt: QuizAttempt) -> Dict[str, Any]:
+        """What the recent-attempts ring keeps per attempt"""
+        performance_data = attempt.performance_data or {}
+        return {
+            "id": str(attempt.id),
+            "quiz_id": str(attempt.quiz_id),
+            "score": attempt.score,
+            "time_taken_seconds": attempt.time_taken_seconds,
+            "completed_at": attempt.completed_at.isoformat(),
+            "weak_topics": performance_data.get("weak_topics", []),
+            "strong_topics": performance_data.get("strong_topics", [])
+        }
+
+    def _apply(self, rollup, entry: Dict[str, Any]):
+        """Fold one attempt into a rollup (JSONB columns are reassigned so changes are tracked)"""
+        score = entry["score"]
+        rollup.attempt_count = (rollup.attempt_count or 0) + 1
+        rollup.score_sum = (rollup.score_sum or 0.0) + score
+        rollup.score_min = score if rollup.score_min is None else min(rollup.score_min, score)
+        rollup.score_max = score if rollup.score_max is None else max(rollup.score_max, score)
+        rollup.time_taken_sum = (rollup.time_taken_sum or 0.0) + (entry["time_taken_seconds"] or 0)
+
+        weak = dict(rollup.weak_topic_counts or {})
+        for topic in entry["weak_topics"]:
+            weak[topic] = weak.get(topic, 0) + 1
+        rollup.weak_topic_counts = weak
+
+        strong = dict(rollup.strong_topic_counts or {})
+        for topic in entry["strong_topics"]:
+            strong[topic] = strong.get(topic, 0) + 1
+        rollup.strong_topic_counts = strong
+
+        recent = [entry] + list(rollup.recent_attempts or [])
+        rollup.recent_attempts = recent[:settings.ANALYTICS_RECENT_ATTEMPTS]
+
+    def record_attempt(self, db: Session, attempt: QuizAttempt, course_id: UUID):
+        """
+        Fold a new (flushed, not yet committed) attempt into the user's rollups
+        The caller commits, so the attempt and its rollups land atomically.
+        """
+        # Lock order is always user rollup, then course rollup
+        user_rollup = db.query(UserPerformanceRollup).filter_by(
+            user_id=attempt.user_id
+        ).with_for_update().first()
+
+        if user_rollup is None:
+            # First attempt since rollups existed: build from history (includes this attempt)
+            self.rebuild_user(db, attempt.user_id)
+            return
+
+        course_rollup = self._locked_row(db, CoursePerformanceRollup, user_id=attempt.user_id, course_id=course_id)
+        entry = self._attempt_entry(attempt)
+        self._apply(user_rollup, entry)
+        self._apply(course_rollup, entry)
+
+    def rebuild_user(self, db: Session, user_id: UUID):
+        """
+        Recompute all of a user's rollups from their attempts (caller commits)
+        Aggregation happens in SQL, so rebuilding never loads the attempts themselves.
+        """
+        user_rollup = self._locked_row(db, UserPerformanceRollup, user_id=user_id)
+        self._fill(db, user_rollup, user_id)
+
+        db.query(CoursePerformanceRollup).filter_by(user_id=user_id).delete(synchronize_session=False)
+        for course_id in analytics_queries.attempted_course_ids(db, user_id):
+            course_rollup = CoursePerformanceRollup(user_id=user_id, course_id=course_id)
+            self._fill(db, course_rollup, user_id, course_id)
+            db.add(course_rollup)
+        db.flush()
+
+    def _fill(self, db: Session, rollup, user_id: UUID, course_id: Optional[UUID] = None):
+        """Set a rollup's columns from SQL aggregates over the user's attempts"""
+        stats = analytics_queries.attempt_stats(db, user_id, course_id)
+        rollup.attempt_count = stats["count"]
+        rollup.score_sum = stats["score_sum"]
+        rollup.score_min = stats["score_min"]
+        rollup.score_max = stats["score_max"]
+        rollup.time_taken_sum = stats["time_taken_sum"]
+        rollup.weak_topic_counts = analytics_queries.topic_counts(db, user_id, "weak_topics", course_id)
+        rollup.strong_topic_counts = analytics_queries.topic_counts(db, user_id, "strong_topics", course_id)
+        rollup.recent_attempts = analytics_queries.recent_attempts(
+            db, user_id, course_id, limit=settings.ANALYTICS_RECENT_ATTEMPTS
+        )
+
+    def get_user_rollup(self, db: Session, user_id: UUID) -> UserPerformanceRollup:
+        """The user's overall rollup, building it from history on first use"""
+        rollup = db.query(UserPerformanceRollup).filter_by(user_id=user_id).first()
+        if rollup is None:
+            self.rebuild_user(db, user_id)
+            db.commit()
+            rollup = db.query(UserPerformanceRollup).filter_by(user_id=user_id).one()
+        return rollup
+
+    def get_course_rollup(self, db: Session, user_id: UUID, course_id: UUID) -> Optional[CoursePerformanceRollup]:
+        """The user's rollup for a course, or None if they have no attempts there"""
+        self.get_user_rollup(db, user_id)
+        return db.query(CoursePerformanceRollup).filter_by(user_id=user_id, course_id=course_id).first()
+
+
+# Singleton instance
+analytics_rollup_service = AnalyticsRollupService()
@@ -0,0 +1,120 @@
+"""
+Content-addressed store for synthesized audio
+Audio is keyed by sha256 over everything that determines the synthesis (text,
+voice, emotion settings, model), kept on local disk under a size budget and
+evicted least-recently-used first. The key doubles as the HTTP ETag.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+
+def audio_key(params: Dict[str, Any]) -> str:
+    """Content address of a synthesis request"""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class AudioStore:
+    def __init__(self, store_dir: str = "./audio_cache", max_bytes: int = 500 * 1024 * 1024):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self._total_bytes = 0
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.store_dir, key[:2], f"{key}.mp3")
+
+    def _load_index(self):
+        """Rebuild the LRU index from disk, using modification times as recency (bumped on read)"""
+        if not os.path.isdir(self.store_dir):
+            return
+        found = []
+        for root, _, files in os.walk(self.store_dir):
+            for name in files:
+                if not name.endswith(".mp3"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Stored audio for key, or None"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Removed behind our back (or evicted concurrently)
+            with self._lock:
+                size = self._entries.pop(key, 0)
+                self._total_bytes -= size
+            return None
+
+        # Persist recency for the next restart
+        now = time.time()
+        os.utime(path, (now, now))
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store audio under key, evicting least-recently-used entries over budget"""
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write atomically so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+# Singleton instance
+audio_store = AudioStore(
+    store_dir=settings.AUDIO_CACHE_DIR,
+    max_bytes=settings.AUDIO_CACHE_MAX_MB * 1024 * 1024
+)
@@ -0,0 +1,134 @@
+"""
+Tutor chat conversation store
+Each user/course/session keeps its last CHAT_HISTORY_RECENT_TURNS exchanges
+verbatim; older turns are folded into a rolling summary by the LLM in the
+background. Chat prompts therefore carry the summary plus a few recent turns
+instead of the whole transcript, so their size stays bounded however long the
+tutoring session runs.
+"""
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+from uuid import UUID
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.models.chat_conversation import ChatConversation
+from app.services.gemini_service import gemini_service
+from app.services.usage_meter import usage_meter
+
+ROLE_LABELS = {"student": "Student", "tutor": "Tutor"}
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def format_history(conversation: Dict[str, Any]) -> str:
+    """Conversation as prompt text: the summary of earlier turns, then recent turns"""
+    parts = []
+    if conversation["summary"]:
+        parts.append(f"Summary of the earlier conversation: {conversation['summary']}")
+    turns = conversation["turns"][-settings.CHAT_HISTORY_RECENT_TURNS * 2:]
+    if turns:
+        parts.append("\n".join(
+            f"{ROLE_LABELS.get(turn['role'], turn['role'])}: {turn['content']}"
+            for turn in turns
+        ))
+    return "\n\n".join(parts)
+
+
+class ConversationStore:
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-summary")
+        self._lock = threading.Lock()
+        self._compacting = set()  # Conversations with a summary update in flight
+
+    def load(self, db: Session, user_id: UUID, course_id: UUID, session_id: str) -> Dict[str, Any]:
+        """
+        {"summary", "turns"} of a conversation (empty if it doesn't exist yet)
+        Only the last CHAT_HISTORY_RECENT_TURNS exchanges are returned, even while
+        older ones are still waiting to be summarized (e.g. summarization failing).
+        """
+        row = db.query(ChatConversation).filter_by(
+            user_id=user_id, course_id=course_id, session_id=session_id
+        ).first()
+        if row is None:
+            return {"summary": "", "turns": []}
+        turns = list(row.recent_turns or [])[-settings.CHAT_HISTORY_RECENT_TURNS * 2:]
+        return {"summary": row.summary or "", "turns": turns}
+
+    def record_turn(self, user_id: UUID, course_id: UUID, session_id: str, message: str, reply: str):
+        """
+        Append a student message and the tutor's reply
+        Uses its own session so it can run after a streamed response has finished;
+        a failure here is logged rather than failing the chat that was already answered.
+        """
+        max_chars = settings.CHAT_HISTORY_TURN_MAX_CHARS
+        keys = {"user_id": user_id, "course_id": course_id, "session_id": session_id}
+
+        db = SessionLocal()
+        try:
+            db.execute(insert(ChatConversation.__table__).values(**keys).on_conflict_do_nothing())
+            row = db.query(ChatConversation).filter_by(**keys).with_for_update().one()
+            turns = list(row.recent_turns or []) + [
+                {"role": "student", "content": message[:max_chars]},
+                {"role": "tutor", "content": reply[:max_chars]}
+            ]
+            # Bounded even if summarization keeps failing; the oldest unsummarized turns go first
+            turns = turns[-settings.CHAT_HISTORY_MAX_UNSUMMARIZED_TURNS * 2:]
+            row.recent_turns = turns
+            db.commit()
+        except Exception as e:
+            print(f"Error saving chat turn: {str(e)}")
+            return
+        finally:
+            db.close()
+
+        if len(turns) > settings.CHAT_HISTORY_RECENT_TURNS * 2:
+            self._schedule_compaction(keys)
+
+    def _schedule_compaction(self, keys: Dict[str, Any]):
+        scope = (keys["user_id"], keys["course_id"], keys["session_id"])
+        with self._lock:
+            if scope in self._compacting:
+                return
+            self._compacting.add(scope)
+        self._executor.submit(usage_meter.attributed(self._compact), keys, scope)
+
+    def _compact(self, keys: Dict[str, Any], scope: tuple):
+        """Fold the turns beyond the recent window into the rolling summary"""
+        db = SessionLocal()
+        try:
+            row = db.query(ChatConversation).filter_by(**keys).first()
+            turns = list(row.recent_turns or []) if row else []
+            overflow = turns[:max(0, len(turns) - settings.CHAT_HISTORY_RECENT_TURNS * 2)]
+            if not overflow:
+                return
+
+            # Summarize without holding the row lock; new turns may arrive meanwhile
+            summary = gemini_service.summarize_conversation(row.summary or "", overflow)
+            db.rollback()
+
+            row = db.query(ChatConversation).filter_by(**keys).with_for_update().one()
+            current = list(row.recent_turns or [])
+            if current[:len(overflow)] != overflow:
+                return  # Compacted concurrently
+            row.summary = summary
+            row.recent_turns = current[len(overflow):]
+            row.summarized_turns = (row.summarized_turns or 0) + len(overflow)
+            db.commit()
+        except Exception as e:
+            print(f"Error summarizing chat conversation: {str(e)}")
+        finally:
+            db.close()
+            with self._lock:
+                self._compacting.discard(scope)
+
+
+# Singleton instance
+conversation_store = ConversationStore()
@@ -7,10 +7,44 @@ Uses DigitalOcean's GPU infrastructure and serverless inference for:
 - Real-time chat response generation
 """
 import requests
-from typing import List, Dict, Any, Optional
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator
 from app.core.config import settings
+from app.core.cache import TTLCache
+from app.core.http import pooled_session, retry_after_seconds, backoff_delay, RETRYABLE_STATUS
+from app.services.rate_limiter import get_provider_guard, estimate_tokens, ProviderUnavailableError
+from app.services.quiz_generation import (
+    map_reduce_quiz,
+    stream_map_reduce_quiz,
+    split_into_segments,
+    validate_question,
+    validate_questions
+)
+from app.services.json_stream import parse_json_array, iter_json_array
+from app.services.transport import provider_transport, RecordedResponse
+from app.services.usage_meter import usage_meter
 import json
 
+# Bump when the window summary prompt changes so cached partials are recomputed
+WINDOW_SUMMARY_VERSION = 1
+
+# Full OpenRouter model name
+CHAT_MODEL = "meta-llama/llama-3.1-70b-instruct"
+
+# Seconds allowed to establish a connection (the read timeout is the time left in the deadline)
+CONNECT_TIMEOUT_SECONDS = 5.0
+
+
+class RetryableResponseError(Exception):
+    """Throttled (429) or server error (5xx) response from the endpoint"""
+
+    def __init__(self, status_code: int, retry_after: float = None):
+        super().__init__(f"DigitalOcean Gradient AI unavailable: {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
 
 class DigitalOceanAIService:
     def __init__(self):
@@ -24,7 +58,18 @@ class DigitalOceanAIService:
         """
         self.api_token = settings.DIGITALOCEAN_API_TOKEN
         self.gradient_endpoint = settings.DIGITALOCEAN_GRADIENT_ENDPOINT
-        self.enabled = self._check_enabled()
+        # Replayed recordings need no credentials
+        self.enabled = self._check_enabled() or provider_transport.replaying
+        self.guard = get_provider_guard("digitalocean")
+        # One keep-alive session for all calls; headers are built once here
+        self.session = pooled_session(settings.DIGITALOCEAN_POOL_SIZE, {
+            "Authorization": f"Bearer {self.api_token}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "http://localhost:8000",  # Required by OpenRouter
+            "X-Title": "ClassroomAI"  # Optional but recommended
+        })
+        # Partial (per-window) transcript summaries, keyed by window content
+        self._window_summaries = TTLCache(maxsize=settings.TRANSCRIPT_SUMMARY_CACHE_SIZE)
 
     def _check_enabled(self) -> bool:
         """Check if DigitalOcean Gradient AI is configured"""
@@ -34,6 +79,114 @@ class DigitalOceanAIService:
             return False
         return True
 
+    def _send(self, path: str, payload: Dict[str, Any], tokens: int, stream: bool = False) -> requests.Response:
+        """
+        POST on the shared session, retrying throttled/5xx responses and connection
+        errors with jittered backoff (honouring Retry-After) until the call's deadline
+
+        Every attempt goes through the shared rate limiter/circuit breaker, so a
+        struggling endpoint still trips the breaker; once it is open no more
+        retries are made. A streamed response's success is recorded by the caller
+        once the stream has been read (see ProviderGuard.settle_stream).
+        """
+        deadline = time.monotonic() + settings.DIGITALOCEAN_DEADLINE_SECONDS
+        attempt = 0
+        while True:
+            try:
+                with self.guard.slot(tokens=tokens, defer_success=stream):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise requests.Timeout("DigitalOcean Gradient AI deadline exceeded")
+                    response = self.session.post(
+                        f"{self.gradient_endpoint}{path}",
+                        json=payload,
+                        timeout=(min(CONNECT_TIMEOUT_SECONDS, remaining), remaining),
+                        stream=stream
+                    )
+                    if response.status_code in RETRYABLE_STATUS:
+                        response.close()
+                        raise RetryableResponseError(
+                            response.status_code,
+                            retry_after_seconds(response.headers.get("Retry-After"))
+                        )
+                return response
+            except ProviderUnavailableError:
+                raise
+            except (RetryableResponseError, requests.ConnectionError, requests.Timeout) as e:
+                delay = backoff_delay(
+                    attempt,
+                    settings.DIGITALOCEAN_RETRY_BACKOFF_SECONDS,
+                    getattr(e, "retry_after", None)
+                )
+                if attempt >= settings.DIGITALOCEAN_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _post(self, path: str, payload: Dict[str, Any], tokens: int = 1) -> RecordedResponse:
+        """
+        POST to the Gradient/OpenRouter endpoint through the record/replay transport
+        and the shared rate limiter/circuit breaker (see _send for retries)
+        """
+        def send() -> RecordedResponse:
+            response = self._send(path, payload, tokens)
+            body = response.json() if response.status_code == 200 else None
+            return RecordedResponse(response.status_code, body)
+
+        # Headers carry the API token and are deliberately not part of the recording key
+        return provider_transport.call("digitalocean", path, {"payload": payload}, send)
+
+    def _post_stream(self, path: str, payload: Dict[str, Any], tokens: int = 1) -> Iterator[str]:
+        """
+        Streaming chat completion, yielding content deltas from OpenRouter's SSE output
+        Only the request is retried; a stream that fails midway is not restarted.
+        """
+        def send() -> Iterator[str]:
+            response = self._send(path, payload, tokens, stream=True)
+            if response.status_code != 200:
+                response.close()
+                self.guard.breaker.record_success()  # The endpoint answered; the request was rejected
+                raise Exception(f"DigitalOcean Gradient AI error: {response.status_code}")
+
+            def deltas() -> Iterator[str]:
+                try:
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue  # keep-alive comments and blank lines
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        yield chunk.get("choices", [{}])[0].get("delta", {}).get("content") or ""
+                finally:
+                    response.close()
+
+            yield from self.guard.settle_stream(deltas())
+
+        return provider_transport.stream("digitalocean", f"{path}:stream", {"payload": payload}, send)
+
+    def _chat_payload(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """Chat completion request body"""
+        payload = {
+            "model": CHAT_MODEL,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _chat_tokens(self, payload: Dict[str, Any]) -> int:
+        """Rate limiter budget of a chat completion: prompt plus the completion allowance"""
+        return estimate_tokens(json.dumps(payload["messages"])) + payload["max_tokens"]
+
     def generate_quiz_questions(
         self,
         content: str,
@@ -60,80 +213,120 @@ class DigitalOceanAIService:
             return self._generate_fallback_questions(content, num_questions)
 
         try:
-            prompt = f"""
-            You are an expert educator creating quiz questions.
-
-            Content:
-            {content[:4000]}  # Limit for token efficiency
-
-            Generate {num_questions} multiple-choice questions at {difficulty} difficulty level.
-            Each question should have:
-            - A clear question
-            - 4 options (A, B, C, D)
-            - The correct answer index (0-3)
-            - A detailed 2-sentence explanation
-
-            Format as JSON array:
-            [
-                {{
-                    "question": "...",
-                    "options": ["A", "B", "C", "D"],
-                    "correct": 0,
-                    "explanation": "..."
-                }},
-                ...
-            ]
-            """
+            questions = map_reduce_quiz(
+                content,
+                num_questions,
+                lambda segment, count: self._generate_quiz_segment(segment, count, difficulty)
+            )
+            return questions or self._generate_fallback_questions(content, num_questions)
 
-            headers = {
-                "Authorization": f"Bearer {self.api_token}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost:8000",  # Required by OpenRouter
-                "X-Title": "ClassroomAI"  # Optional but recommended
-            }
+        except Exception as e:
+            print(f"Error using DigitalOcean Gradient AI: {str(e)}")
+            return self._generate_fallback_questions(content, num_questions)
 
-            payload = {
-                "model": "meta-llama/llama-3.1-70b-instruct",  # Full OpenRouter model name
-                "messages": [
-                    {"role": "system", "content": "You are an expert educational AI assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 3000
-            }
+    def _quiz_prompt(self, content: str, num_questions: int, difficulty: str) -> str:
+        """Quiz prompt shared by the batch and streaming generators"""
+        return f"""
+        You are an expert educator creating quiz questions.
 
-            # OpenRouter endpoint (already includes /api/v1)
-            response = requests.post(
-                f"{self.gradient_endpoint}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+        Content:
+        {content}
 
-            if response.status_code == 200:
-                result = response.json()
-                content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        Generate {num_questions} multiple-choice questions at {difficulty} difficulty level.
+        Each question should have:
+        - A clear question
+        - 4 options (A, B, C, D)
+        - The correct answer index (0-3)
+        - A detailed 2-sentence explanation
+        - The specific topic it tests (a short name, reused for questions on the same topic)
 
-                # Parse JSON from response
-                try:
-                    questions = json.loads(content)
-                    return questions[:num_questions]
-                except json.JSONDecodeError:
-                    # Fallback if JSON parsing fails
-                    return self._generate_fallback_questions(content, num_questions)
-            else:
-                print(f"DigitalOcean Gradient AI error: {response.status_code}")
-                return self._generate_fallback_questions(content, num_questions)
+        Format as JSON array:
+        [
+            {{
+                "question": "...",
+                "options": ["A", "B", "C", "D"],
+                "correct": 0,
+                "explanation": "...",
+                "topic": "..."
+            }},
+            ...
+        ]
+        """
 
-        except Exception as e:
-            print(f"Error using DigitalOcean Gradient AI: {str(e)}")
-            return self._generate_fallback_questions(content, num_questions)
+    def _quiz_payload(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        messages = [
+            {"role": "system", "content": "You are an expert educational AI assistant."},
+            {"role": "user", "content": prompt}
+        ]
+        return self._chat_payload(messages, temperature=0.7, max_tokens=3000, stream=stream)
+
+    def _generate_quiz_segment(
+        self,
+        content: str,
+        num_questions: int,
+        difficulty: str
+    ) -> List[Dict[str, Any]]:
+        """Generate questions for a single content segment (raises on failure)"""
+        payload = self._quiz_payload(self._quiz_prompt(content, num_questions, difficulty))
+
+        # OpenRouter endpoint (already includes /api/v1)
+        response = self._post("/chat/completions", payload, tokens=self._chat_tokens(payload))
+
+        if response.status_code != 200:
+            raise Exception(f"DigitalOcean Gradient AI error: {response.status_code}")
+
+        result = response.json()
+        text = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+        # Salvage every well-formed question even if part of the output is malformed
+        questions, malformed = parse_json_array(text)
+        if malformed:
+            print(f"Dropped {malformed} malformed quiz question(s) from DigitalOcean output")
+
+        questions = validate_questions(questions)
+        if not questions:
+            raise Exception("No valid quiz questions in DigitalOcean output")
+        return questions[:num_questions]
+
+    def _stream_quiz_segment(
+        self,
+        content: str,
+        num_questions: int,
+        difficulty: str
+    ) -> Iterator[Dict[str, Any]]:
+        """Stream questions for a single content segment from OpenRouter's SSE output"""
+        payload = self._quiz_payload(self._quiz_prompt(content, num_questions, difficulty), stream=True)
+
+        deltas = self._post_stream("/chat/completions", payload, tokens=self._chat_tokens(payload))
+        for question in iter_json_array(deltas):
+            question = validate_question(question)
+            if question:
+                yield question
+
+    def generate_quiz_questions_stream(
+        self,
+        content: str,
+        num_questions: int = 25,
+        difficulty: str = "medium"
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of generate_quiz_questions
+        Yields each validated question as soon as it is parsed from the stream.
+        """
+        if not self.enabled:
+            return iter(self._generate_fallback_questions(content, num_questions))
+
+        return stream_map_reduce_quiz(
+            content,
+            num_questions,
+            lambda segment, count: self._stream_quiz_segment(segment, count, difficulty)
+        )
 
     def generate_embeddings(
         self,
         texts: List[str],
-        model: str = "text-embedding-ada-002"
-    ) -> List[List[float]]:
+        model: str = None
+    ) -> List[Optional[List[float]]]:
         """
         Generate embeddings using DigitalOcean GPU infrastructure
 
@@ -143,44 +336,109 @@ class DigitalOceanAIService:
         - Cost-effective at scale
 
         Args:
-            texts: List of text chunks to embed
-            model: Embedding model to use
+            texts: List of text chunks to embed (any number, see bulk_embeddings)
+            model: Embedding model to use (default DIGITALOCEAN_EMBEDDING_MODEL)
 
         Returns:
-            List of embedding vectors
+            Embedding vectors in the order of texts (None where a text failed)
         """
         if not self.enabled:
             return []
 
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_token}",
-                "Content-Type": "application/json"
-            }
-
-            payload = {
-                "model": model,
-                "input": texts[:100]  # Batch process 100 at a time
-            }
+        return self.bulk_embeddings(texts, model)["embeddings"]
 
-            response = requests.post(
-                f"{self.gradient_endpoint}/v1/embeddings",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+    def bulk_embeddings(
+        self,
+        texts: List[str],
+        model: str = None,
+        batch_size: int = None,
+        concurrency: int = None
+    ) -> Dict[str, Any]:
+        """
+        Embed arbitrarily many texts in provider-sized batches with bounded concurrency
 
-            if response.status_code == 200:
-                result = response.json()
-                embeddings = [item["embedding"] for item in result.get("data", [])]
-                return embeddings
-            else:
-                print(f"DigitalOcean embedding error: {response.status_code}")
-                return []
+        A batch that fails is retried one text at a time, so a single bad input
+        (or a transient error) only costs the texts that fail on their own.
 
+        Returns:
+            {
+                "model": model used,
+                "embeddings": vectors in the order of texts (None where a text failed),
+                "batches": [{"start", "size", "seconds", "failed", "error"}] in order
+            }
+        """
+        model = model or settings.DIGITALOCEAN_EMBEDDING_MODEL
+        batch_size = max(1, batch_size or settings.DIGITALOCEAN_EMBEDDING_BATCH_SIZE)
+        concurrency = concurrency or settings.DIGITALOCEAN_EMBEDDING_CONCURRENCY
+        starts = list(range(0, len(texts), batch_size))
+
+        def run(start: int) -> Dict[str, Any]:
+            return self._embed_batch_with_retry(texts[start:start + batch_size], start, model)
+
+        if not starts:
+            batches = []
+        else:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(starts))) as executor:
+                batches = list(executor.map(usage_meter.attributed(run), starts))
+
+        embeddings = []
+        for batch in batches:
+            embeddings.extend(batch.pop("embeddings"))
+
+        return {"model": model, "embeddings": embeddings, "batches": batches}
+
+    def _embed_batch_with_retry(self, texts: List[str], start: int, model: str) -> Dict[str, Any]:
+        """Embed one batch, falling back to one request per text if the batch fails"""
+        started = time.monotonic()
+        error = None
+        try:
+            embeddings = self._embed_batch(texts, model)
+        except ProviderUnavailableError as e:
+            # Circuit open / rate limited: individual retries would be rejected too
+            embeddings = [None] * len(texts)
+            error = str(e)
         except Exception as e:
-            print(f"Error generating embeddings with DigitalOcean: {str(e)}")
-            return []
+            error = str(e)
+            embeddings = []
+            for text in texts:
+                try:
+                    embeddings.extend(self._embed_batch([text], model))
+                except Exception as item_error:
+                    print(f"Error embedding text individually: {str(item_error)}")
+                    embeddings.append(None)
+
+        return {
+            "start": start,
+            "size": len(texts),
+            "seconds": round(time.monotonic() - started, 3),
+            "failed": sum(1 for embedding in embeddings if embedding is None),
+            "error": error,
+            "embeddings": embeddings
+        }
+
+    def _embed_batch(self, texts: List[str], model: str) -> List[List[float]]:
+        """One embeddings request (raises on failure)"""
+        payload = {
+            "model": model,
+            "input": texts
+        }
+
+        # OpenRouter endpoint (already includes /api/v1)
+        response = self._post(
+            "/embeddings",
+            payload,
+            tokens=sum(estimate_tokens(text) for text in texts)
+        )
+
+        if response.status_code != 200:
+            raise Exception(f"DigitalOcean embedding error: {response.status_code}")
+
+        data = response.json().get("data", [])
+        if len(data) != len(texts):
+            raise Exception(f"DigitalOcean returned {len(data)} embeddings for {len(texts)} texts")
+
+        # Items carry their input index; don't rely on response order
+        return [item["embedding"] for item in sorted(data, key=lambda item: item.get("index", 0))]
 
     def enhance_chat_response(
         self,
@@ -234,27 +492,10 @@ Please provide a helpful, encouraging response that:
 4. Encourages further learning"""
             })
 
-            headers = {
-                "Authorization": f"Bearer {self.api_token}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost:8000",
-                "X-Title": "ClassroomAI"
-            }
-
-            payload = {
-                "model": "meta-llama/llama-3.1-70b-instruct",
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 500
-            }
+            payload = self._chat_payload(messages, temperature=0.7, max_tokens=500)
 
             # OpenRouter endpoint (already includes /api/v1)
-            response = requests.post(
-                f"{self.gradient_endpoint}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            response = self._post("/chat/completions", payload, tokens=self._chat_tokens(payload))
 
             if response.status_code == 200:
                 result = response.json()
@@ -300,14 +541,28 @@ Please provide a helpful, encouraging response that:
             }
 
         try:
+            windows = split_into_segments(transcript, settings.TRANSCRIPT_WINDOW_CHARS)
+            if not windows:
+                return {
+                    "summary": "",
+                    "key_topics": [],
+                    "learning_objectives": []
+                }
+
+            # Short transcripts fit in one prompt; long ones are summarized per window first
+            if len(windows) == 1:
+                material = windows[0]
+            else:
+                material = self._reduce_window_summaries(self._summarize_windows(windows))
+
             prompt = f"""
             Analyze this video transcript and provide:
             1. A {max_summary_length}-word summary
             2. List of 5 key topics covered
             3. List of 3 learning objectives
 
-            Transcript:
-            {transcript[:5000]}
+            Transcript{" (summarized section by section, in order)" if len(windows) > 1 else ""}:
+            {material}
 
             Format as JSON:
             {{
@@ -317,45 +572,13 @@ Please provide a helpful, encouraging response that:
             }}
             """
 
-            headers = {
-                "Authorization": f"Bearer {self.api_token}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost:8000",
-                "X-Title": "ClassroomAI"
-            }
-
-            payload = {
-                "model": "meta-llama/llama-3.1-70b-instruct",
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.5,
-                "max_tokens": 1000
-            }
-
-            # OpenRouter endpoint (already includes /api/v1)
-            response = requests.post(
-                f"{self.gradient_endpoint}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-
-            if response.status_code == 200:
-                result = response.json()
-                content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+            content = self._complete_text(prompt, temperature=0.5, max_tokens=1000)
 
-                try:
-                    return json.loads(content)
-                except json.JSONDecodeError:
-                    return {
-                        "summary": content[:max_summary_length],
-                        "key_topics": [],
-                        "learning_objectives": []
-                    }
-            else:
+            try:
+                return json.loads(content)
+            except json.JSONDecodeError:
                 return {
-                    "summary": "Summary generation failed",
+                    "summary": content[:max_summary_length],
                     "key_topics": [],
                     "learning_objectives": []
                 }
@@ -368,6 +591,64 @@ Please provide a helpful, encouraging response that:
                 "learning_objectives": []
             }
 
+    def _complete_text(self, prompt: str, temperature: float, max_tokens: int) -> str:
+        """Single-prompt chat completion returning the message text (raises on failure)"""
+        payload = self._chat_payload([{"role": "user", "content": prompt}], temperature, max_tokens)
+
+        # OpenRouter endpoint (already includes /api/v1)
+        response = self._post("/chat/completions", payload, tokens=self._chat_tokens(payload))
+
+        if response.status_code != 200:
+            raise Exception(f"Summary generation failed: {response.status_code}")
+
+        result = response.json()
+        return result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+    def _summarize_window(self, window: str) -> str:
+        """
+        Summarize one transcript window into dense notes
+
+        Partial summaries are cached by window content, so re-processing a video
+        (or one with appended transcript) only recomputes the windows that changed.
+        """
+        key = hashlib.sha256(f"{WINDOW_SUMMARY_VERSION}:{window}".encode("utf-8")).hexdigest()
+        cached = self._window_summaries.get(key)
+        if cached is not None:
+            return cached
+
+        prompt = f"""
+        Summarize this section of a lecture transcript as dense study notes
+        (at most 150 words). Name every topic covered and keep definitions,
+        formulas and examples. Do not add anything that is not in the section.
+
+        Transcript section:
+        {window}
+        """
+        notes = self._complete_text(prompt, temperature=0.3, max_tokens=400).strip()
+        if notes:
+            self._window_summaries.set(key, notes)
+        return notes
+
+    def _summarize_windows(self, windows: List[str]) -> List[str]:
+        """Summarize windows concurrently, preserving transcript order"""
+        max_workers = min(settings.QUIZ_GENERATION_CONCURRENCY, len(windows))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(usage_meter.attributed(self._summarize_window), windows))
+
+    def _reduce_window_summaries(self, notes: List[str]) -> str:
+        """
+        Combine per-window notes into material that fits one prompt
+        When the notes themselves are too long (very long videos) they are
+        summarized again, level by level, until they fit.
+        """
+        combined = "\n\n".join(note for note in notes if note)
+        while len(combined) > settings.TRANSCRIPT_WINDOW_CHARS:
+            groups = split_into_segments(combined, settings.TRANSCRIPT_WINDOW_CHARS)
+            if len(groups) <= 1:
+                break
+            combined = "\n\n".join(note for note in self._summarize_windows(groups) if note)
+        return combined
+
     def _generate_fallback_questions(self, content: str, num_questions: int) -> List[Dict[str, Any]]:
         """Fallback when DigitalOcean is not available"""
         return []
@@ -0,0 +1,98 @@
+"""
+Embedding backend selection
+Upload chunks are embedded at ingest by the configured EMBEDDING_BACKEND (Gemini,
+one request per chunk, or DigitalOcean bulk batches) and tagged with the model
+that produced them. Vectors from different models aren't comparable, so a query
+is embedded once per model its candidate chunks were stored with (whatever the
+current backend) and compared only with those chunks.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.config import settings
+from app.services.gemini_service import gemini_service
+from app.services.digitalocean_ai_service import digitalocean_ai_service
+from app.services.rate_limiter import ProviderUnavailableError
+
+# Chunks stored before they were tagged were embedded by Gemini
+GEMINI_EMBEDDING_MODEL = "models/embedding-001"
+
+
+class EmbeddingService:
+    @property
+    def use_digitalocean(self) -> bool:
+        return settings.EMBEDDING_BACKEND == "digitalocean" and digitalocean_ai_service.enabled
+
+    def chunk_model(self, chunk_data: Dict[str, Any]) -> str:
+        """Model that embedded a stored chunk"""
+        return chunk_data.get("model") or GEMINI_EMBEDDING_MODEL
+
+    def embed_chunks(self, chunks: List[str]) -> List[Dict[str, Any]]:
+        """Embed text chunks as [{"chunk", "embedding", "model"}], skipping chunks that failed"""
+        chunks = [chunk for chunk in chunks if chunk.strip()]  # Skip empty chunks
+        if self.use_digitalocean:
+            return self._embed_chunks_digitalocean(chunks)
+        return self._embed_chunks_gemini(chunks)
+
+    def _embed_chunks_gemini(self, chunks: List[str]) -> List[Dict[str, Any]]:
+        """One request per chunk, stopping early if Gemini is throttled or down"""
+        embeddings_data = []
+
+        for chunk in chunks:
+            try:
+                embedding = gemini_service.generate_embeddings(chunk)
+                embeddings_data.append({
+                    "chunk": chunk,
+                    "embedding": embedding,
+                    "model": GEMINI_EMBEDDING_MODEL
+                })
+            except ProviderUnavailableError as e:
+                # Remaining chunks would be rejected too - don't hammer the provider
+                print(f"Stopping embedding after {len(embeddings_data)}/{len(chunks)} chunks: {str(e)}")
+                break
+            except Exception as e:
+                print(f"Error generating embedding for chunk: {str(e)}")
+
+        return embeddings_data
+
+    def _embed_chunks_digitalocean(self, chunks: List[str]) -> List[Dict[str, Any]]:
+        """Bulk batches with bounded concurrency"""
+        result = digitalocean_ai_service.bulk_embeddings(chunks)
+
+        batches = result["batches"]
+        failed = sum(batch["failed"] for batch in batches)
+        seconds = sum(batch["seconds"] for batch in batches)
+        print(
+            f"Embedded {len(chunks) - failed}/{len(chunks)} chunks with DigitalOcean in {len(batches)} batches "
+            f"({seconds:.1f}s total, slowest {max((batch['seconds'] for batch in batches), default=0):.1f}s)"
+        )
+
+        return [
+            {"chunk": chunk, "embedding": embedding, "model": result["model"]}
+            for chunk, embedding in zip(chunks, result["embeddings"])
+            if embedding is not None
+        ]
+
+    def embed_query(self, text: str, model: Optional[str] = None) -> Tuple[str, List[float]]:
+        """
+        Embed a search query; returns (model, vector)
+
+        Args:
+            model: Model the compared chunks were embedded with (default: the
+                current ingest backend's model)
+        """
+        if model is None:
+            model = settings.DIGITALOCEAN_EMBEDDING_MODEL if self.use_digitalocean else GEMINI_EMBEDDING_MODEL
+        if model == GEMINI_EMBEDDING_MODEL:
+            return model, gemini_service.semantic_search_query(text)
+
+        if not digitalocean_ai_service.enabled:
+            raise Exception(f"Chunks embedded with {model} need DigitalOcean, which is not configured")
+        result = digitalocean_ai_service.bulk_embeddings([text], model=model)
+        embedding = result["embeddings"][0] if result["embeddings"] else None
+        if embedding is None:
+            raise Exception(f"Error generating query embedding: {result['batches'][0]['error']}")
+        return result["model"], embedding
+
+
+# Singleton instance
+embedding_service = EmbeddingService()
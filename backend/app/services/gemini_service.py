@@ -3,10 +3,22 @@ Gemini API integration service
 Handles PDF text extraction, video processing, quiz generation, and chat
 """
 import google.generativeai as genai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 import PyPDF2
+import hashlib
 import json
+import time
 from app.core.config import settings
+from app.services.rate_limiter import get_provider_guard, estimate_tokens, ProviderUnavailableError
+from app.services.quiz_generation import (
+    map_reduce_quiz,
+    stream_map_reduce_quiz,
+    validate_question,
+    validate_questions
+)
+from app.services.json_stream import parse_json_array, iter_json_array
+from app.services.transport import provider_transport
+from app.services.prompt_cache import prompt_cache
 
 # Configure Gemini API
 genai.configure(api_key=settings.GEMINI_API_KEY)
@@ -16,6 +28,84 @@ class GeminiService:
     def __init__(self):
         # Use gemini-2.0-flash-001 - fast, stable, and widely available
         self.model = genai.GenerativeModel('gemini-2.0-flash-001')
+        self.guard = get_provider_guard("gemini")
+
+    def _generate(
+        self,
+        prompt: str,
+        operation: str = "generate_content",
+        prefix: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        generate_content through the record/replay transport and the shared
+        Gemini rate limiter/circuit breaker. Returns the response text.
+
+        prefix: (system instruction, pinned content) that prompt starts with; served
+        from the provider's context cache when possible (see prompt_cache)
+        """
+        def send() -> str:
+            with self.guard.slot(tokens=estimate_tokens(prompt)):
+                cached_model, suffix = self._cached_prefix(prompt, prefix)
+                if cached_model is not None:
+                    try:
+                        return cached_model.generate_content(suffix).text
+                    except Exception as e:
+                        print(f"Cached prompt prefix failed, sending full prompt: {str(e)}")
+                        prompt_cache.invalidate(self.model.model_name, *prefix)
+                return self.model.generate_content(prompt).text
+
+        request = {"model": self.model.model_name, "prompt": prompt}
+        return provider_transport.call("gemini", operation, request, send)
+
+    def _generate_stream(
+        self,
+        prompt: str,
+        operation: str = "generate_content_stream",
+        prefix: Optional[Tuple[str, str]] = None
+    ) -> Iterator[str]:
+        """Streaming generate_content, yielding text chunks (recorded/replayed and prefix-cached like _generate)"""
+        def send() -> Iterator[str]:
+            # The stream can still fail after it opens, so the breaker outcome is
+            # recorded once it has been read to the end
+            with self.guard.slot(tokens=estimate_tokens(prompt), defer_success=True):
+                cached_model, suffix = self._cached_prefix(prompt, prefix)
+                response = None
+                if cached_model is not None:
+                    try:
+                        response = cached_model.generate_content(suffix, stream=True)
+                    except Exception as e:
+                        print(f"Cached prompt prefix failed, sending full prompt: {str(e)}")
+                        prompt_cache.invalidate(self.model.model_name, *prefix)
+                if response is None:
+                    response = self.model.generate_content(prompt, stream=True)
+            yield from self.guard.settle_stream(chunk.text for chunk in response)
+
+        request = {"model": self.model.model_name, "prompt": prompt}
+        return provider_transport.stream("gemini", operation, request, send)
+
+    def _cached_prefix(self, prompt: str, prefix: Optional[Tuple[str, str]]):
+        """(model bound to the cached prefix, rest of the prompt), or (None, prompt)"""
+        if not prefix:
+            return None, prompt
+        system_instruction, content = prefix
+        cached_model = prompt_cache.model_for(self.model.model_name, system_instruction, content)
+        if cached_model is None:
+            return None, prompt
+        return cached_model, prompt[len(system_instruction) + len(content):]
+
+    def _embed(self, content: str, task_type: str) -> List[float]:
+        """embed_content through the transport and the shared Gemini rate limiter/circuit breaker"""
+        def send() -> List[float]:
+            with self.guard.slot(tokens=estimate_tokens(content)):
+                result = genai.embed_content(
+                    model="models/embedding-001",
+                    content=content,
+                    task_type=task_type
+                )
+            return result['embedding']
+
+        request = {"model": "models/embedding-001", "content": content, "task_type": task_type}
+        return provider_transport.call("gemini", "embed_content", request, send)
 
     def extract_pdf_text(self, pdf_path: str) -> str:
         """Extract text from PDF file"""
@@ -40,18 +130,6 @@ class GeminiService:
         }
         """
         try:
-            # Upload video to Gemini
-            video_file = genai.upload_file(path=video_path)
-
-            # Wait for processing
-            import time
-            while video_file.state.name == "PROCESSING":
-                time.sleep(2)
-                video_file = genai.get_file(video_file.name)
-
-            if video_file.state.name == "FAILED":
-                raise Exception("Video processing failed")
-
             # Generate transcript with timestamps
             prompt = """
             Analyze this educational video and provide:
@@ -76,35 +154,60 @@ class GeminiService:
             }
             """
 
-            response = self.model.generate_content([prompt, video_file])
+            # Recordings are keyed on the video's content, not its path
+            digest = hashlib.sha256()
+            with open(video_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            video_sha256 = digest.hexdigest()
+            request = {"model": self.model.model_name, "prompt": prompt, "video_sha256": video_sha256}
+            result_text = provider_transport.call(
+                "gemini",
+                "process_video",
+                request,
+                lambda: self._analyze_video(video_path, prompt)
+            ).strip()
 
-            # Parse JSON response
-            result_text = response.text.strip()
             # Remove markdown code blocks if present
             if result_text.startswith("```json"):
                 result_text = result_text[7:]
             if result_text.endswith("```"):
                 result_text = result_text[:-3]
 
-            result = json.loads(result_text.strip())
-
-            # Delete uploaded file
-            genai.delete_file(video_file.name)
-
-            return result
+            return json.loads(result_text.strip())
 
         except Exception as e:
             raise Exception(f"Error processing video: {str(e)}")
 
+    def _analyze_video(self, video_path: str, prompt: str) -> str:
+        """Upload a video to Gemini, run the prompt against it and return the response text"""
+        # Upload video to Gemini
+        video_file = genai.upload_file(path=video_path)
+
+        # Wait for processing
+        while video_file.state.name == "PROCESSING":
+            time.sleep(2)
+            video_file = genai.get_file(video_file.name)
+
+        if video_file.state.name == "FAILED":
+            raise Exception("Video processing failed")
+
+        # Video tokens can't be estimated up front; budget the prompt only
+        with self.guard.slot(tokens=estimate_tokens(prompt)):
+            response = self.model.generate_content([prompt, video_file])
+        result_text = response.text
+
+        # Delete uploaded file
+        genai.delete_file(video_file.name)
+
+        return result_text
+
     def generate_embeddings(self, text: str) -> List[float]:
         """Generate embeddings for text using Gemini"""
         try:
-            result = genai.embed_content(
-                model="models/embedding-001",
-                content=text,
-                task_type="retrieval_document"
-            )
-            return result['embedding']
+            return self._embed(text, "retrieval_document")
+        except ProviderUnavailableError:
+            raise
         except Exception as e:
             raise Exception(f"Error generating embeddings: {str(e)}")
 
@@ -132,115 +235,211 @@ class GeminiService:
     def generate_quiz(self, content: str, num_questions: int = 25) -> List[Dict[str, Any]]:
         """
         Generate quiz questions from content
+        Large content is split into segments that are quizzed concurrently,
+        then de-duplicated and balanced to num_questions (see quiz_generation).
         Returns: [
             {
                 'id': 'q1',
                 'question': 'Question text',
                 'options': ['A', 'B', 'C', 'D'],
                 'correct': 0,  # index of correct answer
-                'explanation': 'Why this is correct'
+                'explanation': 'Why this is correct',
+                'topic': 'Topic name',
+                'difficulty': 'easy' | 'medium' | 'hard'
             }
         ]
         """
         try:
-            prompt = f"""
-            Create {num_questions} multiple-choice quiz questions from the following educational content.
-
-            Requirements:
-            - Each question should have 4 options
-            - Include a 2-line explanation for each correct answer
-            - Questions should test understanding, not just memorization
-            - Cover different topics from the content
-
-            Content:
-            {content[:10000]}  # Limit content to avoid token limits
-
-            Return response in JSON format:
-            [
-                {{
-                    "id": "q1",
-                    "question": "Question text here?",
-                    "options": ["Option A", "Option B", "Option C", "Option D"],
-                    "correct": 0,
-                    "explanation": "This is correct because... This demonstrates..."
-                }}
-            ]
-            """
-
-            response = self.model.generate_content(prompt)
-            result_text = response.text.strip()
-
-            # Remove markdown code blocks if present
-            if result_text.startswith("```json"):
-                result_text = result_text[7:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
-
-            questions = json.loads(result_text.strip())
-            return questions
-
+            return map_reduce_quiz(content, num_questions, self._generate_quiz_segment)
+        except ProviderUnavailableError:
+            raise
         except Exception as e:
             raise Exception(f"Error generating quiz: {str(e)}")
 
-    def chat(self, message: str, context: str = "", emotion: str = "encouraging") -> str:
+    def _quiz_prompt(self, content: str, num_questions: int) -> str:
+        """Quiz prompt shared by the batch and streaming generators"""
+        return f"""
+        Create {num_questions} multiple-choice quiz questions from the following educational content.
+
+        Requirements:
+        - Each question should have 4 options
+        - Include a 2-line explanation for each correct answer
+        - Questions should test understanding, not just memorization
+        - Cover different topics from the content
+        - Tag each question with a short topic name (2-4 words) and a difficulty of easy, medium or hard
+
+        Content:
+        {content}
+
+        Return response in JSON format:
+        [
+            {{
+                "id": "q1",
+                "question": "Question text here?",
+                "options": ["Option A", "Option B", "Option C", "Option D"],
+                "correct": 0,
+                "explanation": "This is correct because... This demonstrates...",
+                "topic": "Topic name",
+                "difficulty": "medium"
+            }}
+        ]
         """
-        Chat with Gemini AI
-        Args:
-            message: User's question
-            context: Relevant context from course materials (RAG)
-            emotion: Emotional tone for the response
+
+    def _generate_quiz_segment(self, content: str, num_questions: int) -> List[Dict[str, Any]]:
+        """Generate questions for a single content segment"""
+        prompt = self._quiz_prompt(content, num_questions)
+        response_text = self._generate(prompt, operation="generate_quiz")
+
+        # Salvage every well-formed question even if part of the output is malformed
+        questions, malformed = parse_json_array(response_text)
+        if malformed:
+            print(f"Dropped {malformed} malformed quiz question(s) from Gemini output")
+
+        questions = validate_questions(questions)
+        if not questions:
+            raise Exception("No valid quiz questions in Gemini output")
+        return questions
+
+    def _stream_quiz_segment(self, content: str, num_questions: int) -> Iterator[Dict[str, Any]]:
+        """Stream questions for a single content segment as each one completes"""
+        prompt = self._quiz_prompt(content, num_questions)
+        for question in iter_json_array(self._generate_stream(prompt, operation="generate_quiz_stream")):
+            question = validate_question(question)
+            if question:
+                yield question
+
+    def generate_quiz_stream(self, content: str, num_questions: int = 25) -> Iterator[Dict[str, Any]]:
         """
-        try:
-            # Emotion-based personality prompts
-            personality_prompts = {
-                "excited": """You're an incredibly enthusiastic and passionate AI tutor who LOVES teaching! You speak with genuine excitement and energy. Use expressive language, exclamation marks, and show real joy when explaining concepts. Make learning feel like an adventure!""",
+        Streaming quiz generation
+        Yields validated questions (same shape as generate_quiz) as soon as they are
+        parsed from the model's streamed output, instead of waiting for the whole array.
+        """
+        return stream_map_reduce_quiz(content, num_questions, self._stream_quiz_segment)
 
-                "encouraging": """You're a warm, supportive AI tutor who believes in your students. You're genuinely excited to help them learn and always find ways to boost their confidence. Speak naturally like a caring friend who happens to be really knowledgeable. Use phrases like "Great question!", "You're on the right track!", and celebrate their curiosity.""",
+    def _chat_system_prompt(self, emotion: str) -> str:
+        """Tutor personality and style instructions - the stable start of every chat prompt"""
+        # Emotion-based personality prompts
+        personality_prompts = {
+            "excited": """You're an incredibly enthusiastic and passionate AI tutor who LOVES teaching! You speak with genuine excitement and energy. Use expressive language, exclamation marks, and show real joy when explaining concepts. Make learning feel like an adventure!""",
 
-                "supportive": """You're an empathetic and patient AI tutor who understands learning can be challenging. You speak gently and reassuringly, breaking things down into manageable pieces. Show genuine care for the student's understanding and encourage them warmly.""",
+            "encouraging": """You're a warm, supportive AI tutor who believes in your students. You're genuinely excited to help them learn and always find ways to boost their confidence. Speak naturally like a caring friend who happens to be really knowledgeable. Use phrases like "Great question!", "You're on the right track!", and celebrate their curiosity.""",
 
-                "empathetic": """You're a deeply caring AI tutor who recognizes when students are struggling. You speak with compassion and patience, validating their feelings while gently guiding them forward. Use phrases like "I understand this is tricky", "That's totally normal", and "Let's work through this together".""",
+            "supportive": """You're an empathetic and patient AI tutor who understands learning can be challenging. You speak gently and reassuringly, breaking things down into manageable pieces. Show genuine care for the student's understanding and encourage them warmly.""",
 
-                "congratulatory": """You're a celebratory AI tutor who's genuinely thrilled with the student's progress! Express real excitement and pride in their achievements. Use enthusiastic language and make them feel accomplished!"""
-            }
+            "empathetic": """You're a deeply caring AI tutor who recognizes when students are struggling. You speak with compassion and patience, validating their feelings while gently guiding them forward. Use phrases like "I understand this is tricky", "That's totally normal", and "Let's work through this together".""",
 
-            personality = personality_prompts.get(emotion, personality_prompts["encouraging"])
+            "congratulatory": """You're a celebratory AI tutor who's genuinely thrilled with the student's progress! Express real excitement and pride in their achievements. Use enthusiastic language and make them feel accomplished!"""
+        }
 
-            prompt = f"""
-            {personality}
+        personality = personality_prompts.get(emotion, personality_prompts["encouraging"])
 
-            IMPORTANT STYLE GUIDELINES:
-            - Speak naturally and conversationally, like you're talking to a friend
-            - Use contractions (you're, it's, let's) to sound more human
-            - Add natural speech patterns and emotional expressions
-            - Show genuine personality - react to what the student says!
-            - Keep it concise but warm (2-4 sentences unless more detail is needed)
-            - Use occasional interjections like "Oh!", "Wow!", "Actually", "You know what?"
-            - NEVER sound like you're reading from a textbook
+        return f"""
+        {personality}
 
-            Context from course materials:
-            {context}
+        IMPORTANT STYLE GUIDELINES:
+        - Speak naturally and conversationally, like you're talking to a friend
+        - Use contractions (you're, it's, let's) to sound more human
+        - Add natural speech patterns and emotional expressions
+        - Show genuine personality - react to what the student says!
+        - Keep it concise but warm (2-4 sentences unless more detail is needed)
+        - Use occasional interjections like "Oh!", "Wow!", "Actually", "You know what?"
+        - NEVER sound like you're reading from a textbook
+        """
 
-            Student said: {message}
+    def _chat_prompt(
+        self,
+        message: str,
+        context: str,
+        emotion: str,
+        history: str = "",
+        pinned: str = ""
+    ) -> Tuple[str, Tuple[str, str]]:
+        """
+        Tutor prompt shared by chat and chat_stream, and its cacheable prefix
+        (system instructions + pinned course material)
+        """
+        system_instruction = self._chat_system_prompt(emotion)
+        pinned_block = f"""
+        Course material for this conversation:
+        {pinned}
+        """ if pinned else ""
 
-            Now respond naturally with personality and emotion! Remember: You're having a real conversation, not giving a lecture.
-            """
+        prompt = system_instruction + pinned_block + f"""
+        Context from course materials:
+        {context}
 
-            response = self.model.generate_content(prompt)
-            return response.text
+        Conversation so far:
+        {history or "This is the start of the conversation."}
 
+        Student said: {message}
+
+        Now respond naturally with personality and emotion! Remember: You're having a real conversation, not giving a lecture.
+        """
+        return prompt, (system_instruction, pinned_block)
+
+    def chat(
+        self,
+        message: str,
+        context: str = "",
+        emotion: str = "encouraging",
+        history: str = "",
+        pinned: str = ""
+    ) -> str:
+        """
+        Chat with Gemini AI
+        Args:
+            message: User's question
+            context: Relevant context from course materials (RAG)
+            emotion: Emotional tone for the response
+            history: Earlier conversation (see conversation_store.format_history)
+            pinned: Course material that stays the same across the conversation
+                    (cached with the provider together with the instructions)
+        """
+        try:
+            prompt, prefix = self._chat_prompt(message, context, emotion, history, pinned)
+            return self._generate(prompt, operation="chat", prefix=prefix)
+
+        except ProviderUnavailableError:
+            raise
         except Exception as e:
             raise Exception(f"Error in chat: {str(e)}")
 
+    def chat_stream(
+        self,
+        message: str,
+        context: str = "",
+        emotion: str = "encouraging",
+        history: str = "",
+        pinned: str = ""
+    ) -> Iterator[str]:
+        """Streaming variant of chat, yielding response text chunks as they are generated"""
+        prompt, prefix = self._chat_prompt(message, context, emotion, history, pinned)
+        return self._generate_stream(prompt, operation="chat_stream", prefix=prefix)
+
+    def summarize_conversation(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        """Fold older chat turns into the conversation's rolling summary"""
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        prompt = f"""
+        You are keeping notes on a tutoring conversation between a student and an AI tutor.
+        Update the summary below with the new turns, in at most {settings.CHAT_HISTORY_SUMMARY_WORDS} words.
+        Keep what the student asked about, what they struggled with or misunderstood,
+        what was explained, and anything they said about themselves or their goals.
+        Return only the updated summary.
+
+        Current summary:
+        {summary or "(none yet)"}
+
+        New turns:
+        {transcript}
+        """
+        return self._generate(prompt, operation="summarize_conversation").strip()
+
     def semantic_search_query(self, query: str) -> List[float]:
         """Generate embedding for search query"""
         try:
-            result = genai.embed_content(
-                model="models/embedding-001",
-                content=query,
-                task_type="retrieval_query"
-            )
-            return result['embedding']
+            return self._embed(query, "retrieval_query")
+        except ProviderUnavailableError:
+            raise
         except Exception as e:
             raise Exception(f"Error generating query embedding: {str(e)}")
 
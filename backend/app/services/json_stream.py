@@ -0,0 +1,104 @@
+"""
+Incremental JSON array parsing for streamed LLM output
+LLMs return quiz questions as a JSON array, often wrapped in ``` fences or prose.
+JSONArrayStreamParser consumes the text as it streams in and emits each top-level
+object of the array as soon as it is complete, so a malformed element (or a
+truncated response) only loses that element instead of the whole array.
+"""
+import json
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+
+class JSONArrayStreamParser:
+    def __init__(self):
+        self.started = False  # inside the top-level array
+        self.done = False  # saw the closing bracket
+        self.malformed = 0  # elements that failed to parse
+        self._candidate = False  # saw '[' but not yet the first element
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Consume the next chunk of text and return the objects it completed"""
+        completed = []
+        for ch in text:
+            if self.done:
+                break
+
+            if not self.started:
+                # Skip fences/prose until a '[' that is followed by '{' (or ']')
+                if self._candidate and not ch.isspace():
+                    self._candidate = False
+                    if ch in "{]":
+                        self.started = True
+                    else:
+                        continue
+                elif ch == "[":
+                    self._candidate = True
+                    continue
+                else:
+                    continue
+
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buffer = [ch]
+                elif ch == "]":
+                    self.done = True
+                # Commas and whitespace between elements are skipped
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                # Raw newlines/tabs in strings are common in LLM output and are
+                # decoded leniently, so only escapes and the closing quote matter
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    element = "".join(self._buffer)
+                    self._buffer = []
+                    try:
+                        completed.append(json.loads(element, strict=False))
+                    except json.JSONDecodeError:
+                        self.malformed += 1
+
+        return completed
+
+    @property
+    def truncated(self) -> bool:
+        """True if the stream ended inside an element (partial output)"""
+        return self._depth > 0
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Yield each object of a streamed JSON array as soon as it is complete"""
+    parser = JSONArrayStreamParser()
+    for chunk in chunks:
+        for element in parser.feed(chunk):
+            yield element
+        if parser.done:
+            break
+
+
+def parse_json_array(text: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Parse a (possibly fenced, truncated or partly malformed) JSON array
+
+    Returns:
+        (salvaged objects, number of malformed or truncated elements)
+    """
+    parser = JSONArrayStreamParser()
+    elements = parser.feed(text)
+    return elements, parser.malformed + (1 if parser.truncated else 0)
@@ -0,0 +1,149 @@
+"""
+Prompt-prefix cache
+Tutor chats resend the same long prefix every turn: the personality and style
+instructions plus (when an upload is pinned) its course material. Where the
+provider supports context caching, the prefix is registered once and later
+turns send only the per-turn suffix (retrieved context, history, message),
+cutting prompt tokens and latency.
+
+Handles are tracked with a TTL slightly shorter than the provider's, so an
+expired cache is never referenced. When caching is unsupported (older SDKs),
+the prefix is too short for the provider to accept, or a cached call fails,
+callers get None / invalidate and send the full prompt instead - the response
+is the same either way.
+
+The provider is pluggable, so the cache can be exercised against a stub.
+"""
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import google.generativeai as genai
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.services.rate_limiter import estimate_tokens
+
+# Handles are dropped this long before the provider expires the cached content
+REFRESH_MARGIN_SECONDS = 60
+
+# After a failed registration, the prefix is sent in full for this long
+FAILURE_BACKOFF_SECONDS = 300
+
+
+class GeminiContextCacheProvider:
+    """Context caching through google.generativeai (genai.caching, SDK 0.7+)"""
+
+    def __init__(self):
+        self._caching = getattr(genai, "caching", None)
+
+    @property
+    def supported(self) -> bool:
+        return self._caching is not None and hasattr(genai.GenerativeModel, "from_cached_content")
+
+    def create(self, model_name: str, system_instruction: str, content: str, ttl_seconds: int) -> Any:
+        """Register a prefix; returns a model bound to it"""
+        cached = self._caching.CachedContent.create(
+            model=model_name,
+            system_instruction=system_instruction,
+            contents=[content] if content else None,
+            ttl=timedelta(seconds=ttl_seconds)
+        )
+        return genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+
+class PromptPrefixCache:
+    def __init__(
+        self,
+        provider,
+        ttl_seconds: int = 3600,
+        min_tokens: int = 4096,
+        enabled: bool = True
+    ):
+        self.provider = provider
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self._enabled = enabled
+        self._handles = TTLCache(maxsize=1024, ttl_seconds=max(1, ttl_seconds - REFRESH_MARGIN_SECONDS))
+        self._failures = TTLCache(maxsize=1024, ttl_seconds=FAILURE_BACKOFF_SECONDS)
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+        self.hits = 0
+        self.created = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled and self.provider.supported
+
+    def prefix_key(self, model_name: str, system_instruction: str, content: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{system_instruction}\0{content}".encode("utf-8")).hexdigest()
+
+    def model_for(self, model_name: str, system_instruction: str, content: str = "") -> Optional[Any]:
+        """
+        Model bound to the cached prefix, registering it on first use
+
+        Returns None when the prefix isn't cached (caching unsupported, prefix below
+        the provider minimum, or registration failing) - send the full prompt then.
+        """
+        if not self.enabled or estimate_tokens(system_instruction + content) < self.min_tokens:
+            return None
+
+        key = self.prefix_key(model_name, system_instruction, content)
+        model = self._handles.get(key)
+        if model is not None:
+            self.hits += 1
+            return model
+        if self._failures.get(key):
+            self.fallbacks += 1
+            return None
+
+        # One registration per prefix, however many turns arrive at once
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            model = self._handles.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+            if self._failures.get(key):
+                self.fallbacks += 1
+                return None
+            try:
+                model = self.provider.create(model_name, system_instruction, content, self.ttl_seconds)
+                self._handles.set(key, model)
+                self.created += 1
+            except Exception as e:
+                print(f"Prompt prefix caching failed, sending full prompts: {str(e)}")
+                self._failures.set(key, True)
+                self.fallbacks += 1
+                model = None
+            with self._lock:
+                self._key_locks.pop(key, None)
+            return model
+
+    def invalidate(self, model_name: str, system_instruction: str, content: str = ""):
+        """Forget a handle whose cached call failed (e.g. expired or deleted upstream)"""
+        self._handles.pop(self.prefix_key(model_name, system_instruction, content))
+        self.fallbacks += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache state for status endpoints"""
+        return {
+            "enabled": self.enabled,
+            "cached_prefixes": len(self._handles),
+            "hits": self.hits,
+            "created": self.created,
+            "fallbacks": self.fallbacks
+        }
+
+
+# Singleton instance
+prompt_cache = PromptPrefixCache(
+    GeminiContextCacheProvider(),
+    ttl_seconds=settings.PROMPT_CACHE_TTL_SECONDS,
+    min_tokens=settings.PROMPT_CACHE_MIN_TOKENS,
+    enabled=settings.PROMPT_CACHE_ENABLED
+)
@@ -0,0 +1,195 @@
+"""
+Per-upload question banks
+Questions are generated once per upload in the background (at ingest time) and
+tagged by topic and difficulty. Quiz generation samples from the banks of the
+selected uploads instead of making a live LLM call, and banks are topped up
+asynchronously (once per upload at a time) when they run low.
+"""
+import random
+import threading
+from collections import defaultdict
+from typing import List, Dict, Any, Optional
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.models.upload import Upload
+from app.models.question_bank import QuestionBankItem
+from app.services.gemini_service import gemini_service
+from app.services.quiz_generation import is_duplicate
+
+
+class QuestionBankService:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filling = set()  # upload ids with a fill in progress
+
+    def fresh_counts(self, db: Session, upload_ids: List[UUID]) -> Dict[UUID, int]:
+        """Number of questions per upload that haven't hit QUESTION_BANK_MAX_SERVES"""
+        rows = db.query(QuestionBankItem.upload_id, func.count(QuestionBankItem.id)).filter(
+            QuestionBankItem.upload_id.in_(upload_ids),
+            QuestionBankItem.times_served < settings.QUESTION_BANK_MAX_SERVES
+        ).group_by(QuestionBankItem.upload_id).all()
+        counts = {upload_id: 0 for upload_id in upload_ids}
+        counts.update({upload_id: count for upload_id, count in rows})
+        return counts
+
+    def fill_bank(self, upload_id: str, num_questions: Optional[int] = None) -> int:
+        """
+        Generate questions for an upload and add them to its bank
+        Runs in the background with its own database session.
+
+        Returns:
+            Number of questions added (0 if a fill was already running)
+        """
+        with self._lock:
+            if upload_id in self._filling:
+                return 0
+            self._filling.add(upload_id)
+        return self._fill(upload_id, num_questions)
+
+    def _fill(self, upload_id: str, num_questions: Optional[int] = None) -> int:
+        """fill_bank for an upload already marked as filling (the mark is cleared here)"""
+        db = SessionLocal()
+        try:
+            upload = db.query(Upload).filter(Upload.id == upload_id).first()
+            if not upload or upload.status != 'ready' or not upload.text_content:
+                return 0
+
+            questions = gemini_service.generate_quiz(
+                content=upload.text_content,
+                num_questions=num_questions or settings.QUESTION_BANK_SIZE
+            )
+
+            # Regenerating from the same upload repeats questions; keep only new ones
+            banked = [
+                item.question for item in
+                db.query(QuestionBankItem).filter(QuestionBankItem.upload_id == upload.id).all()
+            ]
+            added = 0
+            for question in questions:
+                if any(is_duplicate(question, other) for other in banked):
+                    continue
+                banked.append(question)
+                db.add(QuestionBankItem(
+                    upload_id=upload.id,
+                    question={
+                        "question": question["question"],
+                        "options": question["options"],
+                        "correct": question["correct"],
+                        "explanation": question["explanation"]
+                    },
+                    topic=question.get("topic"),
+                    difficulty=question.get("difficulty")
+                ))
+                added += 1
+            db.commit()
+            return added
+
+        except Exception as e:
+            print(f"Error filling question bank for upload {upload_id}: {str(e)}")
+            db.rollback()
+            return 0
+        finally:
+            db.close()
+            with self._lock:
+                self._filling.discard(upload_id)
+
+    def claim_top_ups(self, db: Session, upload_ids: List[UUID]) -> List[str]:
+        """
+        Uploads whose banks are below QUESTION_BANK_LOW_WATERMARK and not already
+        being filled, marked as filling so only one top-up is queued per upload
+        """
+        low = [
+            str(upload_id) for upload_id, count in self.fresh_counts(db, upload_ids).items()
+            if count < settings.QUESTION_BANK_LOW_WATERMARK
+        ]
+        claimed = []
+        with self._lock:
+            for upload_id in low:
+                if upload_id not in self._filling:
+                    self._filling.add(upload_id)
+                    claimed.append(upload_id)
+        return claimed
+
+    def top_up(self, upload_ids: List[str]):
+        """Refill banks claimed with claim_top_ups"""
+        for upload_id in upload_ids:
+            self._fill(upload_id)
+
+    def sample(
+        self,
+        db: Session,
+        upload_ids: List[UUID],
+        num_questions: int,
+        difficulty: Optional[str] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Sample a quiz from the banks of the selected uploads
+
+        Questions are spread evenly across uploads and, within an upload, across
+        topics, preferring the least-served questions.
+
+        Returns:
+            Questions with ids q1..qN, or None if the banks can't cover num_questions
+        """
+        query = db.query(QuestionBankItem).filter(
+            QuestionBankItem.upload_id.in_(upload_ids),
+            QuestionBankItem.times_served < settings.QUESTION_BANK_MAX_SERVES
+        )
+        if difficulty:
+            query = query.filter(QuestionBankItem.difficulty == difficulty)
+        items = query.all()
+
+        if len(items) < num_questions:
+            return None
+
+        # upload -> topic -> items, least-served first (random among ties)
+        random.shuffle(items)
+        items.sort(key=lambda item: item.times_served)
+        by_upload = defaultdict(lambda: defaultdict(list))
+        for item in items:
+            by_upload[item.upload_id][item.topic or "General"].append(item)
+
+        topic_queues = [list(topics.values()) for topics in by_upload.values()]
+        selected = []
+        while len(selected) < num_questions:
+            for queues in topic_queues:
+                # Take one question from this upload, rotating through its topics
+                while queues:
+                    queue = queues.pop(0)
+                    if queue:
+                        selected.append(queue.pop(0))
+                        if queue:
+                            queues.append(queue)
+                        break
+                if len(selected) >= num_questions:
+                    break
+
+        questions = [
+            {
+                **item.question,
+                "id": f"q{i}",
+                "topic": item.topic,
+                "difficulty": item.difficulty
+            }
+            for i, item in enumerate(selected, 1)
+        ]
+
+        # Incremented in SQL so concurrent quiz requests don't lose serves
+        db.query(QuestionBankItem).filter(
+            QuestionBankItem.id.in_([item.id for item in selected])
+        ).update(
+            {QuestionBankItem.times_served: QuestionBankItem.times_served + 1},
+            synchronize_session=False
+        )
+        db.commit()
+
+        return questions
+
+
+# Singleton instance
+question_bank_service = QuestionBankService()
@@ -0,0 +1,121 @@
+"""
+Background pre-synthesis of quiz audio
+Right after a quiz is saved, every question (with its options) and every
+explanation is synthesized into the audio store with bounded concurrency, so
+read-aloud during the quiz is a cache hit instead of a 1-3 s ElevenLabs call.
+
+The audio ids are content hashes that are known before synthesis, so the quiz
+stores its audio manifest (question id -> audio ids) up front and the URLs can
+be handed out immediately. The URLs are quiz-scoped: a clip that pre-synthesis
+skipped (e.g. rate limited) or the audio store has since evicted is synthesized
+on demand from the quiz's question text.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.models.quiz import Quiz
+from app.services.audio_store import audio_store
+from app.services.rate_limiter import ProviderUnavailableError
+from app.services.usage_meter import usage_meter
+from app.services.voice_service import voice_service
+
+# Questions are read neutrally; explanations with a little warmth
+QUESTION_EMOTION = "neutral"
+EXPLANATION_EMOTION = "encouraging"
+
+
+def question_speech_text(question: Dict[str, Any]) -> str:
+    """What is read aloud for a question: the question followed by its lettered options"""
+    options = " ".join(
+        f"{'ABCDEFGH'[i]}: {option}." for i, option in enumerate(question.get("options", [])[:8])
+    )
+    return f"{question['question']} {options}".strip()
+
+
+class QuizAudioService:
+    def _speech_items(self, questions: List[Dict[str, Any]]) -> List[Tuple[str, str, str, str]]:
+        """(question id, part, text, emotion) for everything to synthesize"""
+        items = []
+        for question in questions:
+            items.append((question["id"], "question", question_speech_text(question), QUESTION_EMOTION))
+            if question.get("explanation"):
+                items.append((question["id"], "explanation", question["explanation"], EXPLANATION_EMOTION))
+        return items
+
+    def speech_item(self, questions: List[Dict[str, Any]], question_id: str, part: str) -> Optional[Tuple[str, str]]:
+        """(text, emotion) read aloud for one part ("question" or "explanation") of a question, or None"""
+        for item_question_id, item_part, text, emotion in self._speech_items(questions):
+            if item_question_id == question_id and item_part == part:
+                return text, emotion
+        return None
+
+    def audio_for(self, questions: List[Dict[str, Any]], question_id: str, part: str) -> Optional[bytes]:
+        """
+        A clip of a quiz, from the audio store or synthesized now on a miss
+        (None if the quiz has no such question/part)
+
+        Raises:
+            ProviderUnavailableError: synthesis is throttled - the client should retry
+        """
+        item = self.speech_item(questions, question_id, part)
+        if item is None:
+            return None
+        text, emotion = item
+        return voice_service.text_to_speech(text=text, **voice_service.get_emotional_voice_settings(emotion))
+
+    def build_manifest(self, questions: List[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
+        """Audio ids per question: {question_id: {"question": audio_id, "explanation": audio_id}}"""
+        manifest = {}
+        for question_id, part, text, emotion in self._speech_items(questions):
+            audio_id = voice_service.speech_key(text=text, **voice_service.get_emotional_voice_settings(emotion))
+            manifest.setdefault(question_id, {})[part] = audio_id
+        return manifest
+
+    def presynthesize(self, quiz_id: str) -> int:
+        """
+        Synthesize all audio for a quiz that isn't already in the audio store
+        Runs in the background with its own database session.
+
+        Returns:
+            Number of clips synthesized
+        """
+        db = SessionLocal()
+        try:
+            quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
+            if not quiz:
+                return 0
+            questions = quiz.questions
+        finally:
+            db.close()
+
+        pending = [
+            (text, emotion) for _, _, text, emotion in self._speech_items(questions)
+            if not audio_store.exists(
+                voice_service.speech_key(text=text, **voice_service.get_emotional_voice_settings(emotion))
+            )
+        ]
+        if not pending:
+            return 0
+
+        def synthesize(item: Tuple[str, str]) -> bool:
+            text, emotion = item
+            try:
+                voice_service.text_to_speech(text=text, **voice_service.get_emotional_voice_settings(emotion))
+                return True
+            except ProviderUnavailableError:
+                # Rate limited or breaker open - the rest is synthesized on demand (audio_for)
+                return False
+            except Exception as e:
+                print(f"Error pre-synthesizing audio for quiz {quiz_id}: {str(e)}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=settings.QUIZ_AUDIO_CONCURRENCY) as executor:
+            synthesized = sum(executor.map(usage_meter.attributed(synthesize), pending))
+
+        return synthesized
+
+
+# Singleton instance
+quiz_audio_service = QuizAudioService()
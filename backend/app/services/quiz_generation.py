@@ -0,0 +1,325 @@
+"""
+Map-reduce quiz generation
+Splits course content into topic-coherent segments, generates questions for each
+segment concurrently, then de-duplicates and balances them to the requested count.
+Content with more segments than the quiz can use has adjacent segments merged, so
+the number of LLM calls is bounded by the question count rather than the course
+size while all of the material is still sent.
+Shared by the Gemini and DigitalOcean quiz generators.
+"""
+import math
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from typing import List, Dict, Any, Callable, Iterator, Optional
+
+from app.core.config import settings
+from app.services.usage_meter import usage_meter
+
+# Upload boundaries inserted by the quiz endpoints ("--- file.pdf ---")
+SECTION_MARKER = re.compile(r"\n\s*---\s*.+?\s*---\s*\n")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Generate a few extra questions per segment so de-duplication still leaves enough
+OVERGENERATION_FACTOR = 1.25
+
+
+def validate_question(question: Any) -> Optional[Dict[str, Any]]:
+    """
+    Check a generated question has the quiz shape, normalizing what we safely can
+    (e.g. "B" or "1" as the correct answer). Returns None if it's unusable.
+    """
+    if not isinstance(question, dict):
+        return None
+
+    text = question.get("question")
+    options = question.get("options")
+    if not isinstance(text, str) or not text.strip():
+        return None
+    if not isinstance(options, list) or len(options) < 2:
+        return None
+    options = [str(option) for option in options]
+
+    correct = question.get("correct")
+    if isinstance(correct, str):
+        correct = correct.strip()
+        if len(correct) == 1 and correct.upper() in "ABCDEFGH":
+            correct = "ABCDEFGH".index(correct.upper())
+        elif correct.isdigit():
+            correct = int(correct)
+    if isinstance(correct, bool) or not isinstance(correct, int) or not 0 <= correct < len(options):
+        return None
+
+    validated = {
+        "question": text.strip(),
+        "options": options,
+        "correct": correct,
+        "explanation": str(question.get("explanation") or "")
+    }
+    for optional in ("id", "topic", "difficulty"):
+        if question.get(optional):
+            validated[optional] = str(question[optional])
+    return validated
+
+
+def validate_questions(questions: List[Any]) -> List[Dict[str, Any]]:
+    """Keep only the questions that pass validate_question"""
+    return [q for q in (validate_question(question) for question in questions) if q]
+
+
+def _split_oversized(text: str, max_chars: int) -> List[str]:
+    """Split a block larger than max_chars on sentence boundaries (words as a last resort)"""
+    pieces = []
+    current = ""
+    for sentence in SENTENCE_END.split(text):
+        if len(sentence) > max_chars:
+            words = sentence.split()
+            sentence = ""
+            for word in words:
+                if len(sentence) + len(word) + 1 > max_chars and sentence:
+                    pieces.append(sentence)
+                    sentence = ""
+                sentence = f"{sentence} {word}" if sentence else word
+        if len(current) + len(sentence) + 1 > max_chars and current:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_segments(content: str, max_chars: int = None) -> List[str]:
+    """
+    Split content into segments of at most max_chars
+
+    Segments never straddle an upload boundary, and paragraphs are kept together
+    where possible so each segment covers a coherent set of topics.
+    """
+    max_chars = max_chars or settings.QUIZ_SEGMENT_CHARS
+    segments = []
+
+    for section in SECTION_MARKER.split(content):
+        current = ""
+        for paragraph in PARAGRAPH_BREAK.split(section):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            blocks = [paragraph] if len(paragraph) <= max_chars else _split_oversized(paragraph, max_chars)
+            for block in blocks:
+                if len(current) + len(block) + 2 > max_chars and current:
+                    segments.append(current)
+                    current = ""
+                current = f"{current}\n\n{block}" if current else block
+        if current:
+            segments.append(current)
+
+    return segments
+
+
+def merge_segments(segments: List[str], num_questions: int) -> List[str]:
+    """
+    At most ~num_questions * OVERGENERATION_FACTOR segments, merging runs of
+    adjacent segments into groups of roughly equal length (in order)
+
+    Each segment is an LLM call and gets at least one question, so a large course
+    would otherwise fan out into far more calls than the quiz can use. Merging
+    makes each call cover more text instead of leaving material out.
+    """
+    max_segments = max(1, math.ceil(num_questions * OVERGENERATION_FACTOR))
+    if len(segments) <= max_segments:
+        return segments
+
+    # Place each segment in the group its midpoint falls in along the content
+    total_chars = sum(len(segment) for segment in segments) or 1
+    groups: List[List[str]] = [[] for _ in range(max_segments)]
+    offset = 0
+    for segment in segments:
+        index = min(max_segments - 1, int((offset + len(segment) / 2) * max_segments / total_chars))
+        groups[index].append(segment)
+        offset += len(segment)
+    return ["\n\n".join(group) for group in groups if group]
+
+
+def allocate_questions(segments: List[str], num_questions: int) -> List[int]:
+    """Questions to request per segment, proportional to segment length (at least 1 each)"""
+    total_chars = sum(len(segment) for segment in segments) or 1
+    target = num_questions * OVERGENERATION_FACTOR
+    return [max(1, round(target * len(segment) / total_chars)) for segment in segments]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^a-z0-9 ]", "", (text or "").lower()).strip()
+
+
+def is_duplicate(question: Dict[str, Any], other: Dict[str, Any], threshold: float = 0.85) -> bool:
+    """Near-duplicate check on normalized question text"""
+    a = _normalize(question.get("question", ""))
+    b = _normalize(other.get("question", ""))
+    if not a or not b:
+        return False
+    if a == b:
+        return True
+    return SequenceMatcher(None, a, b).ratio() >= threshold
+
+
+def deduplicate_questions(questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop near-duplicate questions, keeping the first occurrence"""
+    unique = []
+    for question in questions:
+        if not any(is_duplicate(question, kept) for kept in unique):
+            unique.append(question)
+    return unique
+
+
+def balance_questions(per_segment: List[List[Dict[str, Any]]], num_questions: int) -> List[Dict[str, Any]]:
+    """
+    Pick num_questions round-robin across segments so questions are spread over
+    the material, skipping near-duplicates of already chosen questions
+    """
+    selected = []
+    queues = [list(questions) for questions in per_segment]
+    while len(selected) < num_questions and any(queues):
+        for pending in queues:
+            while pending:
+                candidate = pending.pop(0)
+                if not any(is_duplicate(candidate, kept) for kept in selected):
+                    selected.append(candidate)
+                    break
+            if len(selected) >= num_questions:
+                break
+    return selected
+
+
+def map_reduce_quiz(
+    content: str,
+    num_questions: int,
+    generate_segment: Callable[[str, int], List[Dict[str, Any]]],
+    max_segment_chars: int = None,
+    max_workers: int = None
+) -> List[Dict[str, Any]]:
+    """
+    Generate a quiz over the full content
+
+    Args:
+        content: Full course content
+        num_questions: Number of questions wanted
+        generate_segment: fn(segment_text, n) -> list of question dicts (may raise)
+        max_segment_chars: Segment size (defaults to QUIZ_SEGMENT_CHARS)
+        max_workers: Concurrent segment generations (defaults to QUIZ_GENERATION_CONCURRENCY)
+
+    Returns:
+        Up to num_questions de-duplicated questions with ids q1..qN
+    """
+    segments = merge_segments(split_into_segments(content, max_segment_chars), num_questions)
+    if not segments:
+        return []
+
+    # Small content: one generation, no reduce step needed
+    if len(segments) == 1:
+        questions = deduplicate_questions(generate_segment(segments[0], num_questions))[:num_questions]
+    else:
+        allocation = allocate_questions(segments, num_questions)
+        max_workers = max_workers or settings.QUIZ_GENERATION_CONCURRENCY
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(segments))) as executor:
+            futures = [
+                executor.submit(usage_meter.attributed(generate_segment), segment, count)
+                for segment, count in zip(segments, allocation)
+            ]
+
+        per_segment = []
+        errors = []
+        for future in futures:
+            try:
+                per_segment.append(future.result() or [])
+            except Exception as e:
+                print(f"Quiz segment generation failed: {str(e)}")
+                errors.append(e)
+
+        if errors and not any(per_segment):
+            raise errors[0]
+
+        questions = balance_questions(per_segment, num_questions)
+
+    for i, question in enumerate(questions, 1):
+        question["id"] = f"q{i}"
+
+    return questions
+
+
+def stream_map_reduce_quiz(
+    content: str,
+    num_questions: int,
+    stream_segment: Callable[[str, int], Iterator[Dict[str, Any]]],
+    max_segment_chars: int = None,
+    max_workers: int = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming variant of map_reduce_quiz
+
+    Segments are generated concurrently and every validated, non-duplicate
+    question is yielded (with ids q1..qN) as soon as any segment produces it.
+
+    Args:
+        stream_segment: fn(segment_text, n) -> iterator of question dicts
+    """
+    segments = merge_segments(split_into_segments(content, max_segment_chars), num_questions)
+    if not segments:
+        return
+
+    allocation = allocate_questions(segments, num_questions) if len(segments) > 1 else [num_questions]
+    max_workers = min(max_workers or settings.QUIZ_GENERATION_CONCURRENCY, len(segments))
+    results: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+    finished = object()
+
+    def worker(segment: str, count: int):
+        try:
+            # Don't open a generation once the quiz is complete or the client has gone
+            if stop.is_set():
+                return
+            stream = stream_segment(segment, count)
+            try:
+                for question in stream:
+                    if stop.is_set():
+                        break
+                    results.put(question)
+            finally:
+                if hasattr(stream, "close"):
+                    stream.close()  # Ends the underlying LLM stream early
+        except Exception as e:
+            print(f"Quiz segment generation failed: {str(e)}")
+            results.put(e)
+        finally:
+            results.put(finished)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    for segment, count in zip(segments, allocation):
+        executor.submit(usage_meter.attributed(worker), segment, count)
+
+    selected = []
+    errors = []
+    remaining = len(segments)
+    try:
+        while remaining and len(selected) < num_questions:
+            item = results.get()
+            if item is finished:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                errors.append(item)
+            else:
+                question = validate_question(item)
+                if question and not any(is_duplicate(question, kept) for kept in selected):
+                    selected.append(question)
+                    question["id"] = f"q{len(selected)}"
+                    yield question
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if errors and not selected:
+        raise errors[0]
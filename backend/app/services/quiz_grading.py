@@ -0,0 +1,80 @@
+"""
+Quiz grading
+A submission is graded once, at submit time, into the attempt's performance_data:
+per-question correctness, the topic of every question and per-topic accuracy
+(with weak/strong topics derived from it). Results pages and analytics read
+these stored values instead of re-grading the quiz on every request.
+"""
+from typing import List, Dict, Any
+
+DEFAULT_TOPIC = "General"
+
+# Per-topic accuracy (%) below which a topic is weak, and at or above which it is strong
+WEAK_TOPIC_THRESHOLD = 60.0
+STRONG_TOPIC_THRESHOLD = 80.0
+
+
+def grade_attempt(questions: List[Dict[str, Any]], answers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Grade answers against a quiz's questions in one pass
+
+    Args:
+        questions: Quiz questions ({id, correct, topic?, ...})
+        answers: [{question_id, selected_answer}]; unanswered questions count as wrong
+
+    Returns:
+        performance_data: {
+            'score': float (0-100),
+            'correct_answers': int,
+            'total_questions': int,
+            'results': [{question_id, selected_answer, correct_answer, is_correct, topic}],
+            'accuracy_by_topic': {topic: {'correct': int, 'total': int, 'accuracy': float}},
+            'weak_topics': [...],   # accuracy < WEAK_TOPIC_THRESHOLD, weakest first
+            'strong_topics': [...]  # accuracy >= STRONG_TOPIC_THRESHOLD, strongest first
+        }
+
+    Questions without a topic are graded under DEFAULT_TOPIC, which is kept out of
+    weak/strong topics (it says nothing about what to study).
+    """
+    answers_dict = {answer["question_id"]: answer["selected_answer"] for answer in answers}
+    results = []
+    by_topic: Dict[str, Dict[str, Any]] = {}
+    correct_count = 0
+
+    for question in questions:
+        selected_answer = answers_dict.get(question["id"], -1)
+        is_correct = selected_answer == question["correct"]
+        topic = question.get("topic") or DEFAULT_TOPIC
+
+        correct_count += is_correct
+        counts = by_topic.setdefault(topic, {"correct": 0, "total": 0})
+        counts["correct"] += is_correct
+        counts["total"] += 1
+
+        results.append({
+            "question_id": question["id"],
+            "selected_answer": selected_answer,
+            "correct_answer": question["correct"],
+            "is_correct": is_correct,
+            "topic": topic
+        })
+
+    for counts in by_topic.values():
+        counts["accuracy"] = round(counts["correct"] / counts["total"] * 100, 2)
+
+    ranked = sorted(by_topic, key=lambda topic: by_topic[topic]["accuracy"])
+    total_questions = len(questions)
+
+    return {
+        "score": (correct_count / total_questions * 100) if total_questions > 0 else 0,
+        "correct_answers": correct_count,
+        "total_questions": total_questions,
+        "results": results,
+        "accuracy_by_topic": by_topic,
+        "weak_topics": [
+            t for t in ranked if t != DEFAULT_TOPIC and by_topic[t]["accuracy"] < WEAK_TOPIC_THRESHOLD
+        ],
+        "strong_topics": [
+            t for t in reversed(ranked) if t != DEFAULT_TOPIC and by_topic[t]["accuracy"] >= STRONG_TOPIC_THRESHOLD
+        ]
+    }
@@ -0,0 +1,281 @@
+"""
+Per-provider rate limiting and circuit breaking
+Every external AI provider (Gemini, DigitalOcean/OpenRouter, Snowflake Cortex, ElevenLabs)
+is called through a ProviderGuard so that a throttled or failing API is not hammered:
+- Token buckets cap requests/min and tokens/min; callers queue briefly or fail fast
+- A circuit breaker opens after consecutive failures and rejects calls until it cools down
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator
+
+from app.core.config import settings
+
+
+class ProviderUnavailableError(Exception):
+    """Raised when a provider call is rejected before reaching the provider"""
+
+    def __init__(self, provider: str, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class RateLimitExceededError(ProviderUnavailableError):
+    """Provider capacity would not free up within the allowed wait"""
+
+
+class CircuitOpenError(ProviderUnavailableError):
+    """Provider circuit is open after repeated failures"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used for tokens/min budgeting"""
+    if not text:
+        return 1
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`"""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.refill_per_second = float(rate_per_minute) / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)"""
+        self._refill(now)
+        # Requests bigger than the bucket are allowed once it is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Combined requests/min and tokens/min limiter for one provider"""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens: int = 1, max_wait: float = 0.0) -> float:
+        """
+        Reserve one request and `tokens` tokens, sleeping up to `max_wait` seconds
+
+        Returns:
+            0.0 on success, otherwise the wait that would have been needed
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait == 0.0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    return 0.0
+            if now + wait > deadline:
+                return wait
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker
+    Opens after `failure_threshold` consecutive failures, then lets a single trial
+    call through once `recovery_seconds` have passed.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, recovery_seconds: float):
+        self._lock = threading.Lock()
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> float:
+        """Return 0.0 if a call may proceed, otherwise seconds until the next trial"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+
+            now = time.monotonic()
+            remaining = self.opened_at + self.recovery_seconds - now
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return 0.0
+
+            return max(remaining, 1.0)
+
+    def release_trial(self):
+        """Give back a half-open trial slot that was granted but not used"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class ProviderGuard:
+    """Rate limiter + circuit breaker in front of a single provider"""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        failure_threshold: int = 5,
+        recovery_seconds: float = 30.0,
+        max_wait_seconds: float = 10.0
+    ):
+        self.name = name
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.breaker = CircuitBreaker(failure_threshold, recovery_seconds)
+        self.max_wait_seconds = max_wait_seconds
+        self.rejected_calls = 0
+
+    @contextmanager
+    def slot(self, tokens: int = 1, wait: bool = True, defer_success: bool = False):
+        """
+        Guard a provider call
+
+        Usage:
+            with gemini_guard.slot(tokens=estimate_tokens(prompt)):
+                response = model.generate_content(prompt)
+
+        Any exception raised inside the block counts as a provider failure.
+        With defer_success, a block that only starts work (e.g. an async query)
+        doesn't count as a success; the caller records the outcome on
+        self.breaker once the work finishes.
+
+        Raises:
+            CircuitOpenError: provider is failing, call rejected without a round trip
+            RateLimitExceededError: capacity not available within the allowed wait
+        """
+        retry_after = self.breaker.allow()
+        if retry_after:
+            self.rejected_calls += 1
+            raise CircuitOpenError(
+                self.name,
+                f"{self.name} is temporarily unavailable (circuit open), retry in {retry_after:.0f}s",
+                retry_after
+            )
+
+        retry_after = self.limiter.acquire(tokens, self.max_wait_seconds if wait else 0.0)
+        if retry_after:
+            self.rejected_calls += 1
+            self.breaker.release_trial()
+            raise RateLimitExceededError(
+                self.name,
+                f"{self.name} rate limit reached, retry in {retry_after:.0f}s",
+                retry_after
+            )
+
+        try:
+            yield
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        else:
+            if not defer_success:
+                self.breaker.record_success()
+
+    def settle_stream(self, chunks: Iterator[Any]) -> Iterator[Any]:
+        """
+        Yield from a stream opened under slot(defer_success=True), recording the
+        outcome on the breaker once it ends: a stream that fails midway counts
+        as a provider failure, one abandoned by the consumer counts as neither
+        """
+        try:
+            for chunk in chunks:
+                yield chunk
+        except GeneratorExit:
+            self.breaker.release_trial()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current limiter/breaker state for status endpoints"""
+        return {
+            "circuit_state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "rejected_calls": self.rejected_calls,
+            "requests_per_minute": int(self.limiter.requests.capacity),
+            "tokens_per_minute": int(self.limiter.tokens.capacity)
+        }
+
+
+def _build_guard(name: str, requests_per_minute: int, tokens_per_minute: int) -> ProviderGuard:
+    return ProviderGuard(
+        name=name,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        recovery_seconds=settings.CIRCUIT_BREAKER_RECOVERY_SECONDS,
+        max_wait_seconds=settings.PROVIDER_MAX_WAIT_SECONDS
+    )
+
+
+# Shared guards - one per provider, used by every service instance
+provider_guards: Dict[str, ProviderGuard] = {
+    "gemini": _build_guard(
+        "gemini", settings.GEMINI_REQUESTS_PER_MINUTE, settings.GEMINI_TOKENS_PER_MINUTE
+    ),
+    "digitalocean": _build_guard(
+        "digitalocean", settings.DIGITALOCEAN_REQUESTS_PER_MINUTE, settings.DIGITALOCEAN_TOKENS_PER_MINUTE
+    ),
+    "snowflake": _build_guard(
+        "snowflake", settings.SNOWFLAKE_REQUESTS_PER_MINUTE, settings.SNOWFLAKE_TOKENS_PER_MINUTE
+    ),
+    "elevenlabs": _build_guard(
+        "elevenlabs", settings.ELEVENLABS_REQUESTS_PER_MINUTE, settings.ELEVENLABS_TOKENS_PER_MINUTE
+    ),
+}
+
+
+def get_provider_guard(name: str) -> ProviderGuard:
+    """Get the shared guard for a provider"""
+    return provider_guards[name]
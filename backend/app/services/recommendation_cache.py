@@ -0,0 +1,102 @@
+"""
+Cached study recommendations
+Generating recommendations runs a Snowflake Cortex COMPLETE, which is far too
+slow to repeat on every dashboard load. Recommendations are cached per scope
+(a user, or a user's course) together with a fingerprint of the inputs they
+were generated from (weak/strong topics, recent scores). While the fingerprint
+is unchanged the cached plan is served as-is; once a new attempt changes it,
+the previous plan is still served immediately (stale-while-revalidate) while a
+fresh one is generated in the background.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.services.usage_meter import usage_meter
+
+# Fallback (non-Cortex) plans are only kept briefly so Cortex is retried soon
+FALLBACK_TTL_SECONDS = 300
+
+
+def fingerprint(inputs: Dict[str, Any]) -> str:
+    """sha256 over the canonical JSON form of the recommendation inputs"""
+    canonical = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RecommendationCache:
+    def __init__(self, maxsize: int = 10000, max_stale_seconds: float = 86400, refresh_workers: int = 2):
+        self.max_stale_seconds = max_stale_seconds
+        self._entries = TTLCache(maxsize=maxsize)
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="recommendations")
+        self._lock = threading.Lock()
+        self._refreshing = set()  # scopes with a background refresh in flight
+
+    def get(self, scope: Hashable, inputs: Dict[str, Any], compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Recommendations for scope, computing them only when the inputs changed
+
+        Args:
+            scope: e.g. ("user", user_id) or ("course", user_id, course_id)
+            inputs: Everything the recommendations depend on
+            compute: Generates recommendations (may raise)
+        """
+        current = fingerprint(inputs)
+        entry = self._entries.get(scope)
+
+        if entry is not None:
+            if entry["fingerprint"] == current:
+                return entry["data"]
+            # Inputs changed: serve the previous plan while a new one is generated
+            if time.monotonic() - entry["computed_at"] < self.max_stale_seconds:
+                self._refresh(scope, current, compute)
+                return entry["data"]
+
+        data = compute()
+        self._store(scope, current, data)
+        return data
+
+    def seed(self, scope: Hashable, seed_fingerprint: str, data: Dict[str, Any], age_seconds: float = 0.0):
+        """Prime an empty scope with an already generated plan (e.g. a precomputed one)"""
+        if self._entries.get(scope) is None:
+            self._entries.set(scope, {
+                "fingerprint": seed_fingerprint,
+                "data": data,
+                "computed_at": time.monotonic() - age_seconds
+            })
+
+    def invalidate(self, scope: Hashable):
+        self._entries.pop(scope)
+
+    def _store(self, scope: Hashable, current: str, data: Dict[str, Any]):
+        ttl = FALLBACK_TTL_SECONDS if data.get("source") else None
+        self._entries.set(scope, {"fingerprint": current, "data": data, "computed_at": time.monotonic()}, ttl)
+
+    def _refresh(self, scope: Hashable, current: str, compute: Callable[[], Dict[str, Any]]):
+        with self._lock:
+            if scope in self._refreshing:
+                return
+            self._refreshing.add(scope)
+
+        def run():
+            try:
+                self._store(scope, current, compute())
+            except Exception as e:
+                print(f"Error refreshing study recommendations: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(scope)
+
+        self._executor.submit(usage_meter.attributed(run))
+
+
+# Singleton instance
+recommendation_cache = RecommendationCache(
+    maxsize=settings.RECOMMENDATION_CACHE_MAX_ENTRIES,
+    max_stale_seconds=settings.RECOMMENDATION_MAX_STALE_SECONDS
+)
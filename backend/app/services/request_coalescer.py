@@ -0,0 +1,131 @@
+"""
+Request coalescing for expensive AI operations
+- Single-flight: concurrent identical calls (same operation, inputs and user) share
+  one in-flight provider call and its result instead of each paying for it
+- Idempotency-Key: a retried request with the same key replays the stored result
+  for IDEMPOTENCY_WINDOW_SECONDS
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+
+class IdempotencyKeyReusedError(Exception):
+    """An Idempotency-Key was reused with a different request"""
+
+
+def canonical_key(operation: str, inputs: Dict[str, Any], user_scope: str) -> str:
+    """sha256 over the canonical JSON form of (operation, inputs, user scope)"""
+    canonical = json.dumps(
+        {"operation": operation, "inputs": inputs, "user": user_scope},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls that share a key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _InFlightCall] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class RequestCoalescer:
+    def __init__(self, window_seconds: float, max_entries: int):
+        self.single_flight = SingleFlight()
+        self.idempotent_results = TTLCache(maxsize=max_entries, ttl_seconds=window_seconds)
+
+    def run(
+        self,
+        operation: str,
+        inputs: Dict[str, Any],
+        user_scope: str,
+        fn: Callable[[], Any],
+        idempotency_key: Optional[str] = None,
+        store: Optional[Callable[[Any], Any]] = None,
+        load: Optional[Callable[[Any], Any]] = None
+    ) -> Any:
+        """
+        Run fn once per distinct (operation, inputs, user) among concurrent callers
+
+        Args:
+            operation: Name of the operation, e.g. "quiz.generate"
+            inputs: Request inputs that determine the result
+            user_scope: User id - results are never shared across users
+            fn: Produces the result
+            idempotency_key: Optional client-supplied Idempotency-Key header
+            store/load: Keep a small reference instead of a large result for
+                Idempotency-Key replays (e.g. an audio store key), and resolve it
+                again on replay; if load returns None the request is run again
+
+        Raises:
+            IdempotencyKeyReusedError: the key was already used for different inputs
+        """
+        # Fingerprint of the request; a reused key must come with the same one
+        key = canonical_key(operation, inputs, user_scope)
+        stored_key = (user_scope, operation, idempotency_key)
+
+        if idempotency_key:
+            stored = self.idempotent_results.get(stored_key)
+            if stored is not None:
+                request_key, result = stored
+                if request_key != key:
+                    raise IdempotencyKeyReusedError(
+                        "Idempotency-Key was already used for a different request"
+                    )
+                if load is not None:
+                    result = load(result)
+                if result is not None:
+                    return result
+
+        result = self.single_flight.do(key, fn)
+
+        if idempotency_key:
+            self.idempotent_results.set(stored_key, (key, store(result) if store is not None else result))
+        return result
+
+
+# Singleton instance
+request_coalescer = RequestCoalescer(
+    window_seconds=settings.IDEMPOTENCY_WINDOW_SECONDS,
+    max_entries=settings.IDEMPOTENCY_MAX_ENTRIES
+)
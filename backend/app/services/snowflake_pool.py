@@ -0,0 +1,218 @@
+"""
+Snowflake connection pool
+Opening a Snowflake connection means a login round trip plus session setup,
+often more than a second. The pool keeps authenticated connections open and
+hands them out per query:
+- Between min_size and max_size connections; callers wait (bounded) when all are busy
+- Connections idle longer than idle_timeout are closed, down to min_size
+- A connection idle longer than health_check_interval is pinged before reuse
+- Checkout is a context manager, so a connection is always returned or discarded
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+from app.services.rate_limiter import ProviderUnavailableError
+
+
+class PoolExhaustedError(ProviderUnavailableError):
+    """No connection became free within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections created by `connect`"""
+
+    def __init__(
+        self,
+        name: str,
+        connect: Callable[[], Any],
+        min_size: int = 1,
+        max_size: int = 8,
+        idle_timeout: float = 600.0,
+        health_check_interval: float = 60.0,
+        acquire_timeout: float = 10.0
+    ):
+        self.name = name
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, last_used), most recently used on the right
+        self._size = 0  # Open connections, idle or checked out
+
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.failed_health_checks = 0
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of the block
+
+        Usage:
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+
+        A connection that is closed when the block exits (e.g. after a network
+        error) is discarded instead of being returned to the pool.
+
+        Raises:
+            PoolExhaustedError: every connection stayed busy for acquire_timeout
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if self._is_closed(conn):
+                self._discard(conn)
+            else:
+                self._release(conn)
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        waited = False
+        started = time.monotonic()
+
+        while True:
+            with self._cond:
+                expired = self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    create = False
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        self.wait_seconds += time.monotonic() - started
+                        raise PoolExhaustedError(
+                            self.name,
+                            f"{self.name} connection pool exhausted ({self.max_size} in use)",
+                            1.0
+                        )
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    self._cond.wait(remaining)
+                    continue
+
+            for expired_conn in expired:
+                self._close(expired_conn)
+
+            if create:
+                # Connect outside the lock so a slow login doesn't block other checkouts
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self.created += 1
+            elif time.monotonic() - last_used > self.health_check_interval and not self._healthy(conn):
+                with self._cond:
+                    self.failed_health_checks += 1
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self.checkouts += 1
+                if waited:
+                    self.wait_seconds += time.monotonic() - started
+            return conn
+
+    def _release(self, conn):
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self.closed += 1
+            self._cond.notify()
+
+    def _evict_idle(self) -> list:
+        """
+        Take connections idle past idle_timeout out of the pool, keeping min_size
+        open (lock held). Returns them so they can be closed outside the lock.
+        """
+        now = time.monotonic()
+        expired = []
+        # Least recently used connections are on the left
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self.closed += 1
+            expired.append(conn)
+        return expired
+
+    def _healthy(self, conn) -> bool:
+        try:
+            if self._is_closed(conn):
+                return False
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _is_closed(self, conn) -> bool:
+        is_closed = getattr(conn, "is_closed", None)
+        try:
+            return bool(is_closed()) if callable(is_closed) else False
+        except Exception:
+            return True
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Error closing {self.name} connection: {str(e)}")
+
+    def close_all(self):
+        """Close every idle connection, e.g. at shutdown (checked-out ones are returned as usual)"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self.closed += len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool size and checkout metrics for status endpoints"""
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "average_wait_seconds": round(self.wait_seconds / self.waits, 3) if self.waits else 0.0,
+                "timeouts": self.timeouts,
+                "failed_health_checks": self.failed_health_checks
+            }
@@ -3,9 +3,113 @@ Snowflake Cortex AI integration service
 Provides AI-powered features using Snowflake's Cortex AI capabilities
 """
 import snowflake.connector
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 import json
+import time
 from app.core.config import settings
+from app.services.rate_limiter import get_provider_guard, estimate_tokens, ProviderUnavailableError
+from app.services.transport import provider_transport
+from app.services.usage_meter import usage_meter
+from app.services.snowflake_pool import ConnectionPool
+
+# mixtral-8x7b is available in most regions
+# Available models: mistral-7b, mixtral-8x7b, llama2-70b-chat, llama3-8b, llama3-70b
+CORTEX_MODEL = "mixtral-8x7b"
+
+# Status polling backs off from SNOWFLAKE_POLL_INTERVAL_SECONDS up to this
+MAX_POLL_INTERVAL_SECONDS = 2.0
+
+
+class SnowflakeQueryTimeoutError(ProviderUnavailableError):
+    """A query ran past its deadline and was cancelled"""
+
+
+class SnowflakeQuery:
+    """
+    A query submitted with execute_async, tracked by its query id
+
+    Submitting returns as soon as Snowflake has accepted the query, so the caller
+    can do other work (Postgres queries, LLM calls) while it runs and collect the
+    rows later with result(). Polls check out pooled connections only briefly.
+    """
+
+    def __init__(self, service: "SnowflakeService", query_id: str, deadline: float):
+        self.service = service
+        self.query_id = query_id
+        self.deadline = deadline
+        self._settled = False  # Outcome recorded on the circuit breaker
+
+    def done(self) -> bool:
+        """True once the query has finished (successfully or not)"""
+        with self.service.pool.connection() as conn:
+            return not conn.is_still_running(conn.get_query_status(self.query_id))
+
+    def result(self) -> List[list]:
+        """
+        Wait for the query and fetch all rows
+        The outcome goes to the Snowflake circuit breaker: submission alone
+        doesn't count as a success, so failing or timing-out Cortex queries open
+        the circuit.
+
+        Raises:
+            SnowflakeQueryTimeoutError: the deadline passed; the query was cancelled
+            snowflake.connector.errors.ProgrammingError: the query failed
+        """
+        breaker = self.service.guard.breaker
+        try:
+            rows = self._wait()
+        except SnowflakeQueryTimeoutError:
+            self._settle(breaker.record_failure)
+            raise
+        except ProviderUnavailableError:
+            # Local pool exhaustion says nothing about Snowflake's health
+            self._settle(breaker.release_trial)
+            raise
+        except Exception:
+            self._settle(breaker.record_failure)
+            raise
+        self._settle(breaker.record_success)
+        return rows
+
+    def _settle(self, record: Callable[[], None]):
+        if not self._settled:
+            self._settled = True
+            record()
+
+    def _wait(self) -> List[list]:
+        interval = settings.SNOWFLAKE_POLL_INTERVAL_SECONDS
+        while True:
+            with self.service.pool.connection() as conn:
+                status = conn.get_query_status_throw_if_error(self.query_id)
+                if not conn.is_still_running(status):
+                    cursor = conn.cursor()
+                    try:
+                        cursor.get_results_from_sfqid(self.query_id)
+                        return [list(row) for row in cursor.fetchall()]
+                    finally:
+                        cursor.close()
+
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                self.cancel()
+                raise SnowflakeQueryTimeoutError(
+                    "snowflake",
+                    f"Snowflake query {self.query_id} exceeded its deadline and was cancelled"
+                )
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+
+    def cancel(self):
+        """Cancel the query in Snowflake (no-op if it already finished)"""
+        try:
+            with self.service.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("SELECT SYSTEM$CANCEL_QUERY(%s)", (self.query_id,))
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print(f"Error cancelling Snowflake query {self.query_id}: {str(e)}")
 
 
 class SnowflakeService:
@@ -17,7 +121,19 @@ class SnowflakeService:
         self.schema = settings.SNOWFLAKE_SCHEMA
         self.warehouse = settings.SNOWFLAKE_WAREHOUSE
         self.use_cortex = settings.SNOWFLAKE_USE_CORTEX
-        self.enabled = self._check_enabled()
+        # Replayed recordings need no credentials
+        self.enabled = self._check_enabled() or provider_transport.replaying
+        self.guard = get_provider_guard("snowflake")
+        # Authenticated sessions are reused across queries instead of logging in per call
+        self.pool = ConnectionPool(
+            "snowflake",
+            self.get_connection,
+            min_size=settings.SNOWFLAKE_POOL_MIN_SIZE,
+            max_size=settings.SNOWFLAKE_POOL_MAX_SIZE,
+            idle_timeout=settings.SNOWFLAKE_POOL_IDLE_TIMEOUT_SECONDS,
+            health_check_interval=settings.SNOWFLAKE_POOL_HEALTH_CHECK_SECONDS,
+            acquire_timeout=settings.SNOWFLAKE_POOL_ACQUIRE_TIMEOUT_SECONDS
+        )
 
     def _check_enabled(self) -> bool:
         """Check if Snowflake is configured and enabled"""
@@ -30,7 +146,7 @@ class SnowflakeService:
         return True
 
     def get_connection(self):
-        """Create Snowflake connection"""
+        """Create a new Snowflake connection (queries check one out of self.pool instead)"""
         if not self.enabled:
             raise Exception("Snowflake is not configured. Set SNOWFLAKE_* environment variables.")
 
@@ -43,6 +159,72 @@ class SnowflakeService:
             warehouse=self.warehouse
         )
 
+    def submit(self, query: str, params=None, tokens: int = 1, timeout: Optional[float] = None) -> SnowflakeQuery:
+        """
+        Start a query without waiting for it (execute_async), through the shared
+        Snowflake rate limiter/circuit breaker
+
+        Args:
+            timeout: Seconds until the query is cancelled (default SNOWFLAKE_QUERY_TIMEOUT_SECONDS)
+        """
+        timeout = timeout or settings.SNOWFLAKE_QUERY_TIMEOUT_SECONDS
+        # The breaker outcome is recorded when the rows are collected (SnowflakeQuery.result)
+        with self.guard.slot(tokens=tokens, defer_success=True), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute_async(query, params)
+                query_id = cursor.sfqid
+            finally:
+                cursor.close()
+        return SnowflakeQuery(self, query_id, time.monotonic() + timeout)
+
+    def _start(
+        self,
+        operation: str,
+        request: Dict[str, Any],
+        query: str,
+        params=None,
+        tokens: int = 1,
+        timeout: Optional[float] = None
+    ) -> Callable[[], List[list]]:
+        """
+        Start a query and return a function that waits for its rows
+
+        Live calls run asynchronously in Snowflake (metered from submission until
+        the rows are collected); when recording or replaying, the call completes
+        here through the record/replay transport.
+        """
+        if provider_transport.mode != "live":
+            rows = provider_transport.call(
+                "snowflake",
+                operation,
+                request,
+                lambda: self.submit(query, params, tokens, timeout).result()
+            )
+            return lambda: rows
+
+        metered = usage_meter.begin("snowflake", operation, request)
+        try:
+            submitted = self.submit(query, params, tokens, timeout)
+        except BaseException as e:
+            metered.finish(error=e)
+            raise
+
+        def collect() -> List[list]:
+            try:
+                rows = submitted.result()
+            except BaseException as e:
+                metered.finish(error=e)
+                raise
+            metered.finish(rows)
+            return rows
+
+        return collect
+
+    def _query(self, query: str, params=None, tokens: int = 1, timeout: Optional[float] = None) -> List[list]:
+        """Run a query and fetch all rows, cancelling it if it runs past the deadline"""
+        return self._start("query", {"query": query, "params": params}, query, params, tokens, timeout)()
+
     def generate_study_recommendations(
         self,
         weak_topics: List[str],
@@ -67,22 +249,74 @@ class SnowflakeService:
                 "priority_topics": ["Topic 1", "Topic 2"]
             }
         """
+        return self.start_study_recommendations(weak_topics, strong_topics, recent_scores, context)()
+
+    def start_study_recommendations(
+        self,
+        weak_topics: List[str],
+        strong_topics: List[str],
+        recent_scores: List[float],
+        context: str = "",
+        timeout: Optional[float] = None
+    ) -> Callable[[], Dict[str, Any]]:
+        """
+        Start generating recommendations in Snowflake and return a function that
+        waits for them (same result and fallbacks as generate_study_recommendations)
+        """
+        def basic() -> Dict[str, Any]:
+            return self._generate_basic_recommendations(weak_topics, strong_topics, recent_scores)
+
         if not self.enabled or not self.use_cortex:
             # Return basic recommendations without Snowflake
-            return self._generate_basic_recommendations(weak_topics, strong_topics, recent_scores)
+            return basic
 
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            prompt = self._recommendation_prompt(weak_topics, strong_topics, recent_scores, context)
 
-            # Build prompt for Cortex AI
-            # Note: Avoid % signs in f-strings to prevent SQL formatting issues
-            weak_list = ', '.join(weak_topics) if weak_topics else 'None identified'
-            strong_list = ', '.join(strong_topics) if strong_topics else 'None identified'
-            scores_list = ', '.join([f'{score}' for score in recent_scores]) if recent_scores else 'No scores yet'
-            context_text = context if context else 'None'
+            # Use Snowflake Cortex COMPLETE function
+            query = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{CORTEX_MODEL}', %(prompt)s) as response"
+            params = {'prompt': prompt}
 
-            prompt = f"""You are an AI tutor analyzing a student's performance. Generate personalized study recommendations.
+            collect_rows = self._start(
+                "query", {"query": query, "params": params}, query, params, estimate_tokens(prompt), timeout
+            )
+        except Exception as e:
+            print(f"Snowflake Cortex AI error: {str(e)}")
+            return basic
+
+        def collect() -> Dict[str, Any]:
+            try:
+                rows = collect_rows()
+                result = rows[0] if rows else None
+
+                if result and result[0]:
+                    return self._parse_recommendations(result[0], weak_topics)
+
+                # Fallback to basic recommendations
+                return basic()
+
+            except Exception as e:
+                print(f"Snowflake Cortex AI error: {str(e)}")
+                # Fallback to basic recommendations
+                return basic()
+
+        return collect
+
+    def _recommendation_prompt(
+        self,
+        weak_topics: List[str],
+        strong_topics: List[str],
+        recent_scores: List[float],
+        context: str = ""
+    ) -> str:
+        """Cortex prompt shared by live and batch recommendation generation"""
+        # Note: Avoid % signs in f-strings to prevent SQL formatting issues
+        weak_list = ', '.join(weak_topics) if weak_topics else 'None identified'
+        strong_list = ', '.join(strong_topics) if strong_topics else 'None identified'
+        scores_list = ', '.join([f'{score}' for score in recent_scores]) if recent_scores else 'No scores yet'
+        context_text = context if context else 'None'
+
+        return f"""You are an AI tutor analyzing a student's performance. Generate personalized study recommendations.
 
 Student Performance Data:
 - Weak Topics: {weak_list}
@@ -104,47 +338,74 @@ Format as JSON:
     "priority_topics": ["topic 1", "topic 2"]
 }}"""
 
-            # Use Snowflake Cortex COMPLETE function
-            # Using mixtral-8x7b which is available in most regions
-            # Available models: mistral-7b, mixtral-8x7b, llama2-70b-chat, llama3-8b, llama3-70b
-            query = "SELECT SNOWFLAKE.CORTEX.COMPLETE('mixtral-8x7b', %(prompt)s) as response"
+    def _parse_recommendations(self, response_text: str, weak_topics: List[str]) -> Dict[str, Any]:
+        """Cortex output as a recommendations dict (wrapping free text if it isn't JSON)"""
+        try:
+            return json.loads(response_text)
+        except json.JSONDecodeError:
+            return {
+                "recommendations": [
+                    f"Focus on {topic}" for topic in weak_topics[:3]
+                ],
+                "study_plan": response_text,
+                "estimated_hours": len(weak_topics) * 2,
+                "priority_topics": weak_topics[:3]
+            }
 
-            cursor.execute(query, {'prompt': prompt})
-            result = cursor.fetchone()
+    def batch_study_recommendations(self, students: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Generate recommendations for many students with one set-based Cortex call
 
-            if result and result[0]:
-                # Parse the response
-                response_text = result[0]
-                # Extract JSON from response
-                try:
-                    # Try to parse as JSON
-                    recommendations = json.loads(response_text)
-                except:
-                    # If not valid JSON, create structured response
-                    recommendations = {
-                        "recommendations": [
-                            f"Focus on {topic}" for topic in weak_topics[:3]
-                        ],
-                        "study_plan": response_text,
-                        "estimated_hours": len(weak_topics) * 2,
-                        "priority_topics": weak_topics[:3]
-                    }
+        Args:
+            students: {key: generate_study_recommendations kwargs}
 
-                cursor.close()
-                conn.close()
+        Returns:
+            {key: recommendations} for every student Cortex answered
+        """
+        return self.start_batch_study_recommendations(students)()
 
-                return recommendations
+    def start_batch_study_recommendations(
+        self,
+        students: Dict[str, Dict[str, Any]],
+        timeout: Optional[float] = None
+    ) -> Callable[[], Dict[str, Dict[str, Any]]]:
+        """
+        Start a set-based Cortex call for many students and return a function that
+        waits for the results (see batch_study_recommendations)
 
-            cursor.close()
-            conn.close()
+        The prompts are sent as one JSON array and completed with a single
+        SELECT ... SNOWFLAKE.CORTEX.COMPLETE(model, prompt) FROM TABLE(FLATTEN(...)),
+        so Snowflake parallelizes the work instead of us issuing one query per student.
+        """
+        if not self.enabled or not self.use_cortex or not students:
+            return lambda: {}
 
-            # Fallback to basic recommendations
-            return self._generate_basic_recommendations(weak_topics, strong_topics, recent_scores)
+        prompts = {key: self._recommendation_prompt(**inputs) for key, inputs in students.items()}
+        query = f"""
+            SELECT
+                staged.value:student_key::STRING,
+                SNOWFLAKE.CORTEX.COMPLETE('{CORTEX_MODEL}', staged.value:prompt::STRING)
+            FROM TABLE(FLATTEN(INPUT => PARSE_JSON(%s))) staged
+        """
+        params = (json.dumps([{"student_key": key, "prompt": prompt} for key, prompt in prompts.items()]),)
+
+        collect_rows = self._start(
+            "batch_complete",
+            {"model": CORTEX_MODEL, "prompts": prompts},
+            query,
+            params,
+            sum(estimate_tokens(prompt) for prompt in prompts.values()),
+            timeout or settings.SNOWFLAKE_BATCH_TIMEOUT_SECONDS
+        )
 
-        except Exception as e:
-            print(f"Snowflake Cortex AI error: {str(e)}")
-            # Fallback to basic recommendations
-            return self._generate_basic_recommendations(weak_topics, strong_topics, recent_scores)
+        def collect() -> Dict[str, Dict[str, Any]]:
+            return {
+                key: self._parse_recommendations(response_text, students[key].get("weak_topics") or [])
+                for key, response_text in collect_rows()
+                if key in students and response_text
+            }
+
+        return collect
 
     def _generate_basic_recommendations(
         self,
@@ -197,51 +458,84 @@ Format as JSON:
     def vector_similarity_search(
         self,
         query_embedding: List[float],
+        course_id: Optional[str] = None,
+        upload_ids: Optional[List[str]] = None,
+        standard_course_code: Optional[str] = None,
         embeddings_table: str = "document_embeddings",
         top_k: int = 5
     ) -> List[Dict[str, Any]]:
         """
         Use Snowflake's vector similarity search (fallback for Gemini quota issues)
 
+        The search is always scoped to a course (and/or the shared embeddings of its
+        standard course code), so Snowflake prunes micro-partitions via the
+        course_id clustering key instead of scanning every tenant's chunks.
+
         Args:
             query_embedding: Vector embedding of the query
+            course_id: Only chunks of this course
+            upload_ids: Only chunks of these uploads
+            standard_course_code: Also chunks shared under this code (e.g. "CSCI-335")
             embeddings_table: Name of the table containing embeddings
             top_k: Number of top results to return
 
         Returns:
-            List of {text, similarity_score, metadata}
+            List of {text, similarity_score, file_name, chunk_index, course_id, upload_id}
         """
+        if not course_id and not standard_course_code:
+            raise ValueError("vector_similarity_search needs a course_id or standard_course_code")
+
         if not self.enabled:
             return []
 
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            params = {
+                "table": embeddings_table,
+                "embedding": json.dumps(query_embedding),
+                "top_k": max(1, int(top_k))
+            }
+
+            scopes = []
+            if course_id:
+                scopes.append("course_id = %(course_id)s")
+                params["course_id"] = str(course_id)
+            if standard_course_code:
+                scopes.append("standard_course_code = %(standard_course_code)s")
+                params["standard_course_code"] = standard_course_code
+            predicates = [f"({' OR '.join(scopes)})"]
+
+            if upload_ids:
+                placeholders = []
+                for i, upload_id in enumerate(upload_ids):
+                    params[f"upload_id_{i}"] = str(upload_id)
+                    placeholders.append(f"%(upload_id_{i})s")
+                predicates.append(f"upload_id IN ({', '.join(placeholders)})")
 
             # Use Snowflake's VECTOR_COSINE_SIMILARITY function
             query = f"""
             SELECT
                 chunk_text,
-                VECTOR_COSINE_SIMILARITY(embedding, PARSE_JSON(%s)::VECTOR(FLOAT, 768)) as similarity_score,
+                VECTOR_COSINE_SIMILARITY(embedding, PARSE_JSON(%(embedding)s)::VECTOR(FLOAT, 768)) as similarity_score,
                 file_name,
-                chunk_index
-            FROM {embeddings_table}
+                chunk_index,
+                course_id,
+                upload_id
+            FROM IDENTIFIER(%(table)s)
+            WHERE {' AND '.join(predicates)}
             ORDER BY similarity_score DESC
-            LIMIT {top_k};
+            LIMIT %(top_k)s;
             """
 
-            cursor.execute(query, (json.dumps(query_embedding),))
-            results = cursor.fetchall()
-
-            cursor.close()
-            conn.close()
+            results = self._query(query, params)
 
             return [
                 {
                     "text": row[0],
                     "similarity_score": float(row[1]),
                     "file_name": row[2],
-                    "chunk_index": row[3]
+                    "chunk_index": row[3],
+                    "course_id": row[4],
+                    "upload_id": row[5]
                 }
                 for row in results
             ]
@@ -0,0 +1,97 @@
+"""
+Sentence-pipelined text-to-speech for streamed LLM responses
+Instead of waiting for the full answer and then the full MP3, the LLM stream is
+split into sentences and each sentence is synthesized as soon as it is complete,
+while later sentences are still being generated. Audio comes back in sentence
+order, so time-to-first-audio is roughly one sentence of generation plus one
+short synthesis.
+"""
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple
+
+from app.core.config import settings
+from app.services.usage_meter import usage_meter
+
+# A sentence ends at . ! ? (optionally followed by closing quotes/brackets) and whitespace
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+# Very short sentences ("Oh!", "Wow!") are merged into the next one to avoid
+# paying TTS round-trip latency for a single word
+MIN_SENTENCE_CHARS = 20
+
+
+def iter_sentences(chunks: Iterable[str], min_chars: int = MIN_SENTENCE_CHARS) -> Iterator[str]:
+    """Re-chunk a stream of text deltas into whole sentences"""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk or ""
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(buffer):
+            sentence = buffer[start:match.end()].strip()
+            if len(sentence) >= min_chars:
+                yield sentence
+                start = match.end()
+        buffer = buffer[start:]
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def pipeline_speech(
+    sentences: Iterable[str],
+    synthesize: Callable[[str], bytes],
+    max_workers: int = None
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Synthesize sentences concurrently with their generation, yielding
+    (sentence, audio) in order
+
+    The sentence iterator (usually wrapping an LLM stream) is consumed on a
+    background thread, so synthesis of sentence N overlaps generation of
+    sentence N+1. At most max_workers syntheses run at once.
+    """
+    max_workers = max_workers or settings.VOICE_STREAM_TTS_CONCURRENCY
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+    finished = object()
+
+    source = iter(sentences)
+
+    def produce():
+        try:
+            for sentence in source:
+                if stop.is_set():
+                    break
+                pending.put((sentence, executor.submit(usage_meter.attributed(synthesize), sentence)))
+        except Exception as e:
+            pending.put(e)
+        finally:
+            pending.put(finished)
+            # Closed on this thread (a running generator can't be closed from another),
+            # which ends the underlying LLM stream once the client has gone
+            close = getattr(source, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    print(f"Error closing sentence stream: {str(e)}")
+
+    threading.Thread(target=usage_meter.attributed(produce), daemon=True).start()
+
+    try:
+        while True:
+            item = pending.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            sentence, future = item
+            yield sentence, future.result()
+    finally:
+        stop.set()
+        # Syntheses not started yet are dropped; nobody is left to play them
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,153 @@
+"""
+Study recommendations: precomputed nightly, cached live
+A nightly batch job (precompute_recommendations.py) builds the recommendation
+inputs of every recently active user from their rollups and generates all of
+their plans with set-based Cortex calls, storing them in study_recommendations.
+The API serves a stored plan when it was built from the user's current inputs;
+otherwise it goes through the fingerprint cache (a stored but outdated plan is
+served stale while it is regenerated), and only users the batch hasn't seen yet
+wait for live generation.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Callable
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.models.course import Course
+from app.models.analytics_rollup import UserPerformanceRollup
+from app.models.study_recommendation import StudyRecommendation
+from app.services.analytics_rollup_service import top_topics
+from app.services.recommendation_cache import recommendation_cache, fingerprint
+from app.services.snowflake_service import snowflake_service
+
+
+class StudyRecommendationService:
+    def user_inputs(self, rollup: UserPerformanceRollup, num_courses: int) -> Dict[str, Any]:
+        """generate_study_recommendations arguments for a user, from their rollup"""
+        return {
+            "weak_topics": top_topics(rollup.weak_topic_counts, 5),
+            "strong_topics": top_topics(rollup.strong_topic_counts, 5),
+            "recent_scores": [attempt["score"] for attempt in rollup.recent_attempts[:10]],
+            "context": f"Student has taken {rollup.attempt_count} quizzes across {num_courses} courses"
+        }
+
+    def get_for_user(self, db: Session, user_id: UUID, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Recommendations for a user: precomputed if current, else cached/live"""
+        scope = ("user", str(user_id))
+        stored = db.query(StudyRecommendation).filter(StudyRecommendation.user_id == user_id).first()
+
+        if stored is not None:
+            if stored.fingerprint == fingerprint(inputs):
+                return stored.data
+            # Outdated plan: serve it while the cache regenerates in the background
+            age = (datetime.now(timezone.utc) - stored.generated_at).total_seconds()
+            recommendation_cache.seed(scope, stored.fingerprint, stored.data, age)
+
+        return recommendation_cache.get(
+            scope,
+            inputs,
+            lambda: snowflake_service.generate_study_recommendations(**inputs)
+        )
+
+    def precompute(self, active_days: int = None, batch_size: int = None) -> int:
+        """
+        Generate and store recommendations for every recently active user whose
+        inputs changed since their last stored plan
+
+        Returns:
+            Number of plans written
+        """
+        active_days = active_days or settings.RECOMMENDATION_BATCH_ACTIVE_DAYS
+        batch_size = batch_size or settings.RECOMMENDATION_BATCH_SIZE
+        since = datetime.now(timezone.utc) - timedelta(days=active_days)
+
+        db = SessionLocal()
+        try:
+            user_ids = [
+                user_id for user_id, in db.query(UserPerformanceRollup.user_id).filter(
+                    UserPerformanceRollup.updated_at >= since,
+                    UserPerformanceRollup.attempt_count > 0
+                ).all()
+            ]
+
+            # While Snowflake completes one batch, the next batch's inputs are read
+            # from Postgres and the previous batch's plans are written back
+            written = 0
+            pending = None
+            for start in range(0, len(user_ids), batch_size):
+                students, fingerprints = self._batch_inputs(db, user_ids[start:start + batch_size])
+                started = self._start_batch(students)
+                if pending:
+                    written += self._store_batch(db, *pending)
+                pending = (started, fingerprints)
+            if pending:
+                written += self._store_batch(db, *pending)
+            return written
+        finally:
+            db.close()
+
+    def _batch_inputs(self, db: Session, user_ids: List[UUID]):
+        """Recommendation inputs of the users whose topics/scores changed since their stored plan"""
+        rollups = db.query(UserPerformanceRollup).filter(UserPerformanceRollup.user_id.in_(user_ids)).all()
+        course_counts = dict(
+            db.query(Course.user_id, func.count(Course.id)).filter(
+                Course.user_id.in_(user_ids)
+            ).group_by(Course.user_id).all()
+        )
+        stored = dict(
+            db.query(StudyRecommendation.user_id, StudyRecommendation.fingerprint).filter(
+                StudyRecommendation.user_id.in_(user_ids)
+            ).all()
+        )
+
+        students = {}
+        fingerprints = {}
+        for rollup in rollups:
+            inputs = self.user_inputs(rollup, course_counts.get(rollup.user_id, 0))
+            key = str(rollup.user_id)
+            fingerprints[key] = fingerprint(inputs)
+            if stored.get(rollup.user_id) != fingerprints[key]:
+                students[key] = inputs
+        return students, fingerprints
+
+    def _start_batch(self, students: Dict[str, Dict[str, Any]]) -> Callable[[], Dict[str, Dict[str, Any]]]:
+        try:
+            return snowflake_service.start_batch_study_recommendations(students)
+        except Exception as e:
+            print(f"Error precomputing study recommendations: {str(e)}")
+            return lambda: {}
+
+    def _store_batch(
+        self,
+        db: Session,
+        collect: Callable[[], Dict[str, Dict[str, Any]]],
+        fingerprints: Dict[str, str]
+    ) -> int:
+        """Wait for a batch's plans and upsert them"""
+        try:
+            results = collect()
+        except Exception as e:
+            print(f"Error precomputing study recommendations: {str(e)}")
+            return 0
+
+        for key, data in results.items():
+            statement = insert(StudyRecommendation.__table__).values(
+                user_id=UUID(key),
+                fingerprint=fingerprints[key],
+                data=data
+            )
+            db.execute(statement.on_conflict_do_update(
+                index_elements=["user_id"],
+                set_={"fingerprint": fingerprints[key], "data": data, "generated_at": func.now()}
+            ))
+        db.commit()
+        return len(results)
+
+
+# Singleton instance
+study_recommendation_service = StudyRecommendationService()
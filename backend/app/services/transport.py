@@ -0,0 +1,223 @@
+"""
+Record/replay transport for external AI calls
+Every provider call made by the Gemini, DigitalOcean, Snowflake and ElevenLabs
+services goes through `provider_transport`, which can:
+- live:   call the provider (default)
+- record: call the provider and persist request -> response in a content-addressed store
+- replay: serve responses from the store only (no network, deterministic), optionally
+          sleeping for the recorded latency so load tests stay realistic
+- auto:   replay when a recording exists, otherwise call and record
+
+This makes load tests and benchmarks reproducible and offline.
+
+Each call is also metered (tokens, latency, outcome) and checked against the
+caller's daily budget by usage_meter, whatever the mode.
+"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from app.core.config import settings
+from app.services.usage_meter import usage_meter
+
+MODES = ("live", "record", "replay", "auto")
+
+
+class ReplayMissError(Exception):
+    """Replay mode was asked for a call that was never recorded"""
+
+
+class RecordedResponse:
+    """Minimal HTTP response (status + JSON body) that can be stored and replayed"""
+
+    def __init__(self, status_code: int, body: Any = None):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self) -> Any:
+        return self._body
+
+
+def _encode(value: Any) -> Any:
+    """Make a provider response JSON-storable (bytes and RecordedResponse are tagged)"""
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, RecordedResponse):
+        return {"__response__": {"status_code": value.status_code, "body": value.json()}}
+    return value
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "__bytes__" in value:
+            return base64.b64decode(value["__bytes__"])
+        if "__response__" in value:
+            return RecordedResponse(value["__response__"]["status_code"], value["__response__"]["body"])
+    return value
+
+
+class ProviderTransport:
+    def __init__(self, mode: str = "live", store_dir: str = "./recordings", latency_scale: float = 0.0):
+        if mode not in MODES:
+            raise ValueError(f"AI_TRANSPORT_MODE must be one of {', '.join(MODES)}")
+        self.mode = mode
+        self.store_dir = store_dir
+        self.latency_scale = latency_scale
+
+    @property
+    def replaying(self) -> bool:
+        """
+        True when every response comes from the store, so provider credentials
+        aren't needed. Auto mode still calls providers on a recording miss, so
+        services keep their real configuration checks there.
+        """
+        return self.mode == "replay"
+
+    def request_key(self, provider: str, operation: str, request: Dict[str, Any]) -> str:
+        """Content address of a call: sha256 of its canonical JSON form"""
+        canonical = json.dumps(
+            {"provider": provider, "operation": operation, "request": request},
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path(self, provider: str, key: str) -> str:
+        return os.path.join(self.store_dir, provider, key[:2], f"{key}.json")
+
+    def _load(self, provider: str, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(provider, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _save(self, provider: str, operation: str, key: str, request: Dict[str, Any], entry: Dict[str, Any]):
+        path = self._path(provider, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry.update({
+            "provider": provider,
+            "operation": operation,
+            "request": request,
+            "recorded_at": datetime.utcnow().isoformat()
+        })
+        # Write atomically so concurrent recorders never leave a torn file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f, default=str)
+        os.replace(tmp_path, path)
+
+    def _simulate_latency(self, seconds: float):
+        if self.latency_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.latency_scale)
+
+    def _recording(self, provider: str, operation: str, key: str) -> Optional[Dict[str, Any]]:
+        """Stored entry to replay, or None if the call should go to the provider"""
+        if self.mode == "live" or self.mode == "record":
+            return None
+        entry = self._load(provider, key)
+        if entry is None and self.mode == "replay":
+            raise ReplayMissError(f"No recording for {provider}.{operation} ({key[:12]})")
+        return entry
+
+    def call(self, provider: str, operation: str, request: Dict[str, Any], send: Callable[[], Any]) -> Any:
+        """
+        Perform (or replay) a provider call
+
+        Args:
+            provider: gemini, digitalocean, snowflake or elevenlabs
+            operation: Call type, e.g. "generate_content"
+            request: Everything that determines the response (never credentials)
+            send: Makes the real call; its result must be JSON-serializable, bytes
+                  or a RecordedResponse
+
+        Raises:
+            UsageBudgetExceededError: the user the call is made for has no budget left
+        """
+        with usage_meter.metered(provider, operation, request) as metered:
+            metered.response = self._call(provider, operation, request, send)
+            return metered.response
+
+    def _call(self, provider: str, operation: str, request: Dict[str, Any], send: Callable[[], Any]) -> Any:
+        if self.mode == "live":
+            return send()
+
+        key = self.request_key(provider, operation, request)
+        entry = self._recording(provider, operation, key)
+        if entry is not None:
+            self._simulate_latency(entry.get("latency_seconds", 0.0))
+            return _decode(entry["response"])
+
+        started = time.monotonic()
+        response = send()
+        self._save(provider, operation, key, request, {
+            "response": _encode(response),
+            "latency_seconds": time.monotonic() - started
+        })
+        return response
+
+    def stream(
+        self,
+        provider: str,
+        operation: str,
+        request: Dict[str, Any],
+        send: Callable[[], Iterator[str]]
+    ) -> Iterator[str]:
+        """
+        Streaming variant of call() for text streams
+        Chunk boundaries and per-chunk timing are recorded so replays stream the same way.
+        """
+        with usage_meter.metered(provider, operation, request) as metered:
+            for chunk in self._stream(provider, operation, request, send):
+                metered.add_output(chunk)
+                yield chunk
+
+    def _stream(
+        self,
+        provider: str,
+        operation: str,
+        request: Dict[str, Any],
+        send: Callable[[], Iterator[str]]
+    ) -> Iterator[str]:
+        if self.mode == "live":
+            yield from send()
+            return
+
+        key = self.request_key(provider, operation, request)
+        entry = self._recording(provider, operation, key)
+        if entry is not None:
+            for chunk, delay in zip(entry["chunks"], entry["chunk_delays"]):
+                self._simulate_latency(delay)
+                yield chunk
+            return
+
+        chunks = []
+        delays = []
+        last = time.monotonic()
+        for chunk in send():
+            now = time.monotonic()
+            chunks.append(chunk)
+            delays.append(now - last)
+            last = now
+            yield chunk
+
+        # Only complete streams are recorded
+        self._save(provider, operation, key, request, {
+            "chunks": chunks,
+            "chunk_delays": delays,
+            "latency_seconds": sum(delays)
+        })
+
+
+# Singleton instance
+provider_transport = ProviderTransport(
+    mode=settings.AI_TRANSPORT_MODE,
+    store_dir=settings.AI_TRANSPORT_STORE_DIR,
+    latency_scale=settings.AI_TRANSPORT_REPLAY_LATENCY_SCALE
+)
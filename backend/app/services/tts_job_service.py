@@ -0,0 +1,179 @@
+"""
+Asynchronous text-to-speech jobs
+Long tutor responses can take many seconds to synthesize. Instead of holding an
+HTTP connection (and a request worker) for that long, clients submit a job, get
+its id back immediately, and either poll for it or receive a webhook when it
+finishes. Jobs run on a bounded worker pool and their audio goes to the audio
+store, where it is served by id.
+
+Callback URLs must resolve to public addresses (or hosts in TTS_JOB_CALLBACK_HOSTS)
+so the server can't be pointed at itself, cloud metadata or private networks.
+"""
+import ipaddress
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.services.audio_store import audio_store
+from app.services.usage_meter import usage_meter
+from app.services.voice_service import voice_service
+
+
+class TTSQueueFullError(Exception):
+    """Too many TTS jobs are already queued"""
+
+
+class InvalidCallbackURLError(ValueError):
+    """callback_url is not an http(s) URL on an allowed, public host"""
+
+
+def check_callback_url(url: str):
+    """
+    Reject callback URLs the server must not POST to
+
+    Raises:
+        InvalidCallbackURLError: not http(s), host not in TTS_JOB_CALLBACK_HOSTS (when
+            set), or the host resolves to a loopback, link-local, private or reserved address
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise InvalidCallbackURLError("callback_url must be an http(s) URL")
+
+    host = parsed.hostname.lower()
+    allowed_hosts = {h.strip().lower() for h in settings.TTS_JOB_CALLBACK_HOSTS.split(",") if h.strip()}
+    if allowed_hosts and host not in allowed_hosts:
+        raise InvalidCallbackURLError(f"callback_url host {host} is not allowed")
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or None)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise InvalidCallbackURLError(f"callback_url host {host} does not resolve")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global:
+            raise InvalidCallbackURLError(f"callback_url host {host} resolves to a non-public address")
+
+
+class TTSJobService:
+    def __init__(self, max_workers: int = 4, max_pending: int = 100, ttl_seconds: int = 3600):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-job")
+        self._jobs = TTLCache(maxsize=max_pending * 20, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def submit(
+        self,
+        user_id: str,
+        text: str,
+        emotion: str = "neutral",
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Queue a synthesis job and return it (status "queued", or "completed"
+        straight away when the audio is already in the store)
+
+        Raises:
+            InvalidCallbackURLError: see check_callback_url
+            TTSQueueFullError: max_pending jobs are already queued
+        """
+        if callback_url:
+            check_callback_url(callback_url)
+
+        emotion_settings = voice_service.get_emotional_voice_settings(emotion)
+        audio_id = voice_service.speech_key(text=text, **emotion_settings)
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "status": "queued",
+            "emotion": emotion,
+            "characters": len(text),
+            "audio_id": audio_id,
+            "callback_url": callback_url,
+            "error": None,
+            "created_at": datetime.utcnow().isoformat(),
+            "completed_at": None
+        }
+
+        if audio_store.exists(audio_id):
+            job["status"] = "completed"
+            job["completed_at"] = job["created_at"]
+            self._jobs.set(job["id"], job)
+            if callback_url:
+                # Deliver off the request thread, like callbacks for synthesized jobs
+                self._executor.submit(self._notify, job)
+            return dict(job)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise TTSQueueFullError(f"{self._pending} text-to-speech jobs already queued")
+            self._pending += 1
+
+        self._jobs.set(job["id"], job)
+        self._executor.submit(usage_meter.attributed(self._run), job, text, emotion_settings)
+        return dict(job)
+
+    def get(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """A job owned by user_id, or None"""
+        job = self._jobs.get(job_id)
+        if not job or job["user_id"] != user_id:
+            return None
+        return dict(job)
+
+    def _run(self, job: Dict[str, Any], text: str, emotion_settings: Dict[str, Any]):
+        try:
+            job["status"] = "running"
+            voice_service.text_to_speech(text=text, **emotion_settings)
+            job["status"] = "completed"
+        except Exception as e:
+            print(f"Error in text-to-speech job {job['id']}: {str(e)}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["completed_at"] = datetime.utcnow().isoformat()
+            with self._lock:
+                self._pending -= 1
+
+        self._notify(job)
+
+    def _notify(self, job: Dict[str, Any]):
+        """POST the finished job to its callback URL (best effort, one retry)"""
+        if not job.get("callback_url"):
+            return
+
+        # Resolved again at delivery time, in case the host's DNS changed since submission
+        try:
+            check_callback_url(job["callback_url"])
+        except InvalidCallbackURLError as e:
+            print(f"Not delivering text-to-speech job callback {job['id']}: {str(e)}")
+            return
+
+        payload = {key: value for key, value in job.items() if key not in ("user_id", "callback_url")}
+        for _ in range(2):
+            try:
+                response = requests.post(
+                    job["callback_url"],
+                    json=payload,
+                    timeout=settings.TTS_JOB_CALLBACK_TIMEOUT_SECONDS,
+                    allow_redirects=False  # A redirect could point at an internal address
+                )
+                if response.status_code < 500:
+                    return
+            except Exception as e:
+                print(f"Error delivering text-to-speech job callback {job['id']}: {str(e)}")
+
+
+# Singleton instance
+tts_job_service = TTSJobService(
+    max_workers=settings.TTS_JOB_WORKERS,
+    max_pending=settings.TTS_JOB_MAX_PENDING,
+    ttl_seconds=settings.TTS_JOB_TTL_SECONDS
+)
@@ -0,0 +1,414 @@
+"""
+Provider usage metering
+Every AI provider call (through provider_transport, plus live asynchronous
+Snowflake queries) is recorded as a UsageEvent: the user and endpoint it was
+made for, input/output tokens, characters synthesized, latency and outcome.
+- Attribution is a context variable set per request by the API middleware; work
+  handed to worker threads keeps it when wrapped with attributed()
+- Events are queued in memory and written in batches by a background thread
+  (every USAGE_FLUSH_INTERVAL_SECONDS, sooner once USAGE_FLUSH_BATCH_SIZE are pending)
+- Per-user daily budgets (tokens, and characters for ElevenLabs) are checked
+  before each call; an exhausted budget rejects the call without reaching the provider
+
+Token counts are the provider's own where the response reports them (OpenRouter
+`usage`), otherwise estimated at ~4 characters per token like the rate limiter's.
+Budget totals are kept per process, seeded from the table on a user's first call
+of the day, so with several workers a user can overshoot by what the other
+workers spent since.
+"""
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.models.usage_event import UsageEvent
+from app.models.user import User
+from app.services.rate_limiter import ProviderUnavailableError, estimate_tokens
+
+# (user_id, endpoint) the current provider calls are made for
+_attribution: ContextVar[Tuple[Optional[UUID], Optional[str]]] = ContextVar(
+    "usage_attribution", default=(None, None)
+)
+
+# Columns each top-consumer grouping reports
+GROUPINGS = {
+    "user": (UsageEvent.user_id, User.email),
+    "endpoint": (UsageEvent.endpoint,),
+    "provider": (UsageEvent.provider, UsageEvent.operation)
+}
+
+
+class UsageBudgetExceededError(ProviderUnavailableError):
+    """The user's daily AI budget is spent; retry_after is the time until it resets"""
+
+
+def _text_tokens(value: Any) -> int:
+    """Estimated tokens in the text of a request or result (nested dicts/lists, model names excluded)"""
+    if isinstance(value, str):
+        return estimate_tokens(value)
+    if isinstance(value, dict):
+        return sum(_text_tokens(item) for key, item in value.items() if key != "model")
+    if isinstance(value, (list, tuple)):
+        return sum(_text_tokens(item) for item in value)
+    return 0
+
+
+def measure(provider: str, request: Dict[str, Any], response: Any = None) -> Dict[str, int]:
+    """input_tokens, output_tokens and characters of one provider call"""
+    if provider == "elevenlabs":
+        return {"input_tokens": 0, "output_tokens": 0, "characters": len(request.get("text") or "")}
+
+    input_tokens = _text_tokens(request)
+    output_tokens = 0
+    if isinstance(response, str):
+        output_tokens = estimate_tokens(response)
+    elif isinstance(response, list):
+        # Snowflake rows; a Gemini embedding is a list of floats and has no text output
+        output_tokens = _text_tokens([row for row in response if isinstance(row, (list, tuple))])
+    elif hasattr(response, "json"):
+        # DigitalOcean RecordedResponse: OpenRouter reports usage, embeddings may not
+        body = response.json()
+        if isinstance(body, dict):
+            usage = body.get("usage") or {}
+            if usage.get("prompt_tokens") is not None:
+                input_tokens = usage["prompt_tokens"]
+            if usage.get("completion_tokens") is not None:
+                output_tokens = usage["completion_tokens"]
+            else:
+                output_tokens = _text_tokens([
+                    (choice.get("message") or {}).get("content") for choice in body.get("choices") or []
+                ])
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens, "characters": 0}
+
+
+def _outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, UsageBudgetExceededError):
+        return "over_budget"
+    if isinstance(error, ProviderUnavailableError):
+        return "rejected"  # Rate limited, circuit open or pool exhausted
+    if isinstance(error, GeneratorExit):
+        return "cancelled"  # Stream abandoned by the client
+    return "error"
+
+
+def _seconds_until_reset() -> float:
+    now = datetime.now(timezone.utc)
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return (tomorrow - now).total_seconds()
+
+
+class MeteredCall:
+    """A provider call in progress; finish() records it (once)"""
+
+    def __init__(self, meter: "UsageMeter", provider: str, operation: str, request: Dict[str, Any]):
+        self.meter = meter
+        self.provider = provider
+        self.operation = operation
+        self.request = request
+        self.user_id, self.endpoint = _attribution.get()
+        self.response = None
+        self._started = time.monotonic()
+        self._streamed_chars = 0
+        self._finished = False
+
+    def add_output(self, chunk: str):
+        """Count a streamed text chunk towards the output tokens"""
+        self._streamed_chars += len(chunk or "")
+
+    def finish(self, response: Any = None, error: Optional[BaseException] = None):
+        if self._finished:
+            return
+        self._finished = True
+
+        outcome = _outcome(error)
+        if outcome in ("rejected", "over_budget"):
+            usage = {"input_tokens": 0, "output_tokens": 0, "characters": 0}  # Never reached the provider
+        else:
+            usage = measure(self.provider, self.request, response)
+            usage["output_tokens"] += self._streamed_chars // 4
+
+        self.meter.record({
+            "user_id": self.user_id,
+            "endpoint": self.endpoint,
+            "provider": self.provider,
+            "operation": self.operation[:200],
+            "latency_ms": int((time.monotonic() - self._started) * 1000),
+            "outcome": outcome,
+            "created_at": datetime.now(timezone.utc),
+            **usage
+        })
+
+
+class UsageMeter:
+    def __init__(
+        self,
+        enabled: bool = True,
+        flush_interval: float = 5.0,
+        batch_size: int = 200,
+        max_pending: int = 10000,
+        daily_token_budget: int = 0,
+        daily_character_budget: int = 0
+    ):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.daily_token_budget = daily_token_budget
+        self.daily_character_budget = daily_character_budget
+
+        self._lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        # (user_id, UTC date) -> {"tokens", "characters"} spent that day
+        self._spent = TTLCache(maxsize=50000, ttl_seconds=2 * 24 * 3600)
+
+        self.written = 0
+        self.dropped = 0
+
+    @contextmanager
+    def attribute(self, user_id: Optional[UUID], endpoint: Optional[str]):
+        """Attribute provider calls made inside the block to user_id/endpoint"""
+        token = _attribution.set((user_id, endpoint))
+        try:
+            yield
+        finally:
+            _attribution.reset(token)
+
+    def attributed(self, fn: Callable) -> Callable:
+        """fn bound to the caller's attribution, for running on another thread"""
+        attribution = _attribution.get()
+
+        def run(*args, **kwargs):
+            token = _attribution.set(attribution)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _attribution.reset(token)
+
+        return run
+
+    def begin(self, provider: str, operation: str, request: Dict[str, Any]) -> MeteredCall:
+        """
+        Start metering a call, after checking the user's budget
+
+        Raises:
+            UsageBudgetExceededError: the attributed user has no budget left today
+        """
+        call = MeteredCall(self, provider, operation, request)
+        if self.enabled and call.user_id is not None:
+            retry_after = self._over_budget(call.user_id, provider)
+            if retry_after is not None:
+                error = UsageBudgetExceededError(provider, "Daily AI usage budget exhausted", retry_after)
+                call.finish(error=error)
+                raise error
+        return call
+
+    @contextmanager
+    def metered(self, provider: str, operation: str, request: Dict[str, Any]):
+        """
+        Meter the call made inside the block
+
+        Usage:
+            with usage_meter.metered("gemini", "generate_content", request) as call:
+                call.response = send()
+        """
+        call = self.begin(provider, operation, request)
+        try:
+            yield call
+        except BaseException as e:
+            call.finish(error=e)
+            raise
+        call.finish(call.response)
+
+    def record(self, event: Dict[str, Any]):
+        """Queue an event for the next batch write and count it against the user's budget"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(event)
+            full = len(self._pending) >= self.batch_size
+            if event["user_id"] is not None:
+                spent = self._spent.get((event["user_id"], event["created_at"].date()))
+                if spent is not None:
+                    spent["tokens"] += event["input_tokens"] + event["output_tokens"]
+                    spent["characters"] += event["characters"]
+
+        self._ensure_writer()
+        if full:
+            self._wake.set()
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="usage-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _run_writer(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write pending events in one multi-row insert; returns how many were written"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+
+        db = SessionLocal()
+        try:
+            db.execute(insert(UsageEvent.__table__), batch)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error writing usage events: {str(e)}")
+            # Keep them for the next flush, as far as the pending limit allows
+            with self._lock:
+                keep = batch[:max(0, self.max_pending - len(self._pending))]
+                self._pending[:0] = keep
+                self.dropped += len(batch) - len(keep)
+            return 0
+        finally:
+            db.close()
+
+        with self._lock:
+            self.written += len(batch)
+        return len(batch)
+
+    def _spent_today(self, user_id: UUID) -> Dict[str, int]:
+        key = (user_id, datetime.now(timezone.utc).date())
+        spent = self._spent.get(key)
+        if spent is not None:
+            return spent
+
+        # First call of the day in this process: start from what the table holds
+        start = datetime.combine(key[1], datetime.min.time(), tzinfo=timezone.utc)
+        db = SessionLocal()
+        try:
+            row = db.query(
+                func.coalesce(func.sum(UsageEvent.input_tokens + UsageEvent.output_tokens), 0),
+                func.coalesce(func.sum(UsageEvent.characters), 0)
+            ).filter(UsageEvent.user_id == user_id, UsageEvent.created_at >= start).one()
+            loaded = {"tokens": int(row[0]), "characters": int(row[1])}
+        except Exception as e:
+            print(f"Error loading usage for budget check: {str(e)}")
+            loaded = {"tokens": 0, "characters": 0}
+        finally:
+            db.close()
+
+        with self._lock:
+            spent = self._spent.get(key)
+            if spent is None:
+                spent = loaded
+                self._spent.set(key, spent)
+            return spent
+
+    def _over_budget(self, user_id: UUID, provider: str) -> Optional[float]:
+        """Seconds until the budget resets if user_id has none left for provider, else None"""
+        if provider == "elevenlabs":
+            budget, kind = self.daily_character_budget, "characters"
+        else:
+            budget, kind = self.daily_token_budget, "tokens"
+        if budget <= 0:
+            return None
+        if self._spent_today(user_id)[kind] < budget:
+            return None
+        return _seconds_until_reset()
+
+    def budget_status(self, user_id: UUID) -> Dict[str, Any]:
+        """Today's spend against the daily budgets (None = unlimited)"""
+        spent = dict(self._spent_today(user_id))
+        return {
+            "tokens_used": spent["tokens"],
+            "token_budget": self.daily_token_budget or None,
+            "characters_used": spent["characters"],
+            "character_budget": self.daily_character_budget or None,
+            "resets_in_seconds": int(_seconds_until_reset())
+        }
+
+    def top_consumers(
+        self,
+        db: Session,
+        group_by: str,
+        since: datetime,
+        limit: int = 20,
+        provider: Optional[str] = None,
+        user_id: Optional[UUID] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Usage since `since` grouped by user, endpoint or provider, heaviest first
+        (by tokens, then characters synthesized)
+        """
+        columns = GROUPINGS[group_by]
+        tokens = func.sum(UsageEvent.input_tokens + UsageEvent.output_tokens)
+        characters = func.sum(UsageEvent.characters)
+
+        query = db.query(
+            *columns,
+            func.count(UsageEvent.id).label("calls"),
+            func.sum(UsageEvent.input_tokens).label("input_tokens"),
+            func.sum(UsageEvent.output_tokens).label("output_tokens"),
+            characters.label("characters"),
+            func.count(UsageEvent.id).filter(UsageEvent.outcome != "ok").label("failed_calls"),
+            func.avg(UsageEvent.latency_ms).label("avg_latency_ms"),
+            func.percentile_cont(0.95).within_group(UsageEvent.latency_ms).label("p95_latency_ms")
+        ).filter(UsageEvent.created_at >= since)
+        if group_by == "user":
+            query = query.outerjoin(User, User.id == UsageEvent.user_id)
+        if provider:
+            query = query.filter(UsageEvent.provider == provider)
+        if user_id is not None:
+            query = query.filter(UsageEvent.user_id == user_id)
+
+        rows = query.group_by(*columns).order_by(tokens.desc(), characters.desc()).limit(limit).all()
+
+        results = []
+        for row in rows:
+            result = row._asdict()
+            if "user_id" in result:
+                result["user_id"] = str(result["user_id"]) if result["user_id"] else None
+            result["avg_latency_ms"] = round(float(result["avg_latency_ms"] or 0), 1)
+            result["p95_latency_ms"] = round(float(result["p95_latency_ms"] or 0), 1)
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Writer state for status endpoints"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending_events": len(self._pending),
+                "written_events": self.written,
+                "dropped_events": self.dropped
+            }
+
+
+# Singleton instance
+usage_meter = UsageMeter(
+    enabled=settings.USAGE_METERING_ENABLED,
+    flush_interval=settings.USAGE_FLUSH_INTERVAL_SECONDS,
+    batch_size=settings.USAGE_FLUSH_BATCH_SIZE,
+    max_pending=settings.USAGE_MAX_PENDING_EVENTS,
+    daily_token_budget=settings.USAGE_DAILY_TOKEN_BUDGET,
+    daily_character_budget=settings.USAGE_DAILY_CHARACTER_BUDGET
+)
@@ -1,7 +1,14 @@
 from elevenlabs import generate, Voice, VoiceSettings
 from app.core.config import settings
+from app.services.rate_limiter import get_provider_guard, ProviderUnavailableError
+from app.services.transport import provider_transport
+from app.services.audio_store import audio_store, audio_key
+from typing import Any, Dict
 import os
 
+DEFAULT_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"  # Sarah - friendly, warm voice
+TTS_MODEL = "eleven_multilingual_v2"
+
 
 class VoiceService:
     def __init__(self):
@@ -9,11 +16,12 @@ class VoiceService:
         self.api_key = settings.ELEVENLABS_API_KEY
         if self.api_key and self.api_key != "your_elevenlabs_api_key_here":
             os.environ["ELEVEN_API_KEY"] = self.api_key
+        self.guard = get_provider_guard("elevenlabs")
 
     def text_to_speech(
         self,
         text: str,
-        voice_id: str = "EXAVITQu4vr4xnSDxMaL",  # Sarah - friendly, warm voice
+        voice_id: str = DEFAULT_VOICE_ID,
         stability: float = 0.5,
         similarity_boost: float = 0.75,
         style: float = 0.0,
@@ -40,11 +48,78 @@ class VoiceService:
             Audio bytes (MP3 format)
         """
 
-        if not self.api_key or self.api_key == "your_elevenlabs_api_key_here":
+        request = self._speech_request(text, voice_id, stability, similarity_boost, style, use_speaker_boost)
+
+        # Identical synthesis requests are served from the on-disk audio cache
+        key = audio_key(request)
+        cached = audio_store.get(key)
+        if cached is not None:
+            return cached
+
+        if not provider_transport.replaying and (
+            not self.api_key or self.api_key == "your_elevenlabs_api_key_here"
+        ):
             raise ValueError("ElevenLabs API key not configured")
 
         try:
-            audio = generate(
+            audio = provider_transport.call("elevenlabs", "generate", request, lambda: self._synthesize(**request))
+        except ProviderUnavailableError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error generating speech: {str(e)}")
+
+        try:
+            audio_store.put(key, audio)
+        except OSError as e:
+            print(f"Error caching speech audio: {str(e)}")
+        return audio
+
+    def speech_key(
+        self,
+        text: str,
+        voice_id: str = DEFAULT_VOICE_ID,
+        stability: float = 0.5,
+        similarity_boost: float = 0.75,
+        style: float = 0.0,
+        use_speaker_boost: bool = True
+    ) -> str:
+        """Audio store key (and ETag) of the audio text_to_speech returns for these arguments"""
+        return audio_key(self._speech_request(text, voice_id, stability, similarity_boost, style, use_speaker_boost))
+
+    def _speech_request(
+        self,
+        text: str,
+        voice_id: str,
+        stability: float,
+        similarity_boost: float,
+        style: float,
+        use_speaker_boost: bool
+    ) -> Dict[str, Any]:
+        """Everything that determines the synthesized audio"""
+        return {
+            "text": text,
+            "voice_id": voice_id,
+            "stability": stability,
+            "similarity_boost": similarity_boost,
+            "style": style,
+            "use_speaker_boost": use_speaker_boost,
+            "model": TTS_MODEL
+        }
+
+    def _synthesize(
+        self,
+        text: str,
+        voice_id: str,
+        stability: float,
+        similarity_boost: float,
+        style: float,
+        use_speaker_boost: bool,
+        model: str
+    ) -> bytes:
+        """Call ElevenLabs through the shared rate limiter/circuit breaker"""
+        # ElevenLabs quota is measured in characters, so budget by text length
+        with self.guard.slot(tokens=len(text)):
+            return generate(
                 text=text,
                 voice=Voice(
                     voice_id=voice_id,
@@ -55,14 +130,9 @@ class VoiceService:
                         use_speaker_boost=use_speaker_boost
                     )
                 ),
-                model="eleven_multilingual_v2"
+                model=model
             )
 
-            return audio
-
-        except Exception as e:
-            raise Exception(f"Error generating speech: {str(e)}")
-
     def get_emotional_voice_settings(self, emotion: str = "neutral"):
         """
         Get voice settings based on desired emotion
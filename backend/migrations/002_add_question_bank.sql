@@ -0,0 +1,18 @@
+-- Migration: Add question_bank_items table
+-- Stores questions generated per upload at ingest time so quizzes can be sampled
+-- without a live LLM call
+-- Date: 2026-10-19
+
+CREATE TABLE IF NOT EXISTS question_bank_items (
+    id UUID PRIMARY KEY,
+    upload_id UUID NOT NULL REFERENCES uploads(id) ON DELETE CASCADE,
+    question JSONB NOT NULL,
+    topic VARCHAR,
+    difficulty VARCHAR,
+    times_served INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+-- Sampling filters by upload and prefers the least-served questions
+CREATE INDEX IF NOT EXISTS ix_question_bank_items_upload_id ON question_bank_items(upload_id);
+CREATE INDEX IF NOT EXISTS idx_question_bank_items_upload_served ON question_bank_items(upload_id, times_served);
@@ -0,0 +1,5 @@
+-- Migration: Add audio column to quizzes table
+-- Holds the audio ids of pre-synthesized question/explanation audio
+-- Date: 2026-10-19
+
+ALTER TABLE quizzes ADD COLUMN IF NOT EXISTS audio JSONB;
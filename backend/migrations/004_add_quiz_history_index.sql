@@ -0,0 +1,10 @@
+-- Migration: Quiz history without N+1 queries
+-- Stores the question count on quizzes (so history needn't load the questions JSONB)
+-- and indexes attempts for keyset pagination on (completed_at, id) per user
+-- Date: 2026-10-19
+
+ALTER TABLE quizzes ADD COLUMN IF NOT EXISTS num_questions INTEGER;
+
+UPDATE quizzes SET num_questions = jsonb_array_length(questions) WHERE num_questions IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_quiz_attempts_user_completed ON quiz_attempts(user_id, completed_at, id);
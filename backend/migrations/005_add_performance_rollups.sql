@@ -0,0 +1,32 @@
+-- Migration: Add analytics rollup tables
+-- Per user x course and per user running quiz statistics, updated when a quiz is
+-- submitted so analytics reads a single row instead of every attempt
+-- Date: 2026-10-19
+
+CREATE TABLE IF NOT EXISTS course_performance_rollups (
+    user_id UUID NOT NULL REFERENCES users(id),
+    course_id UUID NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+    attempt_count INTEGER NOT NULL DEFAULT 0,
+    score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    score_min DOUBLE PRECISION,
+    score_max DOUBLE PRECISION,
+    time_taken_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    weak_topic_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    strong_topic_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    recent_attempts JSONB NOT NULL DEFAULT '[]'::jsonb,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (user_id, course_id)
+);
+
+CREATE TABLE IF NOT EXISTS user_performance_rollups (
+    user_id UUID PRIMARY KEY REFERENCES users(id),
+    attempt_count INTEGER NOT NULL DEFAULT 0,
+    score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    score_min DOUBLE PRECISION,
+    score_max DOUBLE PRECISION,
+    time_taken_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    weak_topic_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    strong_topic_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    recent_attempts JSONB NOT NULL DEFAULT '[]'::jsonb,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
@@ -0,0 +1,13 @@
+-- Migration: Add study_recommendations table
+-- Recommendations precomputed by the nightly batch job (precompute_recommendations.py)
+-- Date: 2026-10-19
+
+CREATE TABLE IF NOT EXISTS study_recommendations (
+    user_id UUID PRIMARY KEY REFERENCES users(id),
+    fingerprint VARCHAR NOT NULL,
+    data JSONB NOT NULL,
+    generated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+-- The batch job selects recently active users from their rollups
+CREATE INDEX IF NOT EXISTS idx_user_performance_rollups_updated_at ON user_performance_rollups(updated_at);
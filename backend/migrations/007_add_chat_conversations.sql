@@ -0,0 +1,16 @@
+-- Migration: Add chat_conversations table
+-- Per user x course x session tutor chat history: recent turns verbatim plus a
+-- rolling summary of older turns, so chat prompts stay bounded
+-- Date: 2026-10-19
+
+CREATE TABLE IF NOT EXISTS chat_conversations (
+    user_id UUID NOT NULL REFERENCES users(id),
+    course_id UUID NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+    session_id VARCHAR NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    recent_turns JSONB NOT NULL DEFAULT '[]'::jsonb,
+    summarized_turns INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (user_id, course_id, session_id)
+);
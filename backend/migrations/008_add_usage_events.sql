@@ -0,0 +1,21 @@
+-- Migration: Add usage_events table
+-- Append-only log of metered AI provider calls (tokens, characters synthesized,
+-- latency, outcome) per user and endpoint, for budgets and top-consumer queries
+-- Date: 2026-10-19
+
+CREATE TABLE IF NOT EXISTS usage_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID REFERENCES users(id),
+    endpoint VARCHAR,
+    provider VARCHAR NOT NULL,
+    operation VARCHAR NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    characters INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER NOT NULL DEFAULT 0,
+    outcome VARCHAR NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_usage_events_user_created ON usage_events(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_usage_events_created ON usage_events(created_at);
@@ -0,0 +1,17 @@
+"""
+Nightly study recommendation precompute
+Run from cron (e.g. `0 3 * * * python precompute_recommendations.py`) to
+regenerate the plans of recently active users in set-based Cortex batches
+"""
+import sys
+
+from app.services.study_recommendation_service import study_recommendation_service
+
+def precompute_recommendations(active_days: int = None):
+    """Generate and store study recommendations for recently active users"""
+    print("Precomputing study recommendations...")
+    written = study_recommendation_service.precompute(active_days=active_days)
+    print(f"✅ Stored {written} study recommendation plan(s)")
+
+if __name__ == "__main__":
+    precompute_recommendations(int(sys.argv[1]) if len(sys.argv) > 1 else None)
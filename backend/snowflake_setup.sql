@@ -23,6 +23,23 @@ GRANT USAGE ON DATABASE CLASSROOM_AI TO ROLE ACCOUNTADMIN;
 GRANT USAGE ON SCHEMA CLASSROOM_AI.PUBLIC TO ROLE ACCOUNTADMIN;
 GRANT ALL ON WAREHOUSE COMPUTE_WH TO ROLE ACCOUNTADMIN;
 
+-- Chunk embeddings for vector similarity search (fallback for Gemini quota issues)
+-- Clustered on course so course-scoped searches prune micro-partitions
+-- instead of scanning every course's chunks
+CREATE TABLE IF NOT EXISTS CLASSROOM_AI.PUBLIC.DOCUMENT_EMBEDDINGS (
+    course_id STRING NOT NULL,
+    upload_id STRING NOT NULL,
+    standard_course_code STRING,  -- e.g. "CSCI-335", for embeddings shared across sections
+    file_name STRING,
+    chunk_index INTEGER,
+    chunk_text STRING,
+    embedding VECTOR(FLOAT, 768)
+)
+CLUSTER BY (course_id);
+
+-- Existing tables: add the clustering key
+ALTER TABLE CLASSROOM_AI.PUBLIC.DOCUMENT_EMBEDDINGS CLUSTER BY (course_id);
+
 -- Verify it worked
 SHOW DATABASES;
 SHOW WAREHOUSES;
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Run from anywhere: make the backend's `app` package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Required settings, so app modules import without a .env
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/cortexiq_test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
@@ -0,0 +1,59 @@
+import json
+
+from app.services.json_stream import JSONArrayStreamParser, iter_json_array, parse_json_array
+
+MULTILINE = '''```json
+[
+  {"question": "What is 2+2?", "answer": "4", "explanation": "Simple addition."},
+  {"question": "Name the powerhouse of the cell", "answer": "Mitochondria", "explanation": "It produces ATP.
+It is found in most eukaryotic cells.
+	Some cells have thousands."},
+  {"question": "Is water wet?", "answer": "Yes", "explanation": "Contains a \\"quoted\\" word and a [bracket] and a }."}
+]
+```'''
+
+
+def test_multiline_strings_are_kept():
+    questions, malformed = parse_json_array(MULTILINE)
+    assert malformed == 0
+    assert questions == json.loads(MULTILINE.strip("`json\n"), strict=False)
+    assert "\n" in questions[1]["explanation"]
+
+
+def test_multiline_strings_when_streamed_char_by_char():
+    questions = list(iter_json_array(iter(MULTILINE)))
+    assert [q["answer"] for q in questions] == ["4", "Mitochondria", "Yes"]
+
+
+def test_malformed_middle_element_only_loses_that_element():
+    text = '''Here you go:
+[
+  {"question": "A", "answer": "1"},
+  {"question": "B" "answer": "2"},
+  {"question": "C", "answer": "3",},
+  {"question": "D", "answer": "4"},
+  {"question": "E", "answer": "5"}
+]'''
+    questions, malformed = parse_json_array(text)
+    assert [q["question"] for q in questions] == ["A", "D", "E"]
+    assert malformed == 2
+
+
+def test_truncated_output_keeps_complete_elements():
+    text = '[{"question": "A", "answer": "1"}, {"question": "B", "answer": "2"}, {"question": "C", "expl'
+    questions, malformed = parse_json_array(text)
+    assert [q["question"] for q in questions] == ["A", "B"]
+    assert malformed == 1
+
+
+def test_truncated_inside_multiline_string():
+    parser = JSONArrayStreamParser()
+    questions = parser.feed('[{"question": "A"}, {"question": "B", "explanation": "line one\nline tw')
+    assert questions == [{"question": "A"}]
+    assert parser.truncated
+    assert not parser.done
+
+
+def test_prose_and_brackets_before_array_are_skipped():
+    text = 'Questions [below]:\n[{"question": "A"}]\ntrailing [junk]'
+    assert parse_json_array(text) == ([{"question": "A"}], 0)
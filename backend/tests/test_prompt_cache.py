@@ -0,0 +1,103 @@
+import types
+
+import pytest
+
+from app.core import cache
+from app.services.prompt_cache import REFRESH_MARGIN_SECONDS, FAILURE_BACKOFF_SECONDS, PromptPrefixCache
+
+INSTRUCTIONS = "You are a patient tutor. " * 20
+MATERIAL = "Photosynthesis converts light energy into chemical energy. " * 20
+
+
+class StubProvider:
+    """Context-cache provider that hands out numbered handles, optionally failing"""
+
+    supported = True
+
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    def create(self, model_name, system_instruction, content, ttl_seconds):
+        self.calls.append((model_name, system_instruction, content, ttl_seconds))
+        if self.fail:
+            raise RuntimeError("caching unavailable")
+        return f"handle-{len(self.calls)}"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock for the TTL caches; advance with clock.now += seconds"""
+    fake = types.SimpleNamespace(now=1000.0)
+    fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(cache, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def provider():
+    return StubProvider()
+
+
+@pytest.fixture
+def prompt_cache(provider, clock):
+    return PromptPrefixCache(provider, ttl_seconds=600, min_tokens=10)
+
+
+def test_creates_a_cache_for_a_new_prefix(prompt_cache, provider):
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) == "handle-1"
+    assert provider.calls == [("gemini", INSTRUCTIONS, MATERIAL, 600)]
+    assert prompt_cache.stats()["created"] == 1
+
+
+def test_reuses_the_cache_within_the_ttl(prompt_cache, provider, clock):
+    prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL)
+    clock.now += 600 - REFRESH_MARGIN_SECONDS - 1
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) == "handle-1"
+    assert len(provider.calls) == 1
+    assert prompt_cache.stats()["hits"] == 1
+
+
+def test_different_prefixes_get_their_own_cache(prompt_cache, provider):
+    prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL)
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, "Other material. " * 40) == "handle-2"
+    assert prompt_cache.model_for("other-model", INSTRUCTIONS, MATERIAL) == "handle-3"
+
+
+def test_recreates_the_cache_before_the_provider_expires_it(prompt_cache, provider, clock):
+    prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL)
+    clock.now += 600 - REFRESH_MARGIN_SECONDS
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) == "handle-2"
+    assert len(provider.calls) == 2
+
+
+def test_invalidated_cache_is_recreated(prompt_cache, provider):
+    prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL)
+    prompt_cache.invalidate("gemini", INSTRUCTIONS, MATERIAL)
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) == "handle-2"
+
+
+def test_falls_back_when_the_provider_raises(prompt_cache, provider, clock):
+    provider.fail = True
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) is None
+
+    # Not retried while backing off
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) is None
+    assert len(provider.calls) == 1
+    assert prompt_cache.stats()["fallbacks"] == 2
+
+    provider.fail = False
+    clock.now += FAILURE_BACKOFF_SECONDS
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) == "handle-2"
+
+
+def test_short_prefixes_are_not_cached(prompt_cache, provider):
+    assert prompt_cache.model_for("gemini", "Be brief.", "") is None
+    assert provider.calls == []
+
+
+def test_unsupported_provider_is_not_used(prompt_cache, provider):
+    provider.supported = False
+    assert not prompt_cache.enabled
+    assert prompt_cache.model_for("gemini", INSTRUCTIONS, MATERIAL) is None
+    assert provider.calls == []